@@ -0,0 +1,705 @@
+#!/usr/bin/env python3
+"""Discrete-event simulation of a cybershake campaign for planning purposes.
+
+Uses the per realisation estimates from estimate_cybershake, the ProcessType
+dependency graph and the per machine job limits (n_runs) from the platform config
+to predict how long the campaign will take, how well each machine is used and which
+chain of tasks determines the total run time (critical path).
+
+The submission behaviour of auto_submit is mirrored, i.e. runnable tasks are picked
+in the order of the priority policy (mgmt db order by default), every submitted job
+(queued or running) counts towards the n_runs limit of its target machine and failed
+attempts are retried as new db entries.
+
+Comparing the simulations with different priority policies (--compare_policies)
+allows to evaluate the policies before using them with auto_submit.
+"""
+import heapq
+import os
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+import qcore.constants as const
+import qcore.simulation_structure as sim_struct
+
+from workflow.automation.lib.MgmtDB import ComparisonOperator
+from workflow.automation.lib.task_priority import (
+    DEFAULT_RUN_TIME,
+    PriorityPolicy,
+    TaskCosts,
+    TaskPrioritiser,
+)
+from workflow.automation.lib.shared_automated_workflow import (
+    parse_config_file,
+    run_name_matches,
+)
+from workflow.automation.platform_config import (
+    HPC,
+    get_target_machine,
+    platform_config,
+)
+
+# Core count used for tasks that have no estimation model
+DEFAULT_N_CORES = 1
+
+# Tasks that are set to completed by auto_submit without submitting a job
+INSTANT_PROCESSES = [const.ProcessType.NO_VM_PERT]
+
+# Reasons for a task on the critical path having started when it did
+REASON_START = "start"
+REASON_DEPENDENCY = "dependency"
+REASON_QUEUE = "queue"
+REASON_RETRY = "retry"
+
+
+@dataclass
+class SimTask:
+    """A single attempt at running a task in the simulation"""
+
+    run_name: str
+    proc_type: const.ProcessType
+    machine: HPC
+    run_time: float
+    n_cores: float
+    order: int
+    attempt: int = 0
+    # Sort key of the priority policy, see TaskPrioritiser.key
+    priority: Tuple = ()
+    ready_time: float = None
+    start_time: float = None
+    end_time: float = None
+    failed: bool = False
+    # The task attempt whose completion allowed this task to become runnable
+    ready_by: "SimTask" = field(default=None, repr=False)
+    # The task attempt whose completion freed the n_runs slot this task used
+    slot_from: "SimTask" = field(default=None, repr=False)
+
+    def __lt__(self, other):
+        return (self.priority, self.order) < (other.priority, other.order)
+
+
+@dataclass
+class CampaignSimulation:
+    """Results of a campaign simulation, all times are in hours"""
+
+    makespan: float
+    n_runs: Dict[HPC, int]
+    machine_utilisation: Dict[HPC, float]
+    machine_core_hours: Dict[HPC, float]
+    critical_path: List[Tuple[str, str, float, float, str]]
+    tasks: List[SimTask]
+    n_unfinished: int
+
+    def to_dataframe(self):
+        """Returns one row per simulated task attempt"""
+        return pd.DataFrame(
+            [
+                (
+                    task.run_name,
+                    task.proc_type.str_value,
+                    task.machine.name,
+                    task.attempt,
+                    task.ready_time,
+                    task.start_time,
+                    task.end_time,
+                    task.failed,
+                )
+                for task in self.tasks
+            ],
+            columns=[
+                "run_name",
+                "proc_type",
+                "machine",
+                "attempt",
+                "ready_time",
+                "start_time",
+                "end_time",
+                "failed",
+            ],
+        )
+
+
+def get_task_list(
+    run_names: Iterable[str], task_config
+) -> List[Tuple[str, const.ProcessType]]:
+    """Gets all (run_name, process) pairs that the task config would run,
+    in the same order as the tasks are populated in the mgmt db"""
+    tasks_n, tasks_to_match, tasks_to_not_match = parse_config_file(task_config)
+    selection = [(tasks_n, "%", ComparisonOperator.LIKE)]
+    selection.extend(
+        (tasks, pattern, ComparisonOperator.LIKE) for pattern, tasks in tasks_to_match
+    )
+    selection.extend(
+        (tasks, pattern, ComparisonOperator.NOTLIKE)
+        for pattern, tasks in tasks_to_not_match
+    )
+
+    task_list = []
+    for run_name in run_names:
+        run_procs = set()
+        for tasks, pattern, matcher in selection:
+            if run_name_matches(run_name, pattern, matcher):
+                run_procs.update(tasks)
+        task_list.extend(
+            (run_name, proc)
+            for proc in sorted(run_procs, key=lambda proc_type: proc_type.value)
+        )
+    return task_list
+
+
+def get_task_estimates(estimation_df: pd.DataFrame):
+    """Gets the run time (hours) and number of cores for each realisation and
+    process type from the estimation dataframe.
+    Medians (fault names) that are not in the dataframe use the mean of the faults
+    realisations."""
+    est_procs = [
+        proc
+        for proc in const.ProcessType
+        if (proc.str_value, const.MetadataField.run_time.value) in estimation_df.columns
+    ]
+    fault_means = estimation_df.groupby(level=0).mean(numeric_only=True)
+
+    estimates = {}
+    for (fault_name, run_name), row in estimation_df.iterrows():
+        for proc in est_procs:
+            estimates[(run_name, proc)] = (
+                row[proc.str_value, const.MetadataField.run_time.value],
+                row[proc.str_value, const.MetadataField.n_cores.value],
+            )
+    for fault_name, row in fault_means.iterrows():
+        for proc in est_procs:
+            estimates.setdefault(
+                (fault_name, proc),
+                (
+                    row[proc.str_value, const.MetadataField.run_time.value],
+                    row[proc.str_value, const.MetadataField.n_cores.value],
+                ),
+            )
+    return estimates
+
+
+def get_task_costs(estimation_df: pd.DataFrame) -> TaskCosts:
+    """Gets the estimated run time (hours) of each task with an estimate,
+    as used by the priority policies"""
+    return _get_task_costs(get_task_estimates(estimation_df))
+
+
+def _get_task_costs(estimates: Dict) -> TaskCosts:
+    return {
+        key: float(run_time)
+        for key, (run_time, _) in estimates.items()
+        if not np.isnan(run_time)
+    }
+
+
+def simulate_campaign(
+    estimation_df: pd.DataFrame,
+    task_config,
+    n_runs: Dict[HPC, int] = None,
+    n_max_retries: int = 2,
+    failure_rate: float = 0.0,
+    queue_wait: float = 0.0,
+    default_run_time: float = DEFAULT_RUN_TIME,
+    seed: int = None,
+    priority_policy: PriorityPolicy = PriorityPolicy.db_order,
+    fair_share: bool = False,
+) -> CampaignSimulation:
+    """Simulates the execution of the cybershake campaign
+
+    Parameters
+    ----------
+    estimation_df: pd.DataFrame
+        The per realisation estimation, as returned by estimate_cybershake.main
+    task_config: str or dict
+        The task config (e.g. task_config_CS.yaml) or its loaded content
+    n_runs: Dict[HPC, int], optional
+        The maximum number of submitted jobs per machine,
+        defaults to the DEFAULT_N_RUNS of the platform config
+    n_max_retries: int, optional
+        The maximum number of attempts for each task
+    failure_rate: float, optional
+        The probability of any attempt failing, a failed attempt uses its full run time
+    queue_wait: float, optional
+        The time (hours) each job waits in the scheduler queue before starting
+    default_run_time: float, optional
+        The run time (hours) for tasks without an estimate
+    seed: int, optional
+        Seed for the failure sampling
+    priority_policy: PriorityPolicy, optional
+        The order in which runnable tasks are submitted, the policy uses the
+        same run time estimates as the simulation
+    fair_share: bool, optional
+        Submit the tasks of the faults with the fewest submitted jobs first
+
+    Returns
+    -------
+    CampaignSimulation
+    """
+    if n_runs is None:
+        n_runs = {
+            HPC[hpc]: count
+            for hpc, count in platform_config[
+                const.PLATFORM_CONFIG.DEFAULT_N_RUNS.name
+            ].items()
+        }
+    rng = np.random.default_rng(seed)
+
+    rel_names = list(estimation_df.index.get_level_values(1))
+    run_names = list(dict.fromkeys(list(estimation_df.index.unique(0)) + rel_names))
+    task_list = get_task_list(run_names, task_config)
+    estimates = get_task_estimates(estimation_df)
+    prioritiser = TaskPrioritiser(
+        priority_policy,
+        _get_task_costs(estimates),
+        {proc for _, proc in task_list},
+        default_run_time,
+    )
+
+    # Dependencies on processes that are not part of the campaign are considered met
+    run_procs = defaultdict(set)
+    for run_name, proc in task_list:
+        run_procs[run_name].add(proc.value)
+    completed = {
+        run_name: {proc.value for proc in const.ProcessType} - procs
+        for run_name, procs in run_procs.items()
+    }
+    rels_of_median = defaultdict(list)
+    for run_name in run_procs.keys():
+        median = sim_struct.get_fault_from_realisation(run_name)
+        if median != run_name:
+            rels_of_median[median].append(run_name)
+
+    def dependencies_met(task: SimTask):
+        median = sim_struct.get_fault_from_realisation(task.run_name)
+        median_completed = completed.get(
+            median, {proc.value for proc in const.ProcessType}
+        )
+        completed_deps = [
+            const.Dependency(proc, dependency_target=const.DependencyTarget.REL)
+            for proc in completed[task.run_name]
+        ] + [
+            const.Dependency(proc, dependency_target=const.DependencyTarget.MEDIAN)
+            for proc in median_completed
+        ]
+        return len(task.proc_type.get_remaining_dependencies(completed_deps)) == 0
+
+    waiting = defaultdict(list)
+    for order, (run_name, proc) in enumerate(task_list):
+        run_time, n_cores = estimates.get((run_name, proc), (np.nan, np.nan))
+        if proc in INSTANT_PROCESSES:
+            run_time = 0.0
+        waiting[run_name].append(
+            SimTask(
+                run_name,
+                proc,
+                get_target_machine(proc),
+                default_run_time if np.isnan(run_time) else float(run_time),
+                DEFAULT_N_CORES if np.isnan(n_cores) else float(n_cores),
+                order,
+                priority=prioritiser.key(run_name, proc),
+            )
+        )
+    next_order = len(task_list)
+
+    # The ready tasks of each machine, by fault
+    ready = {hpc: defaultdict(list) for hpc in n_runs.keys()}
+    # The number of submitted (queued or running) jobs of each fault, for fair share
+    fault_submitted = defaultdict(int)
+    free_slots = dict(n_runs)
+    # The most recent task to free a slot on each machine, used for the critical path
+    slot_releasers = {hpc: [] for hpc in n_runs.keys()}
+    events = []
+    all_tasks = []
+
+    def push_ready(task: SimTask):
+        heapq.heappush(
+            ready[task.machine][sim_struct.get_fault_from_realisation(task.run_name)],
+            task,
+        )
+
+    def pop_ready(hpc: HPC):
+        """Pops the next task to submit to the machine, as auto_submit would"""
+        fault = min(
+            (fault for fault, fault_ready in ready[hpc].items() if fault_ready),
+            key=lambda fault: (
+                fault_submitted[fault] if fair_share else 0,
+                ready[hpc][fault][0].priority,
+                ready[hpc][fault][0].order,
+            ),
+            default=None,
+        )
+        return None if fault is None else heapq.heappop(ready[hpc][fault])
+
+    def release_ready(run_name: str, cur_time: float, finished: SimTask):
+        still_waiting = []
+        for task in waiting[run_name]:
+            if dependencies_met(task):
+                task.ready_time = cur_time
+                task.ready_by = finished
+                push_ready(task)
+            else:
+                still_waiting.append(task)
+        waiting[run_name] = still_waiting
+
+    for run_name in list(waiting.keys()):
+        release_ready(run_name, 0.0, None)
+
+    cur_time = 0.0
+    while True:
+        for hpc in ready.keys():
+            while free_slots[hpc] > 0:
+                task = pop_ready(hpc)
+                if task is None:
+                    break
+                free_slots[hpc] -= 1
+                fault_submitted[
+                    sim_struct.get_fault_from_realisation(task.run_name)
+                ] += 1
+                task.slot_from = (
+                    slot_releasers[hpc].pop() if slot_releasers[hpc] else None
+                )
+                wait = 0.0 if task.proc_type in INSTANT_PROCESSES else queue_wait
+                task.start_time = cur_time + wait
+                task.end_time = task.start_time + task.run_time
+                all_tasks.append(task)
+                heapq.heappush(events, (task.end_time, task.order, task))
+
+        if not events:
+            break
+
+        cur_time, _, task = heapq.heappop(events)
+        free_slots[task.machine] += 1
+        fault_submitted[sim_struct.get_fault_from_realisation(task.run_name)] -= 1
+        slot_releasers[task.machine].append(task)
+
+        task.failed = rng.random() < failure_rate
+        if task.failed:
+            if task.attempt + 1 < n_max_retries:
+                retry = SimTask(
+                    task.run_name,
+                    task.proc_type,
+                    task.machine,
+                    task.run_time,
+                    task.n_cores,
+                    next_order,
+                    attempt=task.attempt + 1,
+                    priority=task.priority,
+                    ready_time=cur_time,
+                    ready_by=task,
+                )
+                next_order += 1
+                push_ready(retry)
+            continue
+
+        completed[task.run_name].add(task.proc_type.value)
+        release_ready(task.run_name, cur_time, task)
+        for rel_name in rels_of_median.get(task.run_name, []):
+            release_ready(rel_name, cur_time, task)
+
+    makespan = max((task.end_time for task in all_tasks), default=0.0)
+    busy_time, core_hours = defaultdict(float), defaultdict(float)
+    for task in all_tasks:
+        busy_time[task.machine] += (
+            task.end_time
+            - task.start_time
+            + (0.0 if task.proc_type in INSTANT_PROCESSES else queue_wait)
+        )
+        core_hours[task.machine] += task.run_time * task.n_cores
+
+    return CampaignSimulation(
+        makespan=makespan,
+        n_runs=n_runs,
+        machine_utilisation={
+            hpc: busy_time[hpc] / (count * makespan) if makespan > 0 else 0.0
+            for hpc, count in n_runs.items()
+        },
+        machine_core_hours={hpc: core_hours[hpc] for hpc in n_runs.keys()},
+        critical_path=get_critical_path(all_tasks),
+        tasks=all_tasks,
+        n_unfinished=sum(len(tasks) for tasks in waiting.values())
+        + sum(
+            len(fault_ready)
+            for hpc_ready in ready.values()
+            for fault_ready in hpc_ready.values()
+        ),
+    )
+
+
+def compare_priority_policies(
+    estimation_df: pd.DataFrame,
+    task_config,
+    policies: Iterable[PriorityPolicy] = tuple(PriorityPolicy),
+    fair_share_options: Iterable[bool] = (False, True),
+    **simulation_kwargs,
+) -> pd.DataFrame:
+    """Simulates the campaign with each combination of priority policy and fair share.
+    The simulation_kwargs are passed to simulate_campaign
+
+    Returns a dataframe with one row per combination, with the makespan, the mean
+    utilisation of the machines and the mean and maximum time (hours) to complete
+    a realisation (all its tasks)
+    """
+    rows = []
+    for policy in policies:
+        for fair_share in fair_share_options:
+            simulation = simulate_campaign(
+                estimation_df,
+                task_config,
+                priority_policy=policy,
+                fair_share=fair_share,
+                **simulation_kwargs,
+            )
+            completion_times = (
+                simulation.to_dataframe().groupby("run_name")["end_time"].max()
+            )
+            rows.append(
+                (
+                    policy.value,
+                    fair_share,
+                    simulation.makespan,
+                    np.mean(list(simulation.machine_utilisation.values())),
+                    completion_times.mean(),
+                    completion_times.max(),
+                    simulation.n_unfinished,
+                )
+            )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "policy",
+            "fair_share",
+            "makespan",
+            "mean_utilisation",
+            "mean_completion_time",
+            "max_completion_time",
+            "n_unfinished",
+        ],
+    )
+
+
+def get_critical_path(tasks: List[SimTask]):
+    """Traces back from the last task to finish, following whatever delayed the
+    start of each task (a dependency, a free n_runs slot or a failed attempt).
+    Returns a list of (run_name, process, start, end, reason) in execution order."""
+    if len(tasks) == 0:
+        return []
+    task = max(tasks, key=lambda cur_task: cur_task.end_time)
+    path = []
+    while task is not None:
+        if task.slot_from is not None and task.slot_from.end_time > task.ready_time:
+            reason, previous = REASON_QUEUE, task.slot_from
+        elif task.ready_by is not None:
+            reason = REASON_RETRY if task.attempt > 0 else REASON_DEPENDENCY
+            previous = task.ready_by
+        else:
+            reason, previous = REASON_START, None
+        path.append(
+            (
+                task.run_name,
+                task.proc_type.str_value,
+                task.start_time,
+                task.end_time,
+                reason,
+            )
+        )
+        task = previous
+    return path[::-1]
+
+
+def display_simulation(simulation: CampaignSimulation, verbose: bool = False):
+    """Prints the simulation results"""
+    print(
+        "n_runs: {}, makespan: {:.2f} hours ({:.2f} days)".format(
+            ", ".join(
+                f"{hpc.name}={count}" for hpc, count in simulation.n_runs.items()
+            ),
+            simulation.makespan,
+            simulation.makespan / 24,
+        )
+    )
+    for hpc in simulation.n_runs.keys():
+        print(
+            "{:>12}: utilisation {:6.2f}%, {:12.2f} core hours".format(
+                hpc.name,
+                simulation.machine_utilisation[hpc] * 100,
+                simulation.machine_core_hours[hpc],
+            )
+        )
+    if simulation.n_unfinished > 0:
+        print(
+            f"{simulation.n_unfinished} tasks did not run, "
+            f"their dependencies failed too many times"
+        )
+    if verbose:
+        print("Critical path:")
+        for run_name, proc_type, start, end, reason in simulation.critical_path:
+            print(
+                "{:>30} {:>15} {:10.2f} -> {:10.2f} ({})".format(
+                    run_name, proc_type, start, end, reason
+                )
+            )
+    print()
+
+
+def load_estimation_df(estimation_file: str):
+    """Loads the dataframe saved by estimate_cybershake.py --output"""
+    return pd.read_csv(estimation_file, index_col=[0, 1], header=[0, 1])
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument(
+        "root_dir", type=str, help="The absolute path to the cybershake root directory."
+    )
+    parser.add_argument(
+        "task_config",
+        type=str,
+        nargs="?",
+        default=os.path.join(
+            platform_config[const.PLATFORM_CONFIG.EXAMPLES_DIR.name],
+            "task_config.yaml",
+        ),
+        help="The task config that would be given to run_cybershake.py",
+    )
+    parser.add_argument(
+        "--estimation_file",
+        type=str,
+        default=None,
+        help="A dataframe saved by estimate_cybershake.py --output. "
+        "If not given the estimation is run.",
+    )
+    parser.add_argument(
+        "--n_runs",
+        default=None,
+        type=int,
+        nargs="+",
+        help="The number of processes each machine can run at once. If a single value is given this is used for all "
+        "machines, otherwise one value per machine must be given. The current order is: {}".format(
+            list(x.name for x in HPC)
+        ),
+    )
+    parser.add_argument(
+        "--n_runs_sweep",
+        default=None,
+        type=int,
+        nargs="+",
+        help="Simulates the campaign once for each of the given values, "
+        "used for all machines. Overrides --n_runs.",
+    )
+    parser.add_argument(
+        "--n_max_retries",
+        help="The maximum number of retries for any given task",
+        default=2,
+        type=int,
+    )
+    parser.add_argument(
+        "--failure_rate",
+        type=float,
+        default=0.0,
+        help="The probability of any task attempt failing",
+    )
+    parser.add_argument(
+        "--queue_wait",
+        type=float,
+        default=0.0,
+        help="The average time (hours) jobs spend in the scheduler queue",
+    )
+    parser.add_argument(
+        "--default_run_time",
+        type=float,
+        default=DEFAULT_RUN_TIME,
+        help="Run time (hours) for the tasks that have no estimation model",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--priority_policy",
+        default=PriorityPolicy.db_order.value,
+        choices=[policy.value for policy in PriorityPolicy],
+        help="The order in which runnable tasks are submitted, see auto_submit.py",
+    )
+    parser.add_argument(
+        "--fair_share",
+        action="store_true",
+        help="Submit the tasks of the faults with the fewest submitted jobs first",
+    )
+    parser.add_argument(
+        "--compare_policies",
+        action="store_true",
+        help="Simulates the campaign with every priority policy, with and without "
+        "fair share, and prints a comparison. Overrides --priority_policy and --fair_share",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Saves the simulated task schedule (of the last simulation) as a csv",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Prints the critical path"
+    )
+    args = parser.parse_args()
+
+    if args.estimation_file is None:
+        # Avoids loading the estimation models when not needed
+        from workflow.automation.estimation.estimate_cybershake import (
+            main as est_cybershake,
+        )
+
+        estimation_df = est_cybershake(args.root_dir)
+    else:
+        estimation_df = load_estimation_df(args.estimation_file)
+
+    if args.n_runs_sweep is not None:
+        n_runs_options = [{hpc: n for hpc in HPC} for n in args.n_runs_sweep]
+    elif args.n_runs is None:
+        n_runs_options = [None]
+    elif len(args.n_runs) == 1:
+        n_runs_options = [{hpc: args.n_runs[0] for hpc in HPC}]
+    elif len(args.n_runs) == len(HPC):
+        n_runs_options = [dict(zip(HPC, args.n_runs))]
+    else:
+        parser.error(
+            "You must specify either one common value for --n_runs, or one "
+            "for each in the following list: {}".format([hpc.name for hpc in HPC])
+        )
+        sys.exit()
+
+    simulation_kwargs = dict(
+        n_max_retries=args.n_max_retries,
+        failure_rate=args.failure_rate,
+        queue_wait=args.queue_wait,
+        default_run_time=args.default_run_time,
+        seed=args.seed,
+    )
+    if args.compare_policies:
+        for n_runs in n_runs_options:
+            print(
+                compare_priority_policies(
+                    estimation_df, args.task_config, n_runs=n_runs, **simulation_kwargs
+                ).to_string(index=False)
+            )
+            print()
+        return
+
+    for n_runs in n_runs_options:
+        simulation = simulate_campaign(
+            estimation_df,
+            args.task_config,
+            n_runs=n_runs,
+            priority_policy=PriorityPolicy(args.priority_policy),
+            fair_share=args.fair_share,
+            **simulation_kwargs,
+        )
+        display_simulation(simulation, args.verbose)
+
+    if args.output is not None:
+        simulation.to_dataframe().to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import argparse
 from datetime import datetime, timedelta
 
 import qcore.constants as const
+from workflow.automation.lib.schedulers.abstractscheduler import parse_job_id
 from workflow.automation.lib.shared_automated_workflow import add_to_queue
 
 
@@ -37,9 +38,10 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "job_id",
-        type=int,
+        type=parse_job_id,
         nargs="?",
-        help="The job id. Used for setting on job queueing, used for matching on following steps",
+        help="The job id, jobid_arrayidx for tasks of job arrays. "
+        "Used for setting on job queueing, used for matching on following steps",
         default=None,
     )
     parser.add_argument(
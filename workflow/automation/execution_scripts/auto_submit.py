@@ -3,7 +3,7 @@
 import argparse
 import os
 import time
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 from datetime import datetime
 from logging import Logger
 from pathlib import Path
@@ -15,10 +15,28 @@ import qcore.simulation_structure as sim_struct
 from qcore import qclogging, utils
 
 from workflow.automation import sim_params
+from workflow.automation.estimation.simulate_cybershake import (
+    get_task_costs,
+    get_task_estimates,
+    load_estimation_df,
+)
 from workflow.automation.lib import shared_automated_workflow
-from workflow.automation.lib.MgmtDB import ComparisonOperator, MgmtDB
+from workflow.automation.lib.admission_control import (
+    AdmissionController,
+    load_budgets,
+)
+from workflow.automation.lib.MgmtDB import ComparisonOperator
+from workflow.automation.lib.job_array import ARRAY_PROCESSES, JobArrayBuilder
+from workflow.automation.lib.mgmt_db_server import connect_mgmt_db
+from workflow.automation.lib.pack_worker import (
+    END_MARGIN,
+    PACK_PROCESSES,
+    is_unpackable,
+    submit_pack_worker,
+)
 from workflow.automation.lib.schedulers.scheduler_factory import Scheduler
-from workflow.automation.metadata.log_metadata import store_metadata
+from workflow.automation.lib.task_priority import PriorityPolicy, TaskPrioritiser
+from workflow.automation.metadata.log_metadata import append_metadata
 from workflow.automation.platform_config import (
     HPC,
     get_platform_specific_script,
@@ -34,6 +52,12 @@ from workflow.automation.submit.submit_sim_imcalc import submit_im_calc_slurm
 from workflow.automation.submit.submit_vm_pert import submit_vm_pert_main
 
 AUTO_SUBMIT_LOG_FILE_NAME = "auto_submit_log_{}.txt"
+# With a priority policy or admission control, this many runnable tasks per
+# submission slot are considered
+PRIORITY_CANDIDATES_PER_SLOT = 10
+# Default allocation of a pack worker
+DEFAULT_PACK_N_CORES = 40
+DEFAULT_PACK_WCT = 2.0
 
 
 def submit_task(
@@ -44,8 +68,15 @@ def submit_task(
     parent_logger,
     retries=None,
     hf_seed=const.HF_DEFAULT_SEED,
+    job_array: JobArrayBuilder = None,
 ):
+    """Creates and submits the script of the task.
+    With a job_array, tasks of the ARRAY_PROCESSES are added to it instead of
+    being submitted"""
     task_logger = qclogging.get_task_logger(parent_logger, run_name, proc_type)
+    use_array = (
+        job_array is not None and const.ProcessType(proc_type) in ARRAY_PROCESSES
+    )
 
     # Metadata logging setup
     ch_log_dir = os.path.abspath(os.path.join(sim_dir, "ch_log"))
@@ -78,7 +109,6 @@ def submit_task(
     )
 
     submitted_time = datetime.now().strftime(const.METADATA_TIMESTAMP_FMT)
-    log_file = os.path.join(sim_dir, "ch_log", const.METADATA_LOG_FILENAME)
 
     def submit_script_to_scheduler(script_name, target_machine=None, **kwargs):
         shared_automated_workflow.submit_script_to_scheduler(
@@ -103,8 +133,8 @@ def submit_task(
             write_directory=sim_dir,
             logger=task_logger,
         )
-        store_metadata(
-            log_file,
+        append_metadata(
+            ch_log_dir,
             const.ProcessType.EMOD3D.str_value,
             {"submit_time": submitted_time},
             logger=task_logger,
@@ -120,8 +150,8 @@ def submit_task(
             write_directory=sim_dir,
             logger=task_logger,
         )
-        store_metadata(
-            log_file,
+        append_metadata(
+            ch_log_dir,
             const.ProcessType.merge_ts.str_value,
             {"submit_time": submitted_time},
             logger=task_logger,
@@ -153,8 +183,8 @@ def submit_task(
 
     elif proc_type == const.ProcessType.HF.value:
         task_logger.debug("Submit HF arguments: {}".format(run_name))
-        submit_hf_main(
-            submit=True,
+        script = submit_hf_main(
+            submit=not use_array,
             machine=get_target_machine(const.ProcessType.HF).name,
             ncores=platform_config[const.PLATFORM_CONFIG.HF_DEFAULT_NCORES.name],
             rel_dir=sim_dir,
@@ -165,16 +195,16 @@ def submit_task(
             write_directory=sim_dir,
             logger=task_logger,
         )
-        store_metadata(
-            log_file,
+        append_metadata(
+            ch_log_dir,
             const.ProcessType.HF.str_value,
             {"submit_time": submitted_time},
             logger=task_logger,
         )
     elif proc_type == const.ProcessType.BB.value:
         task_logger.debug("Submit BB arguments: {}".format(run_name))
-        submit_bb_main(
-            submit=True,
+        script = submit_bb_main(
+            submit=not use_array,
             machine=get_target_machine(const.ProcessType.BB).name,
             rel_dir=sim_dir,
             retries=retries,
@@ -182,25 +212,26 @@ def submit_task(
             write_directory=sim_dir,
             logger=task_logger,
         )
-        store_metadata(
-            log_file,
+        append_metadata(
+            ch_log_dir,
             const.ProcessType.BB.str_value,
             {"submit_time": submitted_time},
             logger=task_logger,
         )
     elif proc_type == const.ProcessType.IM_calculation.value:
-        submit_im_calc_slurm(
+        script = submit_im_calc_slurm(
             sim_dir=sim_dir,
             simple_out=True,
             retries=retries,
             target_machine=get_target_machine(const.ProcessType.IM_calculation).name,
             logger=task_logger,
+            submit=not use_array,
         )
         task_logger.debug(
             f"Submit IM calc arguments: sim_dir: {sim_dir}, simple_out: True, target_machine: {get_target_machine(const.ProcessType.IM_calculation).name}"
         )
-        store_metadata(
-            log_file,
+        append_metadata(
+            ch_log_dir,
             const.ProcessType.IM_calculation.str_value,
             {"submit_time": submitted_time},
             logger=task_logger,
@@ -329,8 +360,8 @@ def submit_task(
         task_logger.debug(
             f"Submit Advanced_IM calc arguments:sim_dir: {sim_dir}, adv_im: True, target_machine: {get_target_machine(const.ProcessType.IM_calculation).name}"
         )
-        store_metadata(
-            log_file,
+        append_metadata(
+            ch_log_dir,
             const.ProcessType.advanced_IM.str_value,
             {"submit_time": submitted_time},
             logger=task_logger,
@@ -438,7 +469,6 @@ def submit_task(
             ).name,
         )
     elif proc_type == const.ProcessType.SRF_GEN.value:
-
         realisation_yaml_path = Path(
             sim_struct.get_srf_path(root_folder, run_name)
         ).parent / (run_name + ".yaml")
@@ -464,6 +494,11 @@ def submit_task(
             target_machine=get_target_machine(const.ProcessType.SRF_GEN).name,
         )
 
+    if use_array:
+        job_array.add(
+            proc_type, run_name, sim_dir, script, get_target_machine(proc_type).name
+        )
+
     qclogging.clean_up_logger(task_logger)
 
 
@@ -476,9 +511,25 @@ def run_main_submit_loop(
     matcher: ComparisonOperator = ComparisonOperator.LIKE,
     main_logger: Logger = qclogging.get_basic_logger(),
     cycle_timeout=1,
+    prioritiser: TaskPrioritiser = None,
+    fair_share: bool = False,
+    admission_controller: AdmissionController = None,
+    job_arrays: bool = False,
+    pack_processes: List[const.ProcessType] = None,
+    pack_n_cores: int = DEFAULT_PACK_N_CORES,
+    pack_wct: float = DEFAULT_PACK_WCT,
+    pack_workers: int = 1,
 ):
+    """pack_processes: The tasks of these process types are run by pack workers
+    (pack_workers per process type, each with pack_n_cores for pack_wct hours)
+    instead of being submitted as individual jobs"""
+    pack_processes = set(
+        [] if pack_processes is None else map(const.ProcessType, pack_processes)
+    )
+    # The job ids of the submitted pack workers of each process type
+    pack_worker_jobs = {proc_type: [] for proc_type in pack_processes}
     mgmt_queue_folder = sim_struct.get_mgmt_db_queue(root_folder)
-    mgmt_db = MgmtDB(sim_struct.get_mgmt_db(root_folder))
+    mgmt_db = connect_mgmt_db(sim_struct.get_mgmt_db(root_folder), main_logger)
     root_params_file = os.path.join(
         sim_struct.get_runs_dir(root_folder), "root_params.yaml"
     )
@@ -508,7 +559,7 @@ def run_main_submit_loop(
         mgmt_queue_entries = os.listdir(mgmt_queue_folder)
 
         # Get in progress tasks in the db and the HPC queue
-        n_tasks_to_run = {}
+        n_tasks_to_run, squeued_job_ids = {}, set()
         for hpc in HPC:
             try:
                 squeued_tasks = Scheduler.get_scheduler().check_queues(
@@ -519,6 +570,7 @@ def run_main_submit_loop(
                 n_tasks_to_run[hpc] = 0
             else:
                 n_tasks_to_run[hpc] = n_runs[hpc] - len(squeued_tasks)
+                squeued_job_ids.update(str(task).split()[0] for task in squeued_tasks)
                 if len(squeued_tasks) > 0:
                     main_logger.debug(
                         "There was at least one job in squeue, resetting timeout"
@@ -526,14 +578,32 @@ def run_main_submit_loop(
                     time_since_something_happened = cycle_timeout
 
         # Gets all runnable tasks based on mgmt db state
+        prioritise = fair_share or (
+            prioritiser is not None and prioritiser.policy != PriorityPolicy.db_order
+        )
         runnable_tasks = mgmt_db.get_runnable_tasks(
             rels_to_run,
-            sum(n_runs.values()),
+            sum(n_runs.values())
+            * (
+                PRIORITY_CANDIDATES_PER_SLOT
+                if prioritise or admission_controller is not None
+                else 1
+            ),
             os.listdir(sim_struct.get_mgmt_db_queue(root_folder)),
             matcher,
             given_tasks_to_run,
             main_logger,
         )
+        if prioritise and len(runnable_tasks) > 0:
+            n_submitted = None
+            if fair_share:
+                n_submitted = Counter(
+                    sim_struct.get_fault_from_realisation(task.run_name)
+                    for task in mgmt_db.get_submitted_tasks()
+                )
+            runnable_tasks = (prioritiser or TaskPrioritiser()).prioritise(
+                runnable_tasks, n_submitted=n_submitted
+            )
         if len(runnable_tasks) > 0:
             time_since_something_happened = cycle_timeout
             main_logger.info("Number of runnable tasks: {}".format(len(runnable_tasks)))
@@ -541,11 +611,28 @@ def run_main_submit_loop(
         else:
             main_logger.debug("No runnable_tasks")
 
-        # Select the first ntask_to_run that are not waiting
-        # for mgmt db updates (i.e. items in the queue)
+        if admission_controller is not None:
+            admission_controller.reset(
+                (task.run_name, task.proc_type)
+                for task in mgmt_db.get_submitted_tasks()
+            )
+
+        # Select the first ntask_to_run (by priority) that are not waiting
+        # for mgmt db updates (i.e. items in the queue) and fit the budget
         tasks_to_run, task_counter = [], {key: 0 for key in HPC}
+        packed_tasks_to_run = set()
         for cur_proc_type, cur_run_name, retries in runnable_tasks:
             cur_hpc = get_target_machine(cur_proc_type)
+            # Tasks of packed process types are run by the pack workers,
+            # unless they don't fit the allocation of a worker
+            if const.ProcessType(cur_proc_type) in pack_processes and not is_unpackable(
+                root_folder, cur_run_name, cur_proc_type
+            ):
+                if not shared_automated_workflow.check_mgmt_queue(
+                    mgmt_queue_entries, cur_run_name, cur_proc_type
+                ):
+                    packed_tasks_to_run.add(const.ProcessType(cur_proc_type))
+                continue
             # Add task if limit has not been reached and there are no
             # outstanding mgmt db updates
             if (
@@ -553,6 +640,10 @@ def run_main_submit_loop(
                     mgmt_queue_entries, cur_run_name, cur_proc_type
                 )
                 and task_counter.get(cur_hpc, 0) < n_tasks_to_run[cur_hpc]
+                and (
+                    admission_controller is None
+                    or admission_controller.admit(cur_run_name, cur_proc_type)
+                )
             ):
                 tasks_to_run.append((cur_proc_type, cur_run_name, retries))
                 task_counter[cur_hpc] += 1
@@ -567,6 +658,30 @@ def run_main_submit_loop(
             ):
                 break
 
+        # Submit a pack worker for the packed process types with runnable tasks,
+        # unless enough of their workers are already queued or running
+        for proc_type in packed_tasks_to_run:
+            cur_hpc = get_target_machine(proc_type)
+            pack_worker_jobs[proc_type] = [
+                job_id
+                for job_id in pack_worker_jobs[proc_type]
+                if str(job_id) in squeued_job_ids
+            ]
+            if (
+                len(pack_worker_jobs[proc_type]) < pack_workers
+                and task_counter[cur_hpc] < n_tasks_to_run[cur_hpc]
+            ):
+                pack_worker_jobs[proc_type].append(
+                    submit_pack_worker(
+                        root_folder,
+                        proc_type,
+                        pack_n_cores,
+                        pack_wct,
+                        logger=main_logger,
+                    )
+                )
+                task_counter[cur_hpc] += 1
+
         if len(tasks_to_run) > 0:
             main_logger.info(
                 "Tasks to run this iteration: "
@@ -581,6 +696,9 @@ def run_main_submit_loop(
             main_logger.debug("No tasks to run this iteration")
 
         # Submit the runnable tasks
+        job_array = (
+            JobArrayBuilder(root_folder, logger=main_logger) if job_arrays else None
+        )
         for proc_type, run_name, retries in tasks_to_run:
             # Special handling for merge-ts
             if proc_type == const.ProcessType.merge_ts.value:
@@ -607,7 +725,10 @@ def run_main_submit_loop(
                 main_logger,
                 retries=retries,
                 hf_seed=hf_seed,
+                job_array=job_array,
             )
+        if job_array is not None and len(job_array) > 0:
+            job_array.submit()
         main_logger.debug("Sleeping for {} second(s)".format(sleep_time))
         time.sleep(sleep_time)
     main_logger.info("Nothing was running or ready to run last cycle, exiting now")
@@ -666,6 +787,65 @@ def main():
         default=ComparisonOperator.LIKE.name,
         options=ComparisonOperator.get_names(),
     )
+    parser.add_argument(
+        "--priority_policy",
+        help="The order in which runnable tasks are submitted. Either: "
+        "db_order for the order of the mgmt db, "
+        "critical_path to submit the tasks with the longest downstream work first, or "
+        "shortest_job_first to submit the tasks with the shortest estimated run time first",
+        default=PriorityPolicy.db_order.value,
+        choices=[policy.value for policy in PriorityPolicy],
+    )
+    parser.add_argument(
+        "--estimation_file",
+        help="A dataframe saved by estimate_cybershake.py --output, "
+        "used for the run time estimates of the priority policy",
+        default=None,
+    )
+    parser.add_argument(
+        "--fair_share",
+        action="store_true",
+        help="Submit the tasks of the faults with the fewest submitted jobs first",
+    )
+    parser.add_argument(
+        "--job_arrays",
+        action="store_true",
+        help="Submit the HF, BB and IM_calc tasks of each cycle with the same "
+        "resource requirements as a single job array (Slurm only)",
+    )
+    parser.add_argument(
+        "--admission_control",
+        action="store_true",
+        help="Also limit the cores and estimated core hours of the submitted jobs "
+        "of each machine, with the budgets of the ADMISSION_CONTROL entry of the "
+        "platform config. By default only the number of jobs is limited (--n_runs)",
+    )
+    parser.add_argument(
+        "--pack_processes",
+        nargs="+",
+        help="Run the tasks of these processes with pack workers, jobs that run "
+        "the tasks of many realisations within one allocation (Slurm only)",
+        choices=[proc.str_value for proc in PACK_PROCESSES],
+        default=[],
+    )
+    parser.add_argument(
+        "--pack_n_cores",
+        type=int,
+        help="Number of cores of each pack worker",
+        default=DEFAULT_PACK_N_CORES,
+    )
+    parser.add_argument(
+        "--pack_wct",
+        type=float,
+        help="Wall clock time (hours) of each pack worker",
+        default=DEFAULT_PACK_WCT,
+    )
+    parser.add_argument(
+        "--pack_workers",
+        type=int,
+        help="Maximum number of queued or running pack workers per process",
+        default=1,
+    )
 
     args = parser.parse_args()
     args.matcher = ComparisonOperator[args.matcher]
@@ -752,8 +932,42 @@ def main():
 
     logger.debug("Processed args are as follows: {}".format(str(args)))
 
+    task_costs, task_estimates = None, None
+    if args.estimation_file is not None:
+        estimation_df = load_estimation_df(args.estimation_file)
+        task_costs = get_task_costs(estimation_df)
+        task_estimates = get_task_estimates(estimation_df)
+        logger.debug(f"Loaded {len(task_costs)} task estimates")
+    prioritiser = TaskPrioritiser(
+        PriorityPolicy(args.priority_policy), task_costs, task_types_to_run
+    )
+
+    admission_controller = None
+    if args.admission_control:
+        budgets = load_budgets()
+        if len(budgets) == 0:
+            parser.error(
+                "--admission_control requires the ADMISSION_CONTROL budgets "
+                "in the platform config"
+            )
+        admission_controller = AdmissionController(budgets, task_estimates)
+        logger.debug(f"Using the admission control budgets {budgets}")
+
     scheduler_logger = qclogging.get_logger(name=f"{logger.name}.scheduler")
     Scheduler.initialise_scheduler(user=args.user, logger=scheduler_logger)
+    if args.job_arrays and not Scheduler.get_scheduler().SUPPORTS_ARRAYS:
+        parser.error("--job_arrays is only supported by the slurm scheduler")
+    pack_processes = [const.ProcessType.from_str(proc) for proc in args.pack_processes]
+    if (
+        len(pack_processes) > 0
+        and platform_config[const.PLATFORM_CONFIG.SCHEDULER.name] != "slurm"
+    ):
+        parser.error("--pack_processes is only supported by the slurm scheduler")
+    if len(pack_processes) > 0 and args.pack_wct * 3600 <= END_MARGIN:
+        parser.error(
+            f"--pack_wct has to be longer than the {END_MARGIN} seconds at the end of "
+            f"a pack worker in which no task is started"
+        )
     run_main_submit_loop(
         root_folder,
         n_runs,
@@ -762,6 +976,14 @@ def main():
         args.sleep_time,
         args.matcher,
         main_logger=logger,
+        prioritiser=prioritiser,
+        fair_share=args.fair_share,
+        admission_controller=admission_controller,
+        job_arrays=args.job_arrays,
+        pack_processes=pack_processes,
+        pack_n_cores=args.pack_n_cores,
+        pack_wct=args.pack_wct,
+        pack_workers=args.pack_workers,
     )
 
 
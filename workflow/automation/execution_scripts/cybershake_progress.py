@@ -3,15 +3,15 @@
 import argparse
 import json
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
 from urllib.request import urlopen
 
 from workflow.automation.estimation.estimate_cybershake import main as est_cybershake
-from workflow.automation.lib.MgmtDB import MgmtDB, ComparisonOperator
-from workflow.automation.lib.constants import ChCountType
+from workflow.automation.lib.MgmtDB import MgmtDB
+from workflow.automation.lib.mgmt_db_server import connect_mgmt_db
 import qcore.simulation_structure as sim_struct
 import qcore.constants as const
 from qcore.formats import load_fault_selection_file
@@ -42,41 +42,34 @@ _summary_est_template_fmt = (
 )
 
 
-def get_chours_used(root_dir: str, fault_names: List[str], proc_types: List[str]):
-    """Returns a dataframe containing the core hours used for each of the
-    specified faults"""
-    db = MgmtDB(f"{root_dir}/slurm_mgmt.db")
-    df = pd.DataFrame(
+def get_progress_used(
+    mgmtdb: MgmtDB, fault_names: List[str], proc_types: List[str]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Returns a dataframe containing the core hours used and a dataframe containing
+    the number of completed tasks, for each of the specified faults and process types.
+    Uses a single query of the progress summary table of the mgmt db."""
+    chours_df = pd.DataFrame(
         columns=proc_types,
         index=fault_names,
         data=np.zeros(shape=(len(fault_names), len(proc_types))),
     )
+    completed_df = pd.DataFrame(
+        columns=proc_types,
+        index=fault_names,
+        data=np.zeros(shape=(len(fault_names), len(proc_types)), dtype=int),
+    )
 
-    rel_names = db.get_rel_names()
-    for fault_name in fault_names:
-        flt_rel_names = [
-            rel_name[0] for rel_name in rel_names if fault_name in rel_name[0]
-        ]
-        for rel_name in flt_rel_names:
-            rel_states = db.get_core_hour_states(rel_name, ChCountType.Needed)
-            for state in rel_states:
-                _, _, proc_type, _, job_id, _ = state
-                proc_type_name = const.ProcessType(proc_type).str_value
-                if proc_type_name in proc_types:
-                    (
-                        _,
-                        _,
-                        _,
-                        start_time,
-                        end_time,
-                        _,
-                        cores,
-                        _,
-                        _,
-                    ) = db.get_job_duration_info(job_id)
-                    runtime = end_time - start_time
-                    df.loc[fault_name, proc_type_name] += cores * runtime / 3600
-    return df
+    for (
+        fault_name,
+        proc_type,
+        num_completed,
+        core_hours,
+    ) in mgmtdb.get_progress_summary():
+        proc_type_name = const.ProcessType(proc_type).str_value
+        if fault_name in chours_df.index and proc_type_name in proc_types:
+            chours_df.loc[fault_name, proc_type_name] = core_hours
+            completed_df.loc[fault_name, proc_type_name] = num_completed
+    return chours_df, completed_df
 
 
 def get_faults_dict(cybershake_list: str):
@@ -118,8 +111,8 @@ def get_new_progress_df(root_dir, faults_dict, mgmtdb: MgmtDB, proc_types: List[
         index=grouped_df.index.values, columns=pd.MultiIndex.from_tuples(column_t)
     )
 
-    # Get actual core hours for all faults
-    chours_df = get_chours_used(root_dir, fault_names, proc_types)
+    # Get actual core hours and number of completed RELs for all faults
+    chours_df, completed_df = get_progress_used(mgmtdb, fault_names, proc_types)
 
     # Populate progress dataframe with estimation data and actual data
     for proc_type in proc_types:
@@ -128,21 +121,7 @@ def get_new_progress_df(root_dir, faults_dict, mgmtdb: MgmtDB, proc_types: List[
                 proc_type, const.MetadataField.core_hours.value
             ]
         progress_df[proc_type, ACT_CORE_HOURS_COL] = chours_df[proc_type]
-
-    # Retrieve the number of completed RELs from DB
-    for fault_name in fault_names:
-        using_rels = faults_dict[fault_name] > 0
-        for proc_type in proc_types:
-            r_completed = mgmtdb.num_task_complete(
-                (const.ProcessType.from_str(proc_type).value, fault_name),
-                matcher=ComparisonOperator.EXACT,
-            )
-            if using_rels:
-                r_completed += mgmtdb.num_task_complete(
-                    (const.ProcessType.from_str(proc_type).value, f"{fault_name}_REL%"),
-                    matcher=ComparisonOperator.LIKE,
-                )
-            progress_df.loc[fault_name, (proc_type, NUM_COMPLETED_COL)] = r_completed
+        progress_df[proc_type, NUM_COMPLETED_COL] = completed_df[proc_type]
 
     # Compute total estimated time and actual time across all faults
     idx = pd.IndexSlice
@@ -271,7 +250,7 @@ def main(root_dir: Path, cybershake_list, proc_types, slack_config=None):
         root_dir.is_dir()
     ), f"Error: {root_dir} is not a valid cybershake root directory"
 
-    mgmtdb = MgmtDB(sim_struct.get_mgmt_db(root_dir))
+    mgmtdb = connect_mgmt_db(sim_struct.get_mgmt_db(root_dir))
 
     if cybershake_list is None:
         rel_names = mgmtdb.get_rel_names()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Runs the mgmt db server of a cybershake run, which owns the mgmt db file and serves
+the queue_monitor, auto_submit and cybershake_progress calls to it.
+See workflow.automation.lib.mgmt_db_server.
+
+Should be run on the machine running the workflow, before run_cybershake. Stop with Ctrl-C."""
+import argparse
+import logging
+import os
+import signal
+
+import qcore.simulation_structure as sim_struct
+from qcore import qclogging
+from workflow.automation.lib.mgmt_db_server import MgmtDBServer
+
+DEFAULT_SOCKET_NAME = "slurm_mgmt.sock"
+
+
+def main():
+    logger = qclogging.get_logger()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root_folder", type=str, help="Cybershake root folder.")
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=None,
+        help="Path of the Unix socket to listen on. "
+        f"Defaults to {DEFAULT_SOCKET_NAME} in the root_folder",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=None,
+        help="Listen on this TCP port instead of a Unix socket, 0 picks a free port",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="localhost",
+        help="Host name to listen on, only used with --port",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="Print debug messages to stdout"
+    )
+    args = parser.parse_args()
+
+    root_folder = os.path.abspath(args.root_folder)
+    if args.debug:
+        qclogging.set_stdout_level(logger, logging.DEBUG)
+
+    if args.port is not None:
+        address = (args.host, args.port)
+    elif args.socket is not None:
+        address = os.path.abspath(args.socket)
+    else:
+        address = os.path.join(root_folder, DEFAULT_SOCKET_NAME)
+
+    server = MgmtDBServer(sim_struct.get_mgmt_db(root_folder), address, logger)
+    signal.signal(signal.SIGTERM, lambda *_: server.shutdown())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        # serve_forever has already closed the listener and removed the server file
+        logger.info("Mgmt db server stopped")
+
+
+if __name__ == "__main__":
+    main()
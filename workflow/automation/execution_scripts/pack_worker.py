@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Runs the runnable tasks of one process type for many realisations within the
+current allocation. Submitted by auto_submit with --pack_processes,
+see workflow.automation.lib.pack_worker."""
+import argparse
+import logging
+import os
+
+import qcore.constants as const
+from qcore import qclogging
+from workflow.automation.lib.pack_worker import (
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_POLL_INTERVAL,
+    DEFAULT_TASK_MEMORY,
+    PACK_PROCESSES,
+    PackWorker,
+)
+from workflow.automation.lib.schedulers.abstractscheduler import parse_job_id
+
+
+def main():
+    logger = qclogging.get_logger()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root_folder", type=str, help="Cybershake root folder.")
+    parser.add_argument(
+        "proc_type",
+        type=const.ProcessType.from_str,
+        help="The string value of the process type to run",
+        choices=PACK_PROCESSES,
+        metavar="{" + ",".join(proc.str_value for proc in PACK_PROCESSES) + "}",
+    )
+    parser.add_argument(
+        "--n_cores", type=int, required=True, help="Number of cores of the allocation"
+    )
+    parser.add_argument(
+        "--memory", type=float, required=True, help="Memory (GB) of the allocation"
+    )
+    parser.add_argument(
+        "--time_limit",
+        type=float,
+        required=True,
+        help="Wall clock time (seconds) of the allocation",
+    )
+    parser.add_argument(
+        "--task_memory",
+        type=float,
+        default=DEFAULT_TASK_MEMORY,
+        help="Memory (GB) of tasks that don't request any",
+    )
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help="Seconds between checks for finished and runnable tasks",
+    )
+    parser.add_argument(
+        "--idle_timeout",
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT,
+        help="Stop after this many seconds without running or runnable tasks",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="Print debug messages to stdout"
+    )
+    args = parser.parse_args()
+
+    if args.debug:
+        qclogging.set_stdout_level(logger, logging.DEBUG)
+
+    job_id = os.environ.get("MGMT_DB_JOB_ID") or os.environ.get("SLURM_JOB_ID")
+    if job_id is None:
+        parser.error("The pack worker has to run within a slurm allocation")
+
+    PackWorker(
+        os.path.abspath(args.root_folder),
+        args.proc_type,
+        args.n_cores,
+        args.memory,
+        parse_job_id(job_id),
+        args.time_limit,
+        task_memory=args.task_memory,
+        poll_interval=args.poll_interval,
+        idle_timeout=args.idle_timeout,
+        logger=logger,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
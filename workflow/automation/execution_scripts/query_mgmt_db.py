@@ -6,21 +6,34 @@ A script that queries a slurm mgmt db and returns the status of a task
 
 import argparse
 from pathlib import Path
-from typing import Union, List
+from typing import Dict, Union, List, Tuple
 
 from workflow.automation.lib import MgmtDB
 
-from workflow.automation.lib.shared_automated_workflow import parse_config_file
+from workflow.automation.lib.shared_automated_workflow import (
+    like_pattern_to_regex,
+    parse_config_file,
+)
 
 PATTERN_FORMATTER = "{:>25}, {:>15}: created: {:>5}, queued: {:>5}, running: {:>5}, other: {:>5}, completed: {:>5}, failed: {:>5}, total: {:>6}"
 PATTERN_TODO_FORMATTER = "{:>25}, {:>15}: created: {:>5}"
-RETRY_MAX_FILTER = """AND (SELECT count(*) 
-                    FROM state as state2, status_enum as status_enum2 
-                    WHERE state2.status = status_enum2.id 
-                    AND status_enum2.state <> 'failed' 
-                    AND state2.run_name = s.run_name
-                    AND s.proc_type = state2.proc_type)
-                 = 0"""
+# Only tasks that have no attempt that did not fail, including archived attempts.
+# The subquery is not correlated, so it is evaluated once instead of for every row
+RETRY_MAX_FILTER = """AND (s.run_name, s.proc_type) NOT IN (
+                    SELECT state2.run_name, state2.proc_type
+                    FROM state_history as state2
+                    WHERE state2.status <> (SELECT id FROM status_enum WHERE state = 'failed'))"""
+# Only the latest attempt of tasks that have not been completed. MgmtDB.archive only
+# moves retried attempts, so the completed and latest attempts are in the state table
+TODO_FILTER = """AND NOT EXISTS (
+        SELECT 1 FROM state s_inner
+        WHERE s_inner.run_name = s.run_name AND s_inner.proc_type = s.proc_type AND s_inner.status = 5)
+        AND s.last_modified IN (
+        SELECT MAX(last_modified) FROM state WHERE run_name = s.run_name AND proc_type = s.proc_type
+        )
+        """
+# The status values that are counted, in the order of PATTERN_FORMATTER
+COUNT_STATUSES = list(range(1, 7))
 
 
 class QueryModes:
@@ -104,6 +117,20 @@ def state_table_query_builder(
     return query
 
 
+def add_history_views(db):
+    """The queries read the state_history view, which a db created with an older
+    version of the schema doesn't have until it is migrated by a process that writes
+    to it (MgmtDB.migrate). Queries of such a db only read the state table, through
+    a temporary view that isn't stored in the db"""
+    if (
+        db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'state_history'"
+        ).fetchone()
+        is None
+    ):
+        db.execute("CREATE TEMP VIEW state_history AS SELECT * FROM state")
+
+
 def print_run_status(db, run_name, query_mode: QueryModes, config_file=None):
     if query_mode.error:
         show_all_error_entries(db, run_name, query_mode.retry_max)
@@ -136,17 +163,11 @@ def print_run_status(db, run_name, query_mode: QueryModes, config_file=None):
 def get_all_entries(db, run_name, query_mode):
     extra_query = ""
     if query_mode.todo:
-        extra_query = """AND NOT EXISTS (
-        SELECT 1 FROM state s_inner
-        WHERE s_inner.run_name = s.run_name AND s_inner.proc_type = s.proc_type AND s_inner.status = 5)
-        AND s.last_modified IN (
-        SELECT MAX(last_modified) FROM state WHERE run_name = s.run_name AND proc_type = s.proc_type
-        )
-        """
+        extra_query = TODO_FILTER
     elif query_mode.retry_max:
         extra_query = RETRY_MAX_FILTER
     base_command = f"""SELECT s.run_name, pe.proc_type, se.state, s.job_id, datetime(last_modified,'unixepoch') lm_time
-                        FROM state s
+                        FROM state_history s
                         JOIN status_enum se ON s.status = se.id
                         JOIN proc_type_enum pe ON s.proc_type = pe.id
                         WHERE
@@ -165,20 +186,14 @@ def get_all_entries(db, run_name, query_mode):
 def get_all_entries_from_config(config_file, db, query_mode):
     extra_query = ""
     if query_mode.todo:
-        extra_query = """AND NOT EXISTS (
-        SELECT 1 FROM state s_inner
-        WHERE s_inner.run_name = s.run_name AND s_inner.proc_type = s.proc_type AND s_inner.status = 5)
-        AND s.last_modified IN (
-        SELECT MAX(last_modified) FROM state WHERE run_name = s.run_name AND proc_type = s.proc_type
-        )
-        """
+        extra_query = TODO_FILTER
     elif query_mode.retry_max:
         extra_query = RETRY_MAX_FILTER
     tasks_n, tasks_to_match, tasks_to_not_match = parse_config_file(config_file)
     status = []
 
     base_command = f""" SELECT s.run_name, pe.proc_type, se.state, s.job_id, datetime(last_modified,'unixepoch') lm_time
-                        FROM state s
+                        FROM state_history s
                         JOIN status_enum se ON s.status = se.id
                         JOIN proc_type_enum pe ON s.proc_type = pe.id
                         WHERE
@@ -215,118 +230,111 @@ def get_all_entries_from_config(config_file, db, query_mode):
     return status
 
 
+def get_state_counts(db) -> Dict[Tuple[str, int], List[int]]:
+    """Gets the number of tasks in each of the COUNT_STATUSES for every run_name and
+    process type, using a single GROUP BY query. Archived attempts are included"""
+    counts = {}
+    for run_name, proc_type, status, count in db.execute(
+        "SELECT run_name, proc_type, status, COUNT(*) FROM state_history "
+        "GROUP BY run_name, proc_type, status"
+    ):
+        if status in COUNT_STATUSES:
+            counts.setdefault((run_name, proc_type), [0] * len(COUNT_STATUSES))[
+                COUNT_STATUSES.index(status)
+            ] += count
+    return counts
+
+
+def sum_state_counts(
+    counts: Dict[Tuple[str, int], List[int]],
+    pattern: str = None,
+    run_name_type: MgmtDB.ComparisonOperator = MgmtDB.ComparisonOperator.LIKE,
+) -> Dict[int, List[int]]:
+    """Sums the state counts of the run_names that match the pattern for each process
+    type. The pattern matching mirrors the SQL (NOT) LIKE comparison"""
+    regex = like_pattern_to_regex(pattern) if pattern is not None else None
+    is_like = run_name_type == MgmtDB.ComparisonOperator.LIKE
+
+    run_name_matches = {}
+    proc_counts = {}
+    for (run_name, proc_type), run_counts in counts.items():
+        if regex is not None:
+            is_match = run_name_matches.get(run_name)
+            if is_match is None:
+                is_match = run_name_matches[run_name] = (
+                    regex.fullmatch(run_name) is not None
+                ) == is_like
+            if not is_match:
+                continue
+        cur_counts = proc_counts.setdefault(proc_type, [0] * len(COUNT_STATUSES))
+        for i, count in enumerate(run_counts):
+            cur_counts[i] += count
+    return proc_counts
+
+
+def _total_counts(proc_counts: Dict[int, List[int]]):
+    """Sums the state counts over all process types"""
+    vals = [0] * len(COUNT_STATUSES)
+    for counts in proc_counts.values():
+        for i, count in enumerate(counts):
+            vals[i] += count
+    return vals
+
+
 def show_pattern_state_counts(config_file, db, todo=False):
     tasks_n, tasks_to_match, tasks_to_not_match = parse_config_file(config_file)
-    vals = []
-    for i in range(1, 7):
-        vals.append(
-            db.execute(
-                state_table_query_builder("COUNT(*)", state=True), (i,)
-            ).fetchone()[0]
-        )
+    counts = get_state_counts(db)
+
+    vals = _total_counts(sum_state_counts(counts))
     if todo:
         print(PATTERN_TODO_FORMATTER.format("ALL", "ALL", vals[0]))
     else:
         print(PATTERN_FORMATTER.format("ALL", "ALL", *vals, sum(vals)))
-    for pattern, tasks in tasks_to_match:
-        vals = []
-        for i in range(1, 7):
-            vals.append(
-                db.execute(
-                    state_table_query_builder(
-                        "COUNT(*)",
-                        state=True,
-                        run_name_type=MgmtDB.ComparisonOperator.LIKE,
-                    ),
-                    (pattern, i),
-                ).fetchone()[0]
-            )
-        if todo:
-            print(PATTERN_TODO_FORMATTER.format("ALL", "ALL", vals[0]))
-        else:
-            print(
-                PATTERN_FORMATTER.format(
-                    ", ".join([task.name for task in tasks]), pattern, *vals, sum(vals)
-                )
-            )
-    for pattern, tasks in tasks_to_not_match:
-        vals = []
-        for i in range(1, 7):
-            vals.append(
-                db.execute(
-                    state_table_query_builder(
-                        "COUNT(*)",
-                        state=True,
-                        run_name_type=MgmtDB.ComparisonOperator.NOTLIKE,
-                    ),
-                    (pattern, i),
-                ).fetchone()[0]
-            )
-        if todo:
-            print(PATTERN_TODO_FORMATTER.format("ALL", "ALL", vals[0]))
-        else:
-            print(
-                PATTERN_FORMATTER.format(
-                    ", ".join([task.name for task in tasks]), pattern, *vals, sum(vals)
+    for run_name_type, pattern_tasks in [
+        (MgmtDB.ComparisonOperator.LIKE, tasks_to_match),
+        (MgmtDB.ComparisonOperator.NOTLIKE, tasks_to_not_match),
+    ]:
+        for pattern, tasks in pattern_tasks:
+            vals = _total_counts(sum_state_counts(counts, pattern, run_name_type))
+            if todo:
+                print(PATTERN_TODO_FORMATTER.format("ALL", "ALL", vals[0]))
+            else:
+                print(
+                    PATTERN_FORMATTER.format(
+                        ", ".join([task.name for task in tasks]),
+                        pattern,
+                        *vals,
+                        sum(vals),
+                    )
                 )
-            )
 
 
 def show_detailed_config_counts(config_file, db, todo=False):
     tasks_n, tasks_to_match, tasks_to_not_match = parse_config_file(config_file)
+    counts = get_state_counts(db)
+    empty_counts = [0] * len(COUNT_STATUSES)
+
+    proc_counts = sum_state_counts(counts)
     for j in tasks_n:
-        vals = []
-        for i in range(1, 7):
-            vals.append(
-                db.execute(
-                    state_table_query_builder(
-                        "COUNT(*)", state=True, process_type=True
-                    ),
-                    (i, j.value),
-                ).fetchone()[0]
-            )
+        vals = proc_counts.get(j.value, empty_counts)
         if todo:
             print(PATTERN_TODO_FORMATTER.format("ALL", j.str_value, vals[0]))
         else:
             print(PATTERN_FORMATTER.format("ALL", j.str_value, *vals, sum(vals)))
-    for pattern, tasks in tasks_to_match:
-        for j in tasks:
-            vals = []
-            for i in range(1, 7):
-                vals.append(
-                    db.execute(
-                        state_table_query_builder(
-                            "COUNT(*)",
-                            state=True,
-                            process_type=True,
-                            run_name_type=MgmtDB.ComparisonOperator.LIKE,
-                        ),
-                        (pattern, i, j.value),
-                    ).fetchone()[0]
-                )
-            if todo:
-                print(PATTERN_TODO_FORMATTER.format(pattern, j.str_value, vals[0]))
-            else:
-                print(PATTERN_FORMATTER.format(pattern, j.str_value, *vals, sum(vals)))
-    for pattern, tasks in tasks_to_not_match:
-        for j in tasks:
-            vals = []
-            for i in range(1, 7):
-                vals.append(
-                    db.execute(
-                        state_table_query_builder(
-                            "COUNT(*)",
-                            state=True,
-                            process_type=True,
-                            run_name_type=MgmtDB.ComparisonOperator.NOTLIKE,
-                        ),
-                        (pattern, i, j.value),
-                    ).fetchone()[0]
-                )
-            if todo:
-                print(PATTERN_TODO_FORMATTER.format(pattern, j.str_value, vals[0]))
-            else:
-                print(PATTERN_FORMATTER.format(pattern, j.str_value, *vals, sum(vals)))
+    for run_name_type, pattern_tasks in [
+        (MgmtDB.ComparisonOperator.LIKE, tasks_to_match),
+        (MgmtDB.ComparisonOperator.NOTLIKE, tasks_to_not_match),
+    ]:
+        for pattern, tasks in pattern_tasks:
+            proc_counts = sum_state_counts(counts, pattern, run_name_type)
+            for j in tasks:
+                vals = proc_counts.get(j.value, empty_counts)
+                if todo:
+                    print(PATTERN_TODO_FORMATTER.format(pattern, j.str_value, vals[0]))
+                else:
+                    print(
+                        PATTERN_FORMATTER.format(pattern, j.str_value, *vals, sum(vals))
+                    )
 
 
 def show_all_error_entries(db, run_name, max_retries=False):
@@ -335,7 +343,7 @@ def show_all_error_entries(db, run_name, max_retries=False):
         extra_query = RETRY_MAX_FILTER
     db.execute(
         """SELECT s.run_name, pe.proc_type, se.state, s.job_id, datetime(last_modified,'unixepoch') lm_time, e.error
-            FROM state s
+            FROM state_history s
             JOIN status_enum se ON s.status = se.id
             JOIN proc_type_enum pe ON s.proc_type = pe.id
             JOIN error e ON s.id = e.task_id
@@ -357,13 +365,12 @@ def show_all_error_entries(db, run_name, max_retries=False):
 
 
 def show_state_counts(db, todo=False):
-    vals = []
-    for i in range(1, 7):
-        vals.append(
-            db.execute(
-                state_table_query_builder("COUNT(*)", state=True), (i,)
-            ).fetchone()[0]
-        )
+    status_counts = dict(
+        db.execute(
+            "SELECT status, COUNT(*) FROM state_history GROUP BY status"
+        ).fetchall()
+    )
+    vals = [status_counts.get(status, 0) for status in COUNT_STATUSES]
     if todo:
         print(PATTERN_TODO_FORMATTER.format("All", "All", vals[0]))
     else:
@@ -447,6 +454,7 @@ def main():
         Path(args.run_folder) / "slurm_mgmt.db",
         pragmas=["synchronous = EXTRA", "integrity_check"],
     ) as cur:
+        add_history_views(cur)
         print_run_status(cur, run_name, query_mode, args.config)
 
 
@@ -16,15 +16,22 @@ import qcore.constants as const
 import qcore.simulation_structure as sim_struct
 from qcore import qclogging
 from workflow.automation.lib.MgmtDB import MgmtDB, SchedulerTask
+from workflow.automation.lib.mgmt_db_server import connect_mgmt_db
+from workflow.automation.lib.schedulers.abstractscheduler import (
+    get_scheduler_job_id,
+    is_pack_task_job_id,
+)
 from workflow.automation.lib.schedulers.scheduler_factory import Scheduler
 from workflow.automation.platform_config import HPC
 from workflow.automation.lib.shared_automated_workflow import check_mgmt_queue
-from workflow.automation.metadata.log_metadata import store_metadata
+from workflow.automation.metadata.log_metadata import append_metadata
 
 # Have to include sub-seconds, as clean up can run sub one second.
 
 QUEUE_MONITOR_LOG_FILE_NAME = "queue_monitor_log_{}.txt"
 DEFAULT_N_MAX_RETRIES = 2
+# Seconds between archiving retried attempts and optimising the mgmt db
+DEFAULT_ARCHIVE_INTERVAL = 3600
 
 keepAlive = True
 
@@ -87,8 +94,10 @@ def update_tasks(
     )
     for db_running_task in db_running_tasks:
         task_logger.debug("Checking task {}".format(db_running_task))
-        if str(db_running_task.job_id) in squeue_tasks.keys():
-            queue_status = squeue_tasks[str(db_running_task.job_id)]
+        # Tasks run by a pack worker are in the queue as the worker job
+        scheduler_job_id = str(get_scheduler_job_id(db_running_task.job_id))
+        if scheduler_job_id in squeue_tasks.keys():
+            queue_status = squeue_tasks[scheduler_job_id]
             task_logger.debug("Found task. It has state {}".format(queue_status))
 
             try:
@@ -163,7 +172,7 @@ def update_tasks(
                 # Check for if task was killed by Wall Clock Time
                 try:
                     killed_wct = Scheduler.get_scheduler().check_wct_hit(
-                        db_running_task.job_id
+                        scheduler_job_id
                     )
                 except IndexError:
                     task_logger.warning(
@@ -186,32 +195,33 @@ def update_tasks(
                         f"Disappeared from {Scheduler.get_scheduler().QUEUE_NAME}.",
                     )
                 )
-            # When job failed, we want to log metadata as well
-            (
-                start_time,
-                end_time,
-                run_time,
-                n_cores,
-                status,
-            ) = Scheduler.get_scheduler().get_metadata(db_running_task, task_logger)
-            log_file = os.path.join(
-                sim_struct.get_sim_dir(root_folder, db_running_task.run_name),
-                "ch_log",
-                "metadata_log.json",
-            )
-            # now log metadata
-            store_metadata(
-                log_file,
-                const.ProcessType(db_running_task.proc_type).str_value,
-                {
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "run_time": run_time,
-                    "cores": n_cores,
-                    "status": status,
-                },
-                logger=task_logger,
-            )
+            # When job failed, we want to log metadata as well, the scheduler has
+            # no accounting of the tasks run by a pack worker
+            if not is_pack_task_job_id(db_running_task.job_id):
+                (
+                    start_time,
+                    end_time,
+                    run_time,
+                    n_cores,
+                    status,
+                ) = Scheduler.get_scheduler().get_metadata(db_running_task, task_logger)
+                log_dir = os.path.join(
+                    sim_struct.get_sim_dir(root_folder, db_running_task.run_name),
+                    "ch_log",
+                )
+                # now log metadata
+                append_metadata(
+                    log_dir,
+                    const.ProcessType(db_running_task.proc_type).str_value,
+                    {
+                        "start_time": start_time,
+                        "end_time": end_time,
+                        "run_time": run_time,
+                        "cores": n_cores,
+                        "status": status,
+                    },
+                    logger=task_logger,
+                )
     return tasks_to_do
 
 
@@ -221,8 +231,9 @@ def queue_monitor_loop(
     max_retries: int,
     queue_logger: Logger = qclogging.get_basic_logger(),
     alert_url=None,
+    archive_interval: int = DEFAULT_ARCHIVE_INTERVAL,
 ):
-    mgmt_db = MgmtDB(sim_struct.get_mgmt_db(root_folder))
+    mgmt_db = connect_mgmt_db(sim_struct.get_mgmt_db(root_folder), queue_logger)
     queue_folder = sim_struct.get_mgmt_db_queue(root_folder)
 
     queue_logger.info("Running queue-monitor, exit with Ctrl-C.")
@@ -230,6 +241,7 @@ def queue_monitor_loop(
     mgmt_db.add_retries(max_retries)
 
     sqlite_tmpdir = "/tmp/cer"
+    last_archive_time = 0
     while keepAlive:
         complete_data = True
         if not os.path.exists(sqlite_tmpdir):
@@ -354,6 +366,13 @@ def queue_monitor_loop(
         else:
             queue_logger.info("No entries in the mgmt db queue.")
 
+        if 0 < archive_interval <= time.time() - last_archive_time:
+            n_archived = mgmt_db.archive()
+            queue_logger.info(f"Archived {n_archived} retried task attempts.")
+            if mgmt_db.optimise():
+                queue_logger.info("Vacuumed the mgmt db.")
+            last_archive_time = time.time()
+
         # Nap time
         queue_logger.debug("Sleeping for {}".format(sleep_time))
         time.sleep(sleep_time)
@@ -385,6 +404,13 @@ def initialisation():
         default=DEFAULT_N_MAX_RETRIES,
         type=int,
     )
+    parser.add_argument(
+        "--archive_interval",
+        help="Seconds between archiving the retried task attempts and optimising the mgmt db. "
+        "Use 0 to disable",
+        default=DEFAULT_ARCHIVE_INTERVAL,
+        type=int,
+    )
     parser.add_argument(
         "--debug", action="store_true", help="Print debug messages to stdout"
     )
@@ -419,6 +445,7 @@ def initialisation():
         args.n_max_retries,
         logger,
         alert_url=args.alert_url,
+        archive_interval=args.archive_interval,
     )
 
 
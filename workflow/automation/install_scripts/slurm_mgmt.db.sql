@@ -17,7 +17,9 @@ CREATE TABLE IF NOT EXISTS `state` (
 	`proc_type`	INTEGER NOT NULL,
 	`status`	INTEGER,
 	`job_id`	INTEGER UNIQUE,
-	`last_modified`	INTEGER
+	`last_modified`	INTEGER,
+	`fault_name`	TEXT,
+	`is_median`	INTEGER
 );
 CREATE TABLE IF NOT EXISTS `error` (
     `id`  INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,
@@ -26,6 +28,8 @@ CREATE TABLE IF NOT EXISTS `error` (
 );
 CREATE INDEX IF NOT EXISTS `state_search` ON state (status);
 CREATE INDEX IF NOT EXISTS `status` ON state (run_name, job_id, status, proc_type);
+CREATE INDEX IF NOT EXISTS `state_run_proc_status` ON state (run_name, proc_type, status);
+CREATE INDEX IF NOT EXISTS `state_proc_status_fault` ON state (proc_type, status, fault_name);
 
 CREATE TABLE IF NOT EXISTS "proc_type_enum" (
 	`id`	INTEGER NOT NULL UNIQUE,
@@ -83,6 +87,49 @@ CREATE TABLE IF NOT EXISTS `job_duration_log`(
 	PRIMARY KEY(`id`),
 	FOREIGN KEY(`job_id`) REFERENCES state(job_id)
 );
+CREATE TABLE IF NOT EXISTS `progress_summary`(
+	`fault_name`	TEXT NOT NULL,
+	`proc_type`	INTEGER NOT NULL,
+	`num_completed`	INTEGER NOT NULL DEFAULT 0,
+	`core_hours`	REAL NOT NULL DEFAULT 0,
+	PRIMARY KEY(`fault_name`, `proc_type`)
+);
+CREATE TABLE IF NOT EXISTS `state_archive` (
+	`id`	INTEGER NOT NULL PRIMARY KEY,
+	`run_name`	TEXT NOT NULL,
+	`proc_type`	INTEGER NOT NULL,
+	`status`	INTEGER,
+	`job_id`	INTEGER,
+	`last_modified`	INTEGER,
+	`fault_name`	TEXT,
+	`is_median`	INTEGER
+);
+CREATE TABLE IF NOT EXISTS `job_duration_log_archive`(
+	`id`	INTEGER NOT NULL PRIMARY KEY,
+	`job_id`	INTEGER,
+	`queued_time` INTEGER,
+	`start_time` INTEGER,
+	`end_time` INTEGER,
+	`nodes` INTEGER,
+	`cores` INTEGER,
+	`memory` INTEGER,
+	`WCT` INTEGER
+);
+CREATE TABLE IF NOT EXISTS `retry_count`(
+	`run_name`	TEXT NOT NULL,
+	`proc_type`	INTEGER NOT NULL,
+	`n_failed`	INTEGER NOT NULL DEFAULT 0,
+	`n_killed_wct`	INTEGER NOT NULL DEFAULT 0,
+	PRIMARY KEY(`run_name`, `proc_type`)
+);
+CREATE VIEW IF NOT EXISTS state_history AS
+SELECT id, run_name, proc_type, status, job_id, last_modified, fault_name, is_median FROM state_archive
+UNION ALL
+SELECT id, run_name, proc_type, status, job_id, last_modified, fault_name, is_median FROM state;
+CREATE VIEW IF NOT EXISTS job_duration_history AS
+SELECT id, job_id, queued_time, start_time, end_time, nodes, cores, memory, WCT FROM job_duration_log_archive
+UNION ALL
+SELECT id, job_id, queued_time, start_time, end_time, nodes, cores, memory, WCT FROM job_duration_log;
 CREATE VIEW IF NOT EXISTS state_view AS
 SELECT state.id, state.run_name, proc_type_enum.proc_type, status_enum.state, state.job_id, state.last_modified
 FROM state, status_enum, proc_type_enum
@@ -4,7 +4,7 @@ from contextlib import contextmanager
 from dataclasses import dataclass
 from logging import Logger
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Tuple, Union
 
 import qcore.constants as const
 from qcore import simulation_structure
@@ -20,12 +20,84 @@ class ComparisonOperator(const.ExtendedEnum):
     NOTLIKE = "NOT LIKE"
 
 
+# Realisation names match this pattern, medians (fault names) do not
+REL_ONLY_PATTERN = "%_REL%"
+
+# Columns added to the state table after its initial schema, name: type
+STATE_MIGRATION_COLUMNS = {
+    "fault_name": "TEXT",
+    "is_median": "INTEGER",
+}
+
+# Indexes of the state table, name: columns
+STATE_INDEXES = {
+    # Counting/grouping by realisation, process type and status and
+    # finding the other attempts of a task
+    "state_run_proc_status": ("run_name", "proc_type", "status"),
+    # Selecting tasks of a process type and status, optionally for a single fault
+    "state_proc_status_fault": ("proc_type", "status", "fault_name"),
+}
+
+# Columns of the state and job_duration_log tables, in schema order
+STATE_COLUMNS = (
+    "id",
+    "run_name",
+    "proc_type",
+    "status",
+    "job_id",
+    "last_modified",
+    "fault_name",
+    "is_median",
+)
+JOB_DURATION_COLUMNS = (
+    "id",
+    "job_id",
+    "queued_time",
+    "start_time",
+    "end_time",
+    "nodes",
+    "cores",
+    "memory",
+    "WCT",
+)
+# Columns of the attempts returned by get_core_hour_states
+CORE_HOUR_STATE_COLUMNS = STATE_COLUMNS[:6]
+
+# Tables holding the retried attempts moved out of the state and job_duration_log
+# tables by MgmtDB.archive, and views of the archived and live rows combined.
+# Queries that need the full history of a task (core hours) use the views.
+ARCHIVE_SCHEMA = {
+    "state_archive": "CREATE TABLE IF NOT EXISTS `state_archive` ("
+    "`id` INTEGER NOT NULL PRIMARY KEY, `run_name` TEXT NOT NULL, "
+    "`proc_type` INTEGER NOT NULL, `status` INTEGER, `job_id` INTEGER, "
+    "`last_modified` INTEGER, `fault_name` TEXT, `is_median` INTEGER)",
+    "job_duration_log_archive": "CREATE TABLE IF NOT EXISTS `job_duration_log_archive` ("
+    "`id` INTEGER NOT NULL PRIMARY KEY, `job_id` INTEGER, `queued_time` INTEGER, "
+    "`start_time` INTEGER, `end_time` INTEGER, `nodes` INTEGER, `cores` INTEGER, "
+    "`memory` INTEGER, `WCT` INTEGER)",
+    "retry_count": "CREATE TABLE IF NOT EXISTS `retry_count` ("
+    "`run_name` TEXT NOT NULL, `proc_type` INTEGER NOT NULL, "
+    "`n_failed` INTEGER NOT NULL DEFAULT 0, `n_killed_wct` INTEGER NOT NULL DEFAULT 0, "
+    "PRIMARY KEY(`run_name`, `proc_type`))",
+    "state_history": "CREATE VIEW IF NOT EXISTS state_history AS "
+    f"SELECT {', '.join(STATE_COLUMNS)} FROM state_archive UNION ALL "
+    f"SELECT {', '.join(STATE_COLUMNS)} FROM state",
+    "job_duration_history": "CREATE VIEW IF NOT EXISTS job_duration_history AS "
+    f"SELECT {', '.join(JOB_DURATION_COLUMNS)} FROM job_duration_log_archive UNION ALL "
+    f"SELECT {', '.join(JOB_DURATION_COLUMNS)} FROM job_duration_log",
+}
+
+# Fraction of unused pages of the db file above which MgmtDB.optimise runs VACUUM
+VACUUM_FREE_FRACTION = 0.25
+
+
 @dataclass
 class SchedulerTask:
     run_name: str
     proc_type: int
     status: int
-    job_id: int
+    # <array job id>_<array task index> for tasks of job arrays
+    job_id: Union[int, str]
     error: str = None
     queued_time: int = None
     start_time: int = None
@@ -104,18 +176,30 @@ class MgmtDB:
         # statement.
         self._conn = None
 
+        if self._db_file.is_file():
+            with connect_db_ctx(self._db_file) as cur:
+                self.migrate(cur)
+
     @property
     def db_file(self):
         return self._db_file
 
     def get_retries(self, process, realisation_name, get_WCT=False):
+        """Counts the killed_WCT attempts (get_WCT) or all other attempts of a task,
+        including the attempts that have been archived"""
         get_WCT_symbol = "=" if get_WCT else "!="
         with connect_db_ctx(self._db_file) as cur:
-            return cur.execute(
+            n_live = cur.execute(
                 "SELECT COUNT(*) from state "
                 f"WHERE run_name = ? AND proc_type = ? and status {get_WCT_symbol} ?",
                 (realisation_name, process, const.Status.killed_WCT.value),
             ).fetchone()[0]
+            n_archived = cur.execute(
+                f"SELECT {'n_killed_wct' if get_WCT else 'n_failed'} FROM retry_count "
+                "WHERE run_name = ? AND proc_type = ?",
+                (realisation_name, process),
+            ).fetchone()
+        return n_live + (0 if n_archived is None else n_archived[0])
 
     def update_entries_live(
         self,
@@ -134,6 +218,7 @@ class MgmtDB:
 
             cur = self._conn.cursor()
             cur.execute("BEGIN")
+            self._check_progress_summary(cur)
             for entry in entries:
                 process = entry.proc_type
                 realisation_name = entry.run_name
@@ -177,15 +262,18 @@ class MgmtDB:
                     self._insert_task(cur, realisation_name, process)
                     logger.debug("New task added to the db, continuing to next process")
                     continue
+                is_finished = entry.status in (
+                    const.Status.failed.value,
+                    const.Status.killed_WCT.value,
+                    const.Status.completed.value,
+                )
+                if is_finished:
+                    progress = self._task_progress(cur, realisation_name, process)
                 logger.debug("Updating task in the db")
                 self._update_entry(cur, entry, logger=logger)
                 logger.debug("Task successfully updated")
 
-                if (
-                    entry.status == const.Status.failed.value
-                    or entry.status == const.Status.killed_WCT.value
-                    or entry.status == const.Status.completed.value
-                ):
+                if is_finished:
                     # Update the job duration log if task has failed, killed by WCT or completed
                     logger.debug("Logging end time for the task to the db")
                     self.update_end_job_log(
@@ -197,6 +285,10 @@ class MgmtDB:
                             else entry.end_time
                         ),
                     )
+                    # Keep the progress summary in sync, as part of the same transaction
+                    self._update_progress_summary(
+                        cur, realisation_name, process, progress
+                    )
 
                 if (
                     entry.status == const.Status.killed_WCT.value
@@ -227,7 +319,13 @@ class MgmtDB:
                     while i < len(tasks):
                         task = tasks[i]
                         # fails dependant task
+                        progress = self._task_progress(
+                            cur, task.run_name, task.proc_type
+                        )
                         self._update_entry(cur, task, logger=logger)
+                        self._update_progress_summary(
+                            cur, task.run_name, task.proc_type, progress
+                        )
                         logger.debug(
                             f"Cascading failure for {entry.run_name} - {task.proc_type}"
                         )
@@ -250,19 +348,23 @@ class MgmtDB:
         return True
 
     def get_core_hour_states(self, rel_name: str, ch_count_type: ChCountType):
+        """Gets the attempts of a realisation to count towards its core hours,
+        including archived attempts, as (id, run_name, proc_type, status, job_id,
+        last_modified) tuples"""
+        columns = ", ".join(CORE_HOUR_STATE_COLUMNS)
         with connect_db_ctx(self._db_file) as cur:
             if ch_count_type == ChCountType.Needed:
                 states = []
                 # Selects only tasks after the last failed attempt
                 proc_types = cur.execute(
-                    "SELECT DISTINCT proc_type from state WHERE run_name=? AND status!=?",
+                    "SELECT DISTINCT proc_type from state_history WHERE run_name=? AND status!=?",
                     (rel_name, const.Status.created.value),
                 ).fetchall()
 
                 for proc_type in proc_types:
                     proc_type = proc_type[0]
                     failed_task_modified = cur.execute(
-                        "SELECT last_modified from state WHERE run_name=? AND status=? AND proc_type=?",
+                        "SELECT last_modified from state_history WHERE run_name=? AND status=? AND proc_type=?",
                         (rel_name, const.Status.failed.value, proc_type),
                     ).fetchall()
                     if len(failed_task_modified) > 0:
@@ -270,7 +372,7 @@ class MgmtDB:
                         failed_task_modified_time = failed_task_modified[-1][0]
                         states.extend(
                             cur.execute(
-                                "SELECT * from state WHERE run_name=? AND "
+                                f"SELECT {columns} from state_history WHERE run_name=? AND "
                                 "(status=? OR status=?) AND proc_type=? AND last_modified>?",
                                 (
                                     rel_name,
@@ -285,7 +387,7 @@ class MgmtDB:
                         # There were no failed tasks for this proc_type
                         states.extend(
                             cur.execute(
-                                "SELECT * from state WHERE run_name=? AND (status=? OR status=?) AND proc_type=?",
+                                f"SELECT {columns} from state_history WHERE run_name=? AND (status=? OR status=?) AND proc_type=?",
                                 (
                                     rel_name,
                                     const.Status.completed.value,
@@ -296,7 +398,7 @@ class MgmtDB:
                         )
             else:
                 states = cur.execute(
-                    "SELECT * from state WHERE run_name=? AND (status=? OR status=?)",
+                    f"SELECT {columns} from state_history WHERE run_name=? AND (status=? OR status=?)",
                     (
                         rel_name,
                         const.Status.completed.value,
@@ -305,10 +407,200 @@ class MgmtDB:
                 ).fetchall()
         return states
 
+    def get_core_hour_jobs(self, ch_count_type: ChCountType):
+        """Gets the state and job duration of the jobs to count towards the
+        core hours of all realisations, using a single query.
+        Uses the same selection as get_core_hour_states.
+
+        Returns a list of (run_name, proc_type, job_id, queued_time, start_time,
+        end_time, nodes, cores, memory, WCT) tuples, in state order
+        """
+        with connect_db_ctx(self._db_file) as cur:
+            return self._select_core_hour_jobs(cur, ch_count_type)
+
+    @staticmethod
+    def _select_core_hour_jobs(cur: sql.Cursor, ch_count_type: ChCountType):
+        query = (
+            "SELECT state.run_name, state.proc_type, state.job_id, "
+            "job.queued_time, job.start_time, job.end_time, "
+            "job.nodes, job.cores, job.memory, job.WCT "
+            "FROM state_history AS state "
+            # Only the first job duration entry of each job, as get_job_duration_info
+            "JOIN (SELECT job_id, MIN(id) AS id FROM job_duration_history GROUP BY job_id) "
+            "AS first_job ON first_job.job_id = state.job_id "
+            "JOIN job_duration_history AS job ON job.id = first_job.id "
+        )
+        params = []
+        if ch_count_type == ChCountType.Needed:
+            # Selects only tasks after the last failed attempt
+            query += (
+                "LEFT JOIN (SELECT run_name, proc_type, MAX(last_modified) AS failed_time "
+                "FROM state_history WHERE status=? GROUP BY run_name, proc_type) AS failed "
+                "ON failed.run_name = state.run_name AND failed.proc_type = state.proc_type "
+            )
+            params.append(const.Status.failed.value)
+        query += "WHERE (state.status=? OR state.status=?) "
+        params.extend([const.Status.completed.value, const.Status.killed_WCT.value])
+        if ch_count_type == ChCountType.Needed:
+            query += "AND (failed.failed_time IS NULL OR state.last_modified > failed.failed_time) "
+        query += "ORDER BY state.id"
+
+        return cur.execute(query, params).fetchall()
+
+    def get_progress_summary(self):
+        """Gets the number of completed tasks and the core hours used (counted as
+        ChCountType.Needed) for each fault and process type, from the progress
+        summary table that is maintained by update_entries_live.
+
+        Returns a list of (fault_name, proc_type, num_completed, core_hours) tuples
+        """
+        with connect_db_ctx(self._db_file) as cur:
+            self._check_progress_summary(cur)
+            return cur.execute(
+                "SELECT fault_name, proc_type, num_completed, core_hours "
+                "FROM progress_summary ORDER BY fault_name, proc_type"
+            ).fetchall()
+
+    @classmethod
+    def _check_progress_summary(cls, cur: sql.Cursor):
+        """Creates and fills the progress summary table,
+        if the db was created before the table existed"""
+        if (
+            cur.execute(
+                "SELECT COUNT(*) FROM sqlite_master "
+                "WHERE type='table' AND name='progress_summary'"
+            ).fetchone()[0]
+            == 0
+        ):
+            cls._rebuild_progress_summary(cur)
+
+    @classmethod
+    def _rebuild_progress_summary(cls, cur: sql.Cursor):
+        """(Re)creates the progress summary table from the state and job duration tables"""
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS `progress_summary` ("
+            "`fault_name` TEXT NOT NULL, "
+            "`proc_type` INTEGER NOT NULL, "
+            "`num_completed` INTEGER NOT NULL DEFAULT 0, "
+            "`core_hours` REAL NOT NULL DEFAULT 0, "
+            "PRIMARY KEY(`fault_name`, `proc_type`))"
+        )
+        cur.execute("DELETE FROM progress_summary")
+
+        summary = {}
+        for run_name, proc_type, n_completed in cur.execute(
+            "SELECT run_name, proc_type, COUNT(*) FROM state "
+            "WHERE status = ? GROUP BY run_name, proc_type",
+            (const.Status.completed.value,),
+        ).fetchall():
+            key = (simulation_structure.get_fault_from_realisation(run_name), proc_type)
+            summary.setdefault(key, [0, 0.0])[0] += n_completed
+        for (
+            run_name,
+            proc_type,
+            _,
+            _,
+            start_time,
+            end_time,
+            _,
+            cores,
+            _,
+            _,
+        ) in cls._select_core_hour_jobs(cur, ChCountType.Needed):
+            key = (simulation_structure.get_fault_from_realisation(run_name), proc_type)
+            summary.setdefault(key, [0, 0.0])[1] += cls._core_hours(
+                start_time, end_time, cores
+            )
+
+        cur.executemany(
+            "INSERT INTO progress_summary (fault_name, proc_type, num_completed, core_hours) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (fault_name, proc_type, n_completed, core_hours)
+                for (fault_name, proc_type), (
+                    n_completed,
+                    core_hours,
+                ) in summary.items()
+            ],
+        )
+
+    @staticmethod
+    def _core_hours(start_time: int, end_time: int, cores: int):
+        if start_time is None or end_time is None or cores is None:
+            return 0.0
+        return cores * (end_time - start_time) / 3600
+
+    @classmethod
+    def _task_progress(cls, cur: sql.Cursor, run_name: str, proc_type: int):
+        """Gets the number of completed attempts and the core hours (counted as
+        ChCountType.Needed, i.e. only the attempts after the last failed attempt)
+        of a task, its share of the progress summary"""
+        attempts = cur.execute(
+            "SELECT status, job_id, last_modified FROM state_history "
+            "WHERE run_name = ? AND proc_type = ?",
+            (run_name, proc_type),
+        ).fetchall()
+        failed_time = max(
+            (
+                last_modified
+                for status, _, last_modified in attempts
+                if status == const.Status.failed.value and last_modified is not None
+            ),
+            default=None,
+        )
+
+        n_completed, core_hours = 0, 0.0
+        for status, job_id, last_modified in attempts:
+            if status == const.Status.completed.value:
+                n_completed += 1
+            if status not in (
+                const.Status.completed.value,
+                const.Status.killed_WCT.value,
+            ) or not (failed_time is None or last_modified > failed_time):
+                continue
+            # Only the first job duration entry of each job, as get_job_duration_info
+            job_duration = cur.execute(
+                "SELECT start_time, end_time, cores FROM job_duration_history "
+                "WHERE job_id = ? ORDER BY id LIMIT 1",
+                (job_id,),
+            ).fetchone()
+            if job_duration is not None:
+                core_hours += cls._core_hours(*job_duration)
+        return n_completed, core_hours
+
+    @classmethod
+    def _update_progress_summary(
+        cls,
+        cur: sql.Cursor,
+        run_name: str,
+        proc_type: int,
+        previous_progress: Tuple[int, float],
+    ):
+        """Updates the progress summary for a task that has just been set to
+        completed, killed_WCT or failed, with the change of its share of the summary
+        since previous_progress (as given by _task_progress before the update).
+        Has to be called after the job duration log has been updated."""
+        n_completed, core_hours = cls._task_progress(cur, run_name, proc_type)
+        if (n_completed, core_hours) == previous_progress:
+            return
+        cur.execute(
+            "INSERT INTO progress_summary (fault_name, proc_type, num_completed, core_hours) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT(fault_name, proc_type) DO UPDATE SET "
+            "num_completed = num_completed + excluded.num_completed, "
+            "core_hours = core_hours + excluded.core_hours",
+            (
+                simulation_structure.get_fault_from_realisation(run_name),
+                proc_type,
+                n_completed - previous_progress[0],
+                core_hours - previous_progress[1],
+            ),
+        )
+
     def get_job_duration_info(self, job_id: int):
         with connect_db_ctx(self._db_file) as cur:
             return cur.execute(
-                "SELECT * from job_duration_log WHERE job_id=?",
+                f"SELECT {', '.join(JOB_DURATION_COLUMNS)} from job_duration_history "
+                "WHERE job_id=?",
                 (job_id,),
             ).fetchone()
 
@@ -358,6 +650,15 @@ class MgmtDB:
                 failure_count.update({key: {"killed_WCT": 0, "failed": 0}})
             failure_count[key][state] += 1
 
+        with connect_db_ctx(self._db_file) as cur:
+            for run_name, proc_type, n_failed, n_killed_wct in cur.execute(
+                "SELECT run_name, proc_type, n_failed, n_killed_wct FROM retry_count"
+            ).fetchall():
+                key = f"{run_name}__{proc_type}"
+                if key in failure_count.keys():
+                    failure_count[key]["failed"] += n_failed
+                    failure_count[key]["killed_WCT"] += n_killed_wct
+
         for key, fail_count in failure_count.items():
             if any([x >= n_max_retries for x in fail_count.values()]):
                 continue
@@ -378,6 +679,74 @@ class MgmtDB:
                 with connect_db_ctx(self._db_file) as cur:
                     self._insert_task(cur, run_name, proc_type)
 
+    def archive(self):
+        """Moves the failed and killed_WCT attempts of tasks that have a newer attempt
+        (i.e. have been retried) and their job duration logs to the archive tables,
+        so that the queries on the live tables don't have to scan the history of
+        every task. The number of archived attempts of each task is kept in the
+        retry_count table.
+
+        Returns the number of archived attempts
+        """
+        state_columns = ", ".join(STATE_COLUMNS)
+        job_duration_columns = ", ".join(JOB_DURATION_COLUMNS)
+        with connect_db_ctx(self._db_file) as cur:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS archive_ids (id INTEGER PRIMARY KEY)"
+            )
+            cur.execute("DELETE FROM temp.archive_ids")
+            n_archived = cur.execute(
+                "INSERT INTO temp.archive_ids (id) SELECT s.id FROM state s "
+                "WHERE s.status IN (?, ?) AND EXISTS (SELECT 1 FROM state newer "
+                "WHERE newer.run_name = s.run_name AND newer.proc_type = s.proc_type "
+                "AND newer.id > s.id)",
+                (const.Status.failed.value, const.Status.killed_WCT.value),
+            ).rowcount
+            if n_archived == 0:
+                return 0
+
+            cur.execute(
+                "INSERT INTO retry_count (run_name, proc_type, n_failed, n_killed_wct) "
+                "SELECT run_name, proc_type, SUM(status = ?), SUM(status = ?) FROM state "
+                "WHERE id IN temp.archive_ids GROUP BY run_name, proc_type "
+                "ON CONFLICT(run_name, proc_type) DO UPDATE SET "
+                "n_failed = n_failed + excluded.n_failed, "
+                "n_killed_wct = n_killed_wct + excluded.n_killed_wct",
+                (const.Status.failed.value, const.Status.killed_WCT.value),
+            )
+
+            archived_jobs = (
+                "job_id IN (SELECT job_id FROM state WHERE id IN temp.archive_ids)"
+            )
+            cur.execute(
+                f"INSERT INTO job_duration_log_archive ({job_duration_columns}) "
+                f"SELECT {job_duration_columns} FROM job_duration_log WHERE {archived_jobs}"
+            )
+            cur.execute(f"DELETE FROM job_duration_log WHERE {archived_jobs}")
+            cur.execute(
+                f"INSERT INTO state_archive ({state_columns}) "
+                f"SELECT {state_columns} FROM state WHERE id IN temp.archive_ids"
+            )
+            cur.execute("DELETE FROM state WHERE id IN temp.archive_ids")
+        return n_archived
+
+    def optimise(self, vacuum_free_fraction: float = VACUUM_FREE_FRACTION):
+        """Updates the statistics used by the query planner, and rebuilds the
+        db file if more than vacuum_free_fraction of its pages are unused,
+        e.g. after archiving.
+
+        Returns True if the db file was rebuilt
+        """
+        with connect_db_ctx(self._db_file) as cur:
+            cur.execute("ANALYZE")
+            page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+            freelist_count = cur.execute("PRAGMA freelist_count").fetchone()[0]
+            if page_count > 0 and freelist_count / page_count > vacuum_free_fraction:
+                cur.execute("VACUUM")
+                return True
+        return False
+
     def close_conn(self):
         """Close the db connection. Note, this ONLY has to be done if
         update_entries_live was used. In all other scenarios the connection is
@@ -392,6 +761,17 @@ class MgmtDB:
             allowed_states=[const.Status.queued, const.Status.running],
         )
 
+    @staticmethod
+    def _run_name_condition(run_name: str, matcher: ComparisonOperator):
+        """Gets the condition and parameters for selecting tasks by run_name.
+        Uses the is_median column for the realisation/median only patterns
+        and no condition for the match all pattern, so the indexes can be used"""
+        if run_name == REL_ONLY_PATTERN and matcher != ComparisonOperator.EXACT:
+            return "is_median = ?", [int(matcher == ComparisonOperator.NOTLIKE)]
+        if run_name == "%" and matcher == ComparisonOperator.LIKE:
+            return "1", []
+        return f"run_name {matcher.value} ?", [run_name]
+
     def get_runnable_tasks(
         self,
         allowed_rels,
@@ -408,13 +788,13 @@ class MgmtDB:
         """
         if allowed_tasks is None:
             allowed_tasks = list(const.ProcessType)
-        allowed_tasks = [str(task.value) for task in allowed_tasks]
+        allowed_tasks = [task.value for task in allowed_tasks]
 
         if len(allowed_tasks) == 0:
             return []
 
         runnable_tasks = []
-        offset = 0
+        last_id = 0
 
         tasks_waiting_for_updates = []
         # To prevent running a task that has already been submitted, but yet to be posted to the db,
@@ -424,56 +804,88 @@ class MgmtDB:
             tasks_waiting_for_updates.append(f"{run_name}__{proc_type}")
         # each entry is {timestamp}.{run_name}.{proc_type} format. convert to "{run name}__{proc_type}" format
 
-        with connect_db_ctx(self._db_file) as cur:
-            entries = cur.execute(
-                """SELECT COUNT(*) 
-                          FROM status_enum, state 
-                          WHERE state.status = status_enum.id
-                           AND proc_type IN (?{})
-                           AND run_name {} (?)
-                           AND status_enum.state = 'created'""".format(
-                    ",?" * (len(allowed_tasks) - 1), matcher.value
-                ),
-                (*allowed_tasks, allowed_rels),
-            ).fetchone()[0]
-
-        while len(runnable_tasks) < task_limit and offset < entries:
+        run_name_condition, run_name_params = self._run_name_condition(
+            allowed_rels, matcher
+        )
+        while len(runnable_tasks) < task_limit:
             with connect_db_ctx(self._db_file) as cur:
+                # Pages through the created tasks by id, which avoids rescanning
+                # the skipped rows of an OFFSET
                 db_tasks = cur.execute(
-                    """SELECT proc_type, run_name 
-                              FROM status_enum, state 
-                              WHERE state.status = status_enum.id
-                               AND proc_type IN (?{})
-                               AND run_name {} (?)
-                                   AND status_enum.state = 'created'
-                                   LIMIT 100 OFFSET ?""".format(
-                        ",?" * (len(allowed_tasks) - 1), matcher.value
+                    f"""SELECT id, proc_type, run_name, fault_name
+                              FROM state
+                              WHERE proc_type IN (?{",?" * (len(allowed_tasks) - 1)})
+                               AND status = ?
+                               AND {run_name_condition}
+                               AND id > ?
+                              ORDER BY id
+                              LIMIT 100""",
+                    (
+                        *allowed_tasks,
+                        const.Status.created.value,
+                        *run_name_params,
+                        last_id,
                     ),
-                    (*allowed_tasks, allowed_rels, offset),
                 ).fetchall()
-            for task in db_tasks:
+                if len(db_tasks) == 0:
+                    break
+                last_id = db_tasks[-1][0]
+
+                completed_tasks = self._get_completed_tasks(
+                    cur,
+                    [(run_name, fault_name) for _, _, run_name, fault_name in db_tasks],
+                )
+            for _, proc_type, run_name, fault_name in db_tasks:
+                task = (proc_type, run_name)
                 # task is a tuple like (11, 'TaieriR_REL21'), tasks_waiting_for_updates is a list of strings like ['TaieriR_REL21__11']
                 if (
-                    self._check_dependancy_met(task, logger)
-                    and f"{task[1]}__{task[0]}" not in tasks_waiting_for_updates
+                    self._dependencies_met(
+                        task,
+                        completed_tasks.get(run_name, []),
+                        completed_tasks.get(fault_name, []),
+                        logger,
+                    )
+                    and f"{run_name}__{proc_type}" not in tasks_waiting_for_updates
                 ):
                     runnable_tasks.append(
                         (*task, self.get_retries(*task, get_WCT=True))
                     )
 
-            offset += 100
-
         return runnable_tasks
 
+    @staticmethod
+    def _get_completed_tasks(cur: sql.Cursor, run_fault_names: List[Tuple[str, str]]):
+        """Gets the completed process types of the given realisations and of
+        the medians of their faults, using a single query
+
+        Returns a dictionary {run_name: list of completed process types}
+        """
+        run_names = list({run_name for run_name, _ in run_fault_names})
+        fault_names = list({fault_name for _, fault_name in run_fault_names})
+        completed_tasks = {}
+        for run_name, proc_type in cur.execute(
+            f"""SELECT run_name, proc_type
+                      FROM state
+                      WHERE status = ?
+                       AND (run_name IN (?{",?" * (len(run_names) - 1)})
+                        OR (is_median = 1 AND fault_name IN (?{",?" * (len(fault_names) - 1)})))""",
+            (const.Status.completed.value, *run_names, *fault_names),
+        ):
+            completed_tasks.setdefault(run_name, []).append(proc_type)
+        return completed_tasks
+
     def num_task_complete(
         self, task, matcher: ComparisonOperator = ComparisonOperator.EXACT
     ):
         process, run_name = task
 
-        query = f"SELECT COUNT (*) FROM state WHERE run_name {matcher.value} ? AND proc_type = ? AND status = ?"
+        run_name_condition, run_name_params = self._run_name_condition(
+            run_name, matcher
+        )
+        query = f"SELECT COUNT (*) FROM state WHERE proc_type = ? AND status = ? AND {run_name_condition}"
         with connect_db_ctx(self._db_file) as cur:
             completed_tasks = cur.execute(
-                query, (run_name, process, const.Status.completed.value)
+                query, (process, const.Status.completed.value, *run_name_params)
             ).fetchone()[0]
         return completed_tasks
 
@@ -483,35 +895,36 @@ class MgmtDB:
     def _check_dependancy_met(self, task, logger=get_basic_logger()):
         """Checks if all dependencies for the specified are met"""
         process, run_name = task
-        median_name = simulation_structure.get_fault_from_realisation(run_name)
-        process = Process(process)
+        fault_name, _ = self._get_fault_columns(run_name)
 
         with connect_db_ctx(self._db_file) as cur:
-            completed_rel_tasks = cur.execute(
-                """SELECT proc_type 
-                          FROM status_enum, state 
-                          WHERE state.status = status_enum.id
-                           AND run_name = (?)
-                           AND status_enum.state = 'completed'""",
-                (run_name,),
-            ).fetchall()
-        with connect_db_ctx(self._db_file) as cur:
-            completed_median_tasks = cur.execute(
-                """SELECT proc_type 
-                          FROM status_enum, state 
-                          WHERE state.status = status_enum.id
-                           AND run_name = (?)
-                           AND status_enum.state = 'completed'""",
-                (median_name,),
-            ).fetchall()
+            completed_tasks = self._get_completed_tasks(cur, [(run_name, fault_name)])
+        return self._dependencies_met(
+            task,
+            completed_tasks.get(run_name, []),
+            completed_tasks.get(fault_name, []),
+            logger,
+        )
+
+    @staticmethod
+    def _dependencies_met(
+        task,
+        completed_rel_tasks: List[int],
+        completed_median_tasks: List[int],
+        logger=get_basic_logger(),
+    ):
+        """Checks if all dependencies for the specified task are met,
+        given the completed process types of its realisation and median"""
+        process, run_name = task
+        process = Process(process)
         logger.debug(
             f"Considering task {process} for realisation {run_name}. Completed realisation tasks as follows: {completed_rel_tasks}. Completed median tasks as follows: {completed_median_tasks}"
         )
         completed_deps = [
-            const.Dependency(x[0], dependency_target=const.DependencyTarget.REL)
+            const.Dependency(x, dependency_target=const.DependencyTarget.REL)
             for x in completed_rel_tasks
         ] + [
-            const.Dependency(x[0], dependency_target=const.DependencyTarget.MEDIAN)
+            const.Dependency(x, dependency_target=const.DependencyTarget.MEDIAN)
             for x in completed_median_tasks
         ]
         remaining_deps = process.get_remaining_dependencies(completed_deps)
@@ -521,7 +934,8 @@ class MgmtDB:
     def _update_entry(
         self, cur: sql.Cursor, entry: SchedulerTask, logger: Logger = get_basic_logger()
     ):
-        """Updates all fields that have a value for the specific entry"""
+        """Updates all fields that have a value for the specific entry
+        Returns the number of updated state entries"""
         if entry.status == const.Status.queued.value:
             logger.debug(
                 f"Got entry {entry} with status queued. Setting status and job id in the db"
@@ -560,9 +974,10 @@ class MgmtDB:
                 "WHERE run_name = ? AND proc_type = ? and status < ?",
                 (entry.status, entry.run_name, entry.proc_type, entry.status),
             )
-        if cur.rowcount > 1:
+        n_updated = cur.rowcount
+        if n_updated > 1:
             logger.warning(
-                f"Last database update caused {cur.rowcount} entries to be updated"
+                f"Last database update caused {n_updated} entries to be updated"
             )
         if entry.error is not None:
             cur.execute(
@@ -571,6 +986,7 @@ class MgmtDB:
                   (SELECT id from state WHERE proc_type = ? AND run_name = ?), ?)""",
                 (entry.proc_type, entry.run_name, entry.error),
             )
+        return n_updated
 
     def populate(self, realisations, fault_selection: Dict[str, int]):
         """Initial population of the database with all realisations"""
@@ -591,22 +1007,82 @@ class MgmtDB:
                     """select * from proc_type_enum"""
                 ).fetchall()
 
-                for run_name in realisations:
-                    for proc in procs_to_be_done:
-                        if not self._does_task_exists(cur, run_name, proc[0]):
-                            self._insert_task(cur, run_name, proc[0])
+            self.insert_tasks(
+                [
+                    (run_name, proc[0])
+                    for run_name in realisations
+                    for proc in procs_to_be_done
+                ]
+            )
+
+    def insert_tasks(self, tasks: List[Tuple[str, int]]):
+        """Bulk inserts tasks into the mgmt db, tasks that already have
+        an entry that has not failed are skipped.
+
+        All tasks are inserted with a single executemany in one transaction,
+        with synchronous writes turned off. If the load is larger than the current
+        state table, the state indexes are dropped before and rebuilt after the load.
+
+        Parameters
+        ----------
+        tasks: List[Tuple[str, int]]
+            The (run_name, proc_type) of the tasks to insert
+
+        Returns
+        -------
+        int
+            The number of inserted tasks
+        """
+        with connect_db_ctx(self._db_file, pragmas=["synchronous = OFF"]) as cur:
+            # Hold the write lock from the start, so the existing tasks can't change
+            cur.execute("BEGIN IMMEDIATE")
+            existing_tasks = set(
+                cur.execute(
+                    "SELECT run_name, proc_type FROM state WHERE status <> ?",
+                    (const.Status.failed.value,),
+                ).fetchall()
+            )
+            new_tasks = [
+                task for task in dict.fromkeys(tasks) if task not in existing_tasks
+            ]
+            if len(new_tasks) == 0:
+                return 0
+
+            n_rows = cur.execute("SELECT COUNT(*) FROM state").fetchone()[0]
+            indexes = []
+            if len(new_tasks) > n_rows:
+                # Autoindexes (UNIQUE constraints) have no sql and can't be dropped
+                indexes = cur.execute(
+                    "SELECT name, sql FROM sqlite_master "
+                    "WHERE type='index' AND tbl_name='state' AND sql IS NOT NULL"
+                ).fetchall()
+                for index_name, _ in indexes:
+                    cur.execute(f"DROP INDEX `{index_name}`")
+
+            cur.executemany(
+                """INSERT OR IGNORE INTO `state`(run_name, proc_type, status, 
+                last_modified, fault_name, is_median) VALUES(?, ?, 1, strftime('%s','now'), ?, ?)""",
+                [
+                    (run_name, proc_type, *self._get_fault_columns(run_name))
+                    for run_name, proc_type in new_tasks
+                ],
+            )
+
+            for _, index_sql in indexes:
+                cur.execute(index_sql)
+        return len(new_tasks)
 
     def insert(self, run_name: str, proc_type: int):
         """Inserts a task into the mgmt db"""
         with connect_db_ctx(self._db_file) as cur:
             self._insert_task(cur, run_name, proc_type)
 
-    @staticmethod
-    def _insert_task(cur: sql.Cursor, run_name: str, proc_type: int):
+    @classmethod
+    def _insert_task(cls, cur: sql.Cursor, run_name: str, proc_type: int):
         cur.execute(
             """INSERT OR IGNORE INTO `state`(run_name, proc_type, status, 
-            last_modified) VALUES(?, ?, 1, strftime('%s','now'))""",
-            (run_name, proc_type),
+            last_modified, fault_name, is_median) VALUES(?, ?, 1, strftime('%s','now'), ?, ?)""",
+            (run_name, proc_type, *cls._get_fault_columns(run_name)),
         )
 
     @staticmethod
@@ -660,6 +1136,59 @@ class MgmtDB:
             (end_time, job_id),
         )
 
+    @classmethod
+    def migrate(cls, cur: sql.Cursor):
+        """Migrates a db created with an older version of the schema, adds the
+        fault_name and is_median columns to the state table, the archive tables
+        and the missing indexes. Does nothing if the db is up to date."""
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(state)")]
+        if any(column not in columns for column in STATE_MIGRATION_COLUMNS):
+            # Lock the db, so only one process performs the migration
+            cur.execute("BEGIN IMMEDIATE")
+            columns = [row[1] for row in cur.execute("PRAGMA table_info(state)")]
+            for column, column_type in STATE_MIGRATION_COLUMNS.items():
+                if column not in columns:
+                    cur.execute(
+                        f"ALTER TABLE state ADD COLUMN `{column}` {column_type}"
+                    )
+            cur.executemany(
+                "UPDATE state SET fault_name = ?, is_median = ? WHERE run_name = ?",
+                [
+                    (*cls._get_fault_columns(run_name), run_name)
+                    for (run_name,) in cur.execute(
+                        "SELECT DISTINCT run_name FROM state"
+                    ).fetchall()
+                ],
+            )
+
+        schema_names = [
+            row[0]
+            for row in cur.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"
+            )
+        ]
+        for name, create_sql in ARCHIVE_SCHEMA.items():
+            if name not in schema_names:
+                cur.execute(create_sql)
+
+        indexes = [
+            row[0]
+            for row in cur.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='state'"
+            )
+        ]
+        for index_name, index_columns in STATE_INDEXES.items():
+            if index_name not in indexes:
+                cur.execute(
+                    f"CREATE INDEX IF NOT EXISTS `{index_name}` ON state ({', '.join(index_columns)})"
+                )
+
+    @staticmethod
+    def _get_fault_columns(run_name: str):
+        """Gets the fault_name and is_median column values for the run_name"""
+        fault_name = simulation_structure.get_fault_from_realisation(run_name)
+        return fault_name, int(fault_name == run_name)
+
     @classmethod
     def init_db(cls, db_file: str, init_script: str):
         with connect_db_ctx(Path(db_file)) as cur:
@@ -0,0 +1,145 @@
+"""Core-hour budget and backfill aware admission of jobs for auto_submit.
+
+n_runs only limits the number of submitted jobs per machine, regardless of their
+size. With auto_submit --admission_control, the admission controller additionally
+limits the requested cores and the estimated core hours of the submitted (queued or
+running) jobs of each machine, with the budgets given by the ADMISSION_CONTROL entry
+of the platform config:
+    max_cores       Maximum number of requested cores in flight
+    max_core_hours  Maximum number of estimated core hours in flight
+    backfill_window Jobs with an estimated run time (hours) of at most this fit the
+                    backfill window of the scheduler
+    backfill_cores  Number of cores above max_cores that short (backfill) jobs can use
+
+No platform config sets budgets by default, they depend on the allocation and
+fair share of the project. E.g.
+    "ADMISSION_CONTROL": {"maui": {"max_cores": 4000, "max_core_hours": 40000,
+                                   "backfill_window": 1.0, "backfill_cores": 800}}
+
+Jobs that don't fit the budget are skipped, so smaller jobs further down the list of
+runnable tasks can fill the gap. Short jobs are admitted over the budget, as long as
+they fit the backfill cores, as the scheduler can start them in the gaps before the
+next large job.
+
+Jobs are sized with the estimates of the estimate_wct models (e.g. from
+estimate_cybershake.py --output), tasks without an estimate use the default number
+of cores of the platform config and DEFAULT_RUN_TIME.
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+import qcore.constants as const
+
+from workflow.automation.lib.task_priority import DEFAULT_RUN_TIME
+from workflow.automation.platform_config import (
+    HPC,
+    get_target_machine,
+    platform_config,
+)
+
+ADMISSION_CONTROL_KEY = "ADMISSION_CONTROL"
+
+# Estimated (run time (hours), number of cores) of each (run_name, process) task
+TaskEstimates = Dict[Tuple[str, const.ProcessType], Tuple[float, int]]
+
+# The platform config keys of the default number of cores of each process type
+DEFAULT_N_CORES_KEYS = {
+    const.ProcessType.EMOD3D: const.PLATFORM_CONFIG.LF_DEFAULT_NCORES.name,
+    const.ProcessType.HF: const.PLATFORM_CONFIG.HF_DEFAULT_NCORES.name,
+    const.ProcessType.BB: const.PLATFORM_CONFIG.BB_DEFAULT_NCORES.name,
+    const.ProcessType.IM_calculation: const.PLATFORM_CONFIG.IM_CALC_DEFAULT_N_CORES.name,
+    const.ProcessType.merge_ts: const.PLATFORM_CONFIG.MERGE_TS_DEFAULT_NCORES.name,
+    const.ProcessType.VM_PERT: const.PLATFORM_CONFIG.VM_PERT_DEFAULT_NCORES.name,
+}
+
+
+@dataclass
+class MachineBudget:
+    max_cores: int = None
+    max_core_hours: float = None
+    backfill_window: float = 0.0
+    backfill_cores: int = 0
+
+
+def load_budgets(config: Dict = platform_config) -> Dict[HPC, MachineBudget]:
+    """Loads the budget of each machine from the platform config,
+    machines without a budget are not limited"""
+    return {
+        HPC[machine]: MachineBudget(**budget)
+        for machine, budget in config.get(ADMISSION_CONTROL_KEY, {}).items()
+    }
+
+
+def get_default_n_cores(proc_type: const.ProcessType, config: Dict = platform_config):
+    key = DEFAULT_N_CORES_KEYS.get(proc_type)
+    return 1 if key is None else int(config.get(key, 1))
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        budgets: Dict[HPC, MachineBudget],
+        estimates: TaskEstimates = None,
+        default_run_time: float = DEFAULT_RUN_TIME,
+    ):
+        """
+        budgets: The budget of each machine, machines without a budget are not limited
+        estimates: The estimated run time and number of cores of the tasks
+        """
+        self.budgets = budgets
+        self.estimates = {} if estimates is None else estimates
+        self.default_run_time = default_run_time
+        self.cores = {hpc: 0 for hpc in HPC}
+        self.core_hours = {hpc: 0.0 for hpc in HPC}
+
+    def size(self, run_name: str, proc_type: const.ProcessType) -> Tuple[int, float]:
+        """The number of cores and run time (hours) of the job of a task"""
+        proc_type = const.ProcessType(proc_type)
+        run_time, n_cores = self.estimates.get((run_name, proc_type), (np.nan, np.nan))
+        if np.isnan(run_time):
+            run_time = self.default_run_time
+        if np.isnan(n_cores):
+            n_cores = get_default_n_cores(proc_type)
+        return int(n_cores), float(run_time)
+
+    def reset(self, submitted_tasks: Iterable[Tuple[str, int]]):
+        """Sets the jobs in flight to the given (run_name, proc_type) tasks,
+        i.e. the queued and running tasks of the mgmt db"""
+        self.cores = {hpc: 0 for hpc in HPC}
+        self.core_hours = {hpc: 0.0 for hpc in HPC}
+        for run_name, proc_type in submitted_tasks:
+            self._add(get_target_machine(proc_type), *self.size(run_name, proc_type))
+
+    def _add(self, hpc: HPC, n_cores: int, run_time: float):
+        self.cores[hpc] += n_cores
+        self.core_hours[hpc] += n_cores * run_time
+
+    def fits(self, run_name: str, proc_type: const.ProcessType) -> bool:
+        """Checks if the job of the task fits the budget of its machine,
+        or the backfill window. Jobs always fit an idle machine, so jobs larger than
+        the budget still run"""
+        proc_type = const.ProcessType(proc_type)
+        hpc = get_target_machine(proc_type)
+        budget = self.budgets.get(hpc)
+        if budget is None or self.cores[hpc] == 0:
+            return True
+        n_cores, run_time = self.size(run_name, proc_type)
+        cores = self.cores[hpc] + n_cores
+
+        if (budget.max_cores is None or cores <= budget.max_cores) and (
+            budget.max_core_hours is None
+            or self.core_hours[hpc] + n_cores * run_time <= budget.max_core_hours
+        ):
+            return True
+        return run_time <= budget.backfill_window and (
+            budget.max_cores is None
+            or cores <= budget.max_cores + budget.backfill_cores
+        )
+
+    def admit(self, run_name: str, proc_type: const.ProcessType) -> bool:
+        """Adds the job of the task to the jobs in flight if it fits"""
+        if not self.fits(run_name, proc_type):
+            return False
+        self._add(get_target_machine(proc_type), *self.size(run_name, proc_type))
+        return True
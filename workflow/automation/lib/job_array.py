@@ -0,0 +1,186 @@
+"""Submission of per realisation tasks as job arrays.
+
+Instead of submitting the script of every realisation as its own job, the scripts of
+tasks with the same process type and resource shape (the scheduler header, i.e. the
+number of cores, nodes and memory) are submitted as one job array, with the longest
+wall clock time of its tasks. Array task i runs the script of the i-th realisation, which is recorded in the mgmt
+db with the job id <array job id>_<i> (see get_array_task_job_id).
+"""
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from logging import Logger
+from typing import Dict, List, Tuple
+
+import qcore.constants as const
+import qcore.simulation_structure as sim_struct
+from qcore import qclogging
+
+from workflow.automation.lib.schedulers.abstractscheduler import get_array_task_job_id
+from workflow.automation.lib.schedulers.scheduler_factory import Scheduler
+from workflow.automation.lib.shared_automated_workflow import add_to_queue
+from workflow.automation.lib.shared_template import (
+    convert_time_to_hours,
+    generate_context,
+    write_to_file,
+)
+from workflow.automation.platform_config import platform_config
+
+# The process types whose tasks can be submitted as job arrays
+ARRAY_PROCESSES = (
+    const.ProcessType.HF,
+    const.ProcessType.BB,
+    const.ProcessType.IM_calculation,
+)
+ARRAY_TEMPLATE = "job_array.sl.template"
+ARRAY_DIR_NAME = "job_arrays"
+HEADER_END = "## END HEADER"
+WCT_DIRECTIVE = "--time"
+# Slurms default MaxArraySize is 1001
+DEFAULT_MAX_ARRAY_SIZE = 1000
+
+
+@dataclass
+class ArrayTask:
+    run_name: str
+    sim_dir: str
+    script: str
+    header: List[str]
+
+
+def read_header(script: str) -> List[str]:
+    """Reads the scheduler header of a script, up to the end of header marker"""
+    header = []
+    with open(script, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            header.append(line)
+            if line.strip() == HEADER_END:
+                break
+    return header
+
+
+def get_resource_shape(header: List[str]) -> Tuple[str]:
+    """The directives of a header that determine the resources of the job,
+    i.e. all but the job name and wall clock time"""
+    return tuple(
+        line.strip()
+        for line in header
+        if line.startswith("#SBATCH")
+        and "--job-name" not in line
+        and WCT_DIRECTIVE not in line
+    )
+
+
+def get_wct(header: List[str]) -> float:
+    """The wall clock time (hours) of a header, 0 if it has none"""
+    for line in header:
+        if line.startswith("#SBATCH") and WCT_DIRECTIVE in line:
+            value = line.split(WCT_DIRECTIVE, 1)[1].lstrip("= ").split()[0]
+            return convert_time_to_hours(value)
+    return 0.0
+
+
+class JobArrayBuilder:
+    def __init__(
+        self,
+        root_folder: str,
+        max_array_size: int = DEFAULT_MAX_ARRAY_SIZE,
+        logger: Logger = qclogging.get_basic_logger(),
+    ):
+        """
+        root_folder: The cybershake root folder, the array scripts and logs are written
+            to its job_arrays directory
+        max_array_size: Groups with more tasks are submitted as multiple arrays
+        """
+        self.root_folder = root_folder
+        self.array_dir = os.path.join(root_folder, ARRAY_DIR_NAME)
+        self.max_array_size = max_array_size
+        self.logger = logger
+        self._groups: Dict[Tuple, List[ArrayTask]] = defaultdict(list)
+
+    def __len__(self):
+        return sum(len(tasks) for tasks in self._groups.values())
+
+    def add(
+        self,
+        proc_type: const.ProcessType,
+        run_name: str,
+        sim_dir: str,
+        script: str,
+        target_machine: str = None,
+    ):
+        """Adds the (not yet submitted) script of a task to the array of its
+        process type, target machine and resource shape"""
+        header = read_header(script)
+        key = (const.ProcessType(proc_type), target_machine, get_resource_shape(header))
+        self._groups[key].append(ArrayTask(run_name, sim_dir, script, header))
+
+    def submit(self) -> List[str]:
+        """Submits the arrays of all added tasks and adds the queued entries of their
+        tasks to the mgmt db queue. Returns the array job ids"""
+        queue_folder = sim_struct.get_mgmt_db_queue(self.root_folder)
+        os.makedirs(self.array_dir, exist_ok=True)
+
+        array_job_ids = []
+        for key, tasks in self._groups.items():
+            proc_type, target_machine, _ = key
+            for start in range(0, len(tasks), self.max_array_size):
+                array_tasks = tasks[start : start + self.max_array_size]
+                # The header of the longest task, they only differ in the WCT
+                header = max((task.header for task in array_tasks), key=get_wct)
+                script = self._write_array_script(proc_type, header, array_tasks)
+                array_job_id = Scheduler.get_scheduler().submit_array_job(
+                    self.array_dir, script, len(array_tasks), target_machine
+                )
+                self.logger.info(
+                    f"Submitted {len(array_tasks)} {proc_type.str_value} tasks "
+                    f"as job array {array_job_id}"
+                )
+                for index, task in enumerate(array_tasks):
+                    add_to_queue(
+                        queue_folder,
+                        task.run_name,
+                        proc_type.value,
+                        const.Status.queued.value,
+                        job_id=get_array_task_job_id(array_job_id, index),
+                        logger=self.logger,
+                    )
+                array_job_ids.append(array_job_id)
+
+        self._groups.clear()
+        return array_job_ids
+
+    def _write_array_script(
+        self, proc_type: const.ProcessType, header: List[str], tasks: List[ArrayTask]
+    ):
+        script_extension = Scheduler.get_scheduler().SCRIPT_EXTENSION
+        header = [
+            (
+                f"#SBATCH --job-name={proc_type.str_value}_array"
+                if line.startswith("#SBATCH") and "--job-name" in line
+                else line
+            )
+            for line in header
+        ]
+        body = generate_context(
+            platform_config[const.PLATFORM_CONFIG.SCHEDULER_TEMPLATES_DIR.name],
+            ARRAY_TEMPLATE,
+            {
+                "scripts": [task.script for task in tasks],
+                "sim_dirs": [task.sim_dir for task in tasks],
+                "script_extension": script_extension,
+            },
+        )
+        script = os.path.join(
+            self.array_dir,
+            "{}_array_{}_{}.{}".format(
+                proc_type.str_value,
+                datetime.now().strftime(const.TIMESTAMP_FORMAT),
+                tasks[0].run_name,
+                script_extension,
+            ),
+        )
+        write_to_file("\n".join(header + [body]), script)
+        return script
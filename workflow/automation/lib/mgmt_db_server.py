@@ -0,0 +1,336 @@
+"""Local server mode for the mgmt db.
+
+The mgmt db is a single SQLite file on the shared filesystem, and SQLite file
+locking over Lustre/NFS is slow and unreliable when several processes write to it.
+In server mode a single process owns the SQLite file (MgmtDB is the storage
+backend) and the other processes (queue_monitor, auto_submit, cybershake_progress)
+forward their MgmtDB calls to it over a Unix or TCP socket.
+
+All calls are executed in order by a single worker thread, so the db file is only
+ever accessed by one connection. Calls that arrive while the worker is busy are
+executed as one batch, consecutive update_entries_live calls of a batch are
+merged into a single call, i.e. a single transaction.
+
+While the server is running its address is written to a server file next to the
+db file, connect_mgmt_db uses it to decide between the server and the SQLite file.
+"""
+import inspect
+import json
+import os
+import queue
+import threading
+from logging import Logger
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Any, Dict, List, Tuple, Union
+
+from qcore.qclogging import get_basic_logger
+from workflow.automation.lib.MgmtDB import MgmtDB
+
+SERVER_FILENAME = "slurm_mgmt_server.json"
+FAMILY_UNIX = "AF_UNIX"
+FAMILY_TCP = "AF_INET"
+
+# The MgmtDB methods that can be called through the server
+SERVER_METHODS = (
+    "add_retries",
+    "archive",
+    "command_builder",
+    "get_core_hour_jobs",
+    "get_core_hour_states",
+    "get_job_duration_info",
+    "get_progress_summary",
+    "get_rel_names",
+    "get_retries",
+    "get_runnable_tasks",
+    "get_submitted_tasks",
+    "insert",
+    "insert_tasks",
+    "is_task_complete",
+    "num_task_complete",
+    "optimise",
+    "populate",
+    "update_entries_live",
+)
+BATCHED_METHOD = "update_entries_live"
+# Loggers can't be sent to the server, the server uses its own logger for them
+SERVER_LOGGER = "__server_logger__"
+
+# A call is (method name, args, kwargs), a reply is (succeeded, result or exception)
+Call = Tuple[str, Tuple, Dict[str, Any]]
+Reply = Tuple[bool, Any]
+
+
+def get_server_file(db_file: Union[str, Path]):
+    """The file holding the address of the server of the given db file"""
+    return Path(db_file).with_name(SERVER_FILENAME)
+
+
+class MgmtDBServer:
+    def __init__(
+        self,
+        db_file: Union[str, Path],
+        address: Union[str, Tuple[str, int]],
+        logger: Logger = get_basic_logger(),
+    ):
+        """
+        db_file: The SQLite mgmt db file served
+        address: Path of the Unix socket or (host, port) of the TCP socket to listen on.
+            Port 0 picks a free port
+        """
+        self.db_file = Path(db_file)
+        self.family = FAMILY_UNIX if isinstance(address, str) else FAMILY_TCP
+        self.logger = logger
+
+        # The connections are authenticated with a key only readable through the
+        # server file, so only the owner of the db can send (pickled) calls
+        self._authkey = os.urandom(32)
+        self._listener = Listener(address, self.family, authkey=self._authkey)
+        # The listener has no address once closed
+        self._address = self._listener.address
+        self._requests = queue.Queue()
+        self._running = False
+
+    @property
+    def address(self):
+        return self._address
+
+    def serve_forever(self):
+        """Writes the server file and serves requests until shutdown is called"""
+        self._running = True
+        worker = threading.Thread(target=self._work, daemon=True)
+        worker.start()
+
+        server_file = get_server_file(self.db_file)
+        fd = os.open(server_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                {
+                    "family": self.family,
+                    "address": self.address,
+                    "authkey": self._authkey.hex(),
+                },
+                f,
+            )
+        self.logger.info(f"Serving {self.db_file} on {self.address}")
+
+        try:
+            while True:
+                try:
+                    conn = self._listener.accept()
+                except (OSError, AuthenticationError):
+                    self.logger.warning("Rejected a mgmt db server connection")
+                    continue
+                if not self._running:
+                    # Woken up by shutdown
+                    conn.close()
+                    break
+                threading.Thread(
+                    target=self._handle_connection, args=(conn,), daemon=True
+                ).start()
+        finally:
+            self._running = False
+            self._listener.close()
+            if server_file.exists():
+                server_file.unlink()
+            self._requests.put(None)
+            worker.join()
+
+    def shutdown(self):
+        """Stops serve_forever, can be called from any thread and from signal handlers.
+        Does nothing if the server is not running"""
+        if not self._running:
+            return
+        self._running = False
+        # Closing the listener doesn't interrupt a blocking accept, connect to wake it
+        # up. The connection is authenticated within accept, so it is made from another
+        # thread in case shutdown is called by a signal handler of the serving thread
+        threading.Thread(target=self._wake_up, daemon=True).start()
+
+    def _wake_up(self):
+        try:
+            Client(self.address, self.family, authkey=self._authkey).close()
+        except (OSError, EOFError):
+            # serve_forever already stopped
+            pass
+
+    def _handle_connection(self, conn):
+        """Reads the batches of calls sent by a client and sends back the replies"""
+        replies = queue.Queue()
+        with conn:
+            while True:
+                try:
+                    calls = conn.recv()
+                except (EOFError, OSError):
+                    return
+                self._requests.put((calls, replies))
+                conn.send(replies.get())
+
+    def _work(self):
+        """Executes the requests of all clients. All requests that arrived while the
+        previous batch was executed are executed as the next batch"""
+        mgmt_db = MgmtDB(self.db_file)
+        try:
+            while True:
+                requests = [self._requests.get()]
+                while True:
+                    try:
+                        requests.append(self._requests.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in requests:
+                    requests.remove(None)
+                    self._execute(mgmt_db, requests)
+                    return
+                self._execute(mgmt_db, requests)
+        finally:
+            mgmt_db.close_conn()
+
+    def _execute(
+        self,
+        mgmt_db: MgmtDB,
+        requests: List[Tuple[List[Call], queue.Queue]],
+    ):
+        calls = [
+            (request_ix, call)
+            for request_ix, (request_calls, _) in enumerate(requests)
+            for call in request_calls
+        ]
+        replies: List[List[Reply]] = [[] for _ in requests]
+
+        i = 0
+        while i < len(calls):
+            request_ix, (method, args, kwargs) = calls[i]
+            if method == BATCHED_METHOD:
+                # Merge the following update_entries_live calls with the same arguments
+                entries, bound_args = _bind_update_entries_live(args, kwargs)
+                merged = [request_ix]
+                while i + len(merged) < len(calls):
+                    next_request_ix, (next_method, next_args, next_kwargs) = calls[
+                        i + len(merged)
+                    ]
+                    if next_method != BATCHED_METHOD:
+                        break
+                    next_entries, next_bound_args = _bind_update_entries_live(
+                        next_args, next_kwargs
+                    )
+                    if next_bound_args != bound_args:
+                        break
+                    entries = entries + next_entries
+                    merged.append(next_request_ix)
+                if len(merged) > 1:
+                    self.logger.debug(
+                        f"Merged {len(merged)} {BATCHED_METHOD} calls "
+                        f"with {len(entries)} entries"
+                    )
+                reply = self._call(mgmt_db, method, (entries,), bound_args)
+                for merged_request_ix in merged:
+                    replies[merged_request_ix].append(reply)
+                i += len(merged)
+            else:
+                replies[request_ix].append(self._call(mgmt_db, method, args, kwargs))
+                i += 1
+
+        for (_, reply_queue), request_replies in zip(requests, replies):
+            reply_queue.put(request_replies)
+
+    def _call(self, mgmt_db: MgmtDB, method: str, args: Tuple, kwargs: Dict) -> Reply:
+        if method not in SERVER_METHODS:
+            return False, AttributeError(f"{method} can't be called through the server")
+        args = [self._replace_logger(arg) for arg in args]
+        kwargs = {key: self._replace_logger(value) for key, value in kwargs.items()}
+        try:
+            return True, getattr(mgmt_db, method)(*args, **kwargs)
+        except Exception as e:
+            self.logger.exception(f"Mgmt db server call {method} failed")
+            # The traceback references the frames of the worker thread
+            return False, e.with_traceback(None)
+
+    def _replace_logger(self, arg):
+        if isinstance(arg, str) and arg == SERVER_LOGGER:
+            return self.logger
+        return arg
+
+
+def _bind_update_entries_live(args: Tuple, kwargs: Dict):
+    """Splits the arguments of an update_entries_live call into
+    the entries and the other arguments"""
+    bound = inspect.signature(MgmtDB.update_entries_live).bind(None, *args, **kwargs)
+    bound_args = dict(bound.arguments)
+    bound_args.pop("self")
+    return list(bound_args.pop("entries")), bound_args
+
+
+class MgmtDBClient:
+    """Forwards the MgmtDB calls to a MgmtDBServer, has the same interface as MgmtDB
+    for the methods in SERVER_METHODS"""
+
+    def __init__(
+        self, address: Union[str, Tuple[str, int]], family: str, authkey: bytes
+    ):
+        self._conn = Client(address, family, authkey=authkey)
+        # A connection can only be used by one thread at a time
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_server_file(cls, server_file: Union[str, Path]):
+        with open(server_file, "r") as f:
+            server = json.load(f)
+        address = server["address"]
+        return cls(
+            address if server["family"] == FAMILY_UNIX else tuple(address),
+            server["family"],
+            bytes.fromhex(server["authkey"]),
+        )
+
+    def call_batch(self, calls: List[Call]):
+        """Executes a list of (method name, args, kwargs) calls on the server in a
+        single request, returns their results. Raises the exception of the first call
+        that failed"""
+        with self._lock:
+            self._conn.send(calls)
+            replies = self._conn.recv()
+        results = []
+        for succeeded, result in replies:
+            if not succeeded:
+                raise result
+            results.append(result)
+        return results
+
+    def __getattr__(self, name: str):
+        if name not in SERVER_METHODS:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            args = tuple(
+                SERVER_LOGGER if isinstance(arg, Logger) else arg for arg in args
+            )
+            kwargs = {
+                key: SERVER_LOGGER if isinstance(value, Logger) else value
+                for key, value in kwargs.items()
+            }
+            return self.call_batch([(name, args, kwargs)])[0]
+
+        call.__name__ = name
+        return call
+
+    def close_conn(self):
+        self._conn.close()
+
+
+def connect_mgmt_db(
+    db_file: Union[str, Path], logger: Logger = get_basic_logger()
+) -> Union[MgmtDB, MgmtDBClient]:
+    """Connects to the server of the db file if one is running,
+    otherwise uses the SQLite db file directly"""
+    server_file = get_server_file(db_file)
+    if server_file.exists():
+        try:
+            return MgmtDBClient.from_server_file(server_file)
+        except (OSError, ValueError) as e:
+            logger.warning(
+                f"Failed to connect to the mgmt db server in {server_file}, "
+                f"using the db file directly: {e}"
+            )
+    return MgmtDB(db_file)
@@ -0,0 +1,473 @@
+"""Pack mode, many small realisation tasks run within one allocation.
+
+Small tasks (BB, IM_calc, rrup, clean_up) often need less than a node, but each
+job waits in the scheduler queue. In pack mode auto_submit submits a pack worker
+job for a process type instead, which pulls the runnable tasks of that process type
+from the mgmt db and runs their scripts concurrently within its allocation,
+as long as the cores, memory and the remaining wall clock time of the allocation
+allow it.
+
+Each task run by a worker is recorded in the mgmt db with its own job id,
+<worker job id>_p<n> (see get_pack_task_job_id), which queue_monitor maps back to the
+worker job when checking the scheduler queue. The task scripts post their
+running/completed/failed updates as usual, the worker only posts the queued update
+when it starts a task and a failed update if a task script exits with an error.
+
+Tasks are claimed by creating a claim file, so several workers of the same process
+type never run the same task. Claims expire with the allocation of their worker.
+Tasks whose wall clock time doesn't fit a whole allocation are marked as unpackable,
+auto_submit submits them as normal jobs instead.
+"""
+import json
+import os
+import re
+import shlex
+import subprocess
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from logging import Logger
+from typing import Dict, List, Tuple
+
+import qcore.constants as const
+import qcore.simulation_structure as sim_struct
+from qcore import qclogging
+
+from workflow.automation.estimation import estimate_wct
+from workflow.automation.lib.MgmtDB import ComparisonOperator
+from workflow.automation.lib.job_array import read_header
+from workflow.automation.lib.mgmt_db_server import connect_mgmt_db
+from workflow.automation.lib.schedulers.abstractscheduler import get_pack_task_job_id
+from workflow.automation.lib.schedulers.scheduler_factory import Scheduler
+from workflow.automation.lib.shared_automated_workflow import add_to_queue
+from workflow.automation.lib.shared_template import (
+    convert_time_to_hours,
+    generate_context,
+    resolve_header,
+    write_to_file,
+)
+from workflow.automation.platform_config import (
+    get_platform_node_requirements,
+    get_platform_specific_script,
+    get_target_machine,
+    platform_config,
+)
+from workflow.automation.submit.submit_bb import main as submit_bb_main
+from workflow.automation.submit.submit_sim_imcalc import submit_im_calc_slurm
+
+# The process types whose tasks can be run by a pack worker
+PACK_PROCESSES = (
+    const.ProcessType.BB,
+    const.ProcessType.IM_calculation,
+    const.ProcessType.rrup,
+    const.ProcessType.clean_up,
+)
+PACK_TEMPLATE = "pack_worker.sl.template"
+PACK_DIR_NAME = "pack_workers"
+CLAIMS_DIR_NAME = "claims"
+UNPACKABLE_DIR_NAME = "unpackable"
+
+# Memory (GB) of a task that doesn't request any
+DEFAULT_TASK_MEMORY = 2.0
+# Seconds between checks for finished and runnable tasks
+DEFAULT_POLL_INTERVAL = 30
+# Seconds without any running or runnable task after which the worker stops
+DEFAULT_IDLE_TIMEOUT = 300
+# Seconds at the end of the allocation in which no task is started
+END_MARGIN = 60
+
+MEMORY_UNITS = {"K": 1 / 1024**2, "M": 1 / 1024, "G": 1, "T": 1024}
+
+
+@dataclass
+class TaskResources:
+    n_cores: int = 1
+    memory: float = DEFAULT_TASK_MEMORY
+    wct: float = 0.0  # hours
+    n_tasks: int = 1
+    cpus_per_task: int = 1
+
+
+def parse_memory(memory: str) -> float:
+    """Parses a slurm memory size (e.g. 16G, default unit M) into GB"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([KMGT]?)B?", memory.strip().upper())
+    if match is None:
+        raise ValueError(f"Invalid memory size {memory}")
+    return float(match.group(1)) * MEMORY_UNITS[match.group(2) or "M"]
+
+
+def get_task_resources(
+    header: List[str], default_memory: float = DEFAULT_TASK_MEMORY
+) -> TaskResources:
+    """Gets the resources requested by the #SBATCH directives of a script header"""
+    options = {}
+    for line in header:
+        if line.startswith("#SBATCH"):
+            for option in line.split()[1:]:
+                key, _, value = option.lstrip("-").partition("=")
+                options[key] = value
+
+    resources = TaskResources(memory=default_memory)
+    resources.n_tasks = int(options.get("ntasks", 1))
+    resources.cpus_per_task = int(options.get("cpus-per-task", 1))
+    resources.n_cores = resources.n_tasks * resources.cpus_per_task
+    if "mem" in options:
+        resources.memory = parse_memory(options["mem"])
+    elif "mem-per-cpu" in options:
+        resources.memory = parse_memory(options["mem-per-cpu"]) * resources.n_cores
+    if "time" in options:
+        resources.wct = convert_time_to_hours(options["time"])
+    return resources
+
+
+def create_task_command(
+    proc_type: const.ProcessType,
+    run_name: str,
+    root_folder: str,
+    retries: int = 0,
+    logger: Logger = qclogging.get_basic_logger(),
+) -> List[str]:
+    """Creates the script of the task (without submitting it),
+    returns the command running it"""
+    sim_dir = sim_struct.get_sim_dir(root_folder, run_name)
+    if proc_type == const.ProcessType.BB:
+        script = submit_bb_main(
+            submit=False,
+            machine=get_target_machine(proc_type).name,
+            rel_dir=sim_dir,
+            retries=retries,
+            version=platform_config[const.PLATFORM_CONFIG.BB_DEFAULT_VERSION.name],
+            write_directory=sim_dir,
+            logger=logger,
+        )
+        return ["bash", script]
+    if proc_type == const.ProcessType.IM_calculation:
+        script = submit_im_calc_slurm(
+            sim_dir=sim_dir,
+            simple_out=True,
+            retries=retries,
+            target_machine=get_target_machine(proc_type).name,
+            logger=logger,
+            submit=False,
+        )
+        return ["bash", script]
+    if proc_type == const.ProcessType.rrup:
+        arguments = OrderedDict({"REL": sim_dir, "MGMT_DB_LOC": root_folder})
+    elif proc_type == const.ProcessType.clean_up:
+        arguments = OrderedDict(
+            {"SIM_DIR": sim_dir, "SRF_NAME": run_name, "MGMT_DB_LOC": root_folder}
+        )
+    else:
+        raise ValueError(f"{proc_type.str_value} tasks can't be run by a pack worker")
+    return ["bash", *shlex.split(get_platform_specific_script(proc_type, arguments))]
+
+
+def claim_task(claims_dir: str, run_name: str, proc_type: int, expiry: float):
+    """Claims a task until the expiry timestamp, returns False if another worker
+    holds the claim"""
+    claim_file = os.path.join(claims_dir, f"{run_name}.{proc_type}")
+    for _ in range(2):
+        try:
+            fd = os.open(claim_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            try:
+                with open(claim_file, "r") as f:
+                    claim_expiry = json.load(f)["expiry"]
+            except (OSError, ValueError, KeyError):
+                # Being written or released by another worker
+                return False
+            if claim_expiry > time.time():
+                return False
+            # Only one worker can move the expired claim away
+            try:
+                os.rename(claim_file, f"{claim_file}.{os.getpid()}.expired")
+            except OSError:
+                return False
+            os.remove(f"{claim_file}.{os.getpid()}.expired")
+        else:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expiry": expiry}, f)
+            return True
+    return False
+
+
+def release_task(claims_dir: str, run_name: str, proc_type: int):
+    claim_file = os.path.join(claims_dir, f"{run_name}.{proc_type}")
+    if os.path.exists(claim_file):
+        os.remove(claim_file)
+
+
+def mark_unpackable(root_folder: str, run_name: str, proc_type: int):
+    """Marks a task that can't be run by a pack worker"""
+    unpackable_dir = os.path.join(root_folder, PACK_DIR_NAME, UNPACKABLE_DIR_NAME)
+    os.makedirs(unpackable_dir, exist_ok=True)
+    open(os.path.join(unpackable_dir, f"{run_name}.{proc_type}"), "w").close()
+
+
+def is_unpackable(root_folder: str, run_name: str, proc_type: int):
+    return os.path.exists(
+        os.path.join(
+            root_folder, PACK_DIR_NAME, UNPACKABLE_DIR_NAME, f"{run_name}.{proc_type}"
+        )
+    )
+
+
+class PackWorker:
+    def __init__(
+        self,
+        root_folder: str,
+        proc_type: const.ProcessType,
+        n_cores: int,
+        memory: float,
+        job_id: str,
+        time_limit: float,
+        task_memory: float = DEFAULT_TASK_MEMORY,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        logger: Logger = qclogging.get_basic_logger(),
+    ):
+        """
+        n_cores, memory: The cores and memory (GB) of the allocation
+        job_id: The job id of the allocation, the tasks run are recorded with
+            <job_id>_p<n>
+        time_limit: The wall clock time (seconds) of the allocation
+        task_memory: The memory (GB) of tasks that don't request any
+        """
+        self.root_folder = root_folder
+        self.proc_type = const.ProcessType(proc_type)
+        self.n_cores = n_cores
+        self.memory = memory
+        self.job_id = job_id
+        self.time_limit = time_limit
+        self.end_time = time.time() + time_limit - END_MARGIN
+        self.task_memory = task_memory
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.logger = logger
+
+        self.queue_folder = sim_struct.get_mgmt_db_queue(root_folder)
+        self.claims_dir = os.path.join(root_folder, PACK_DIR_NAME, CLAIMS_DIR_NAME)
+        os.makedirs(self.claims_dir, exist_ok=True)
+        self.mgmt_db = connect_mgmt_db(sim_struct.get_mgmt_db(root_folder), logger)
+
+        # run name -> (process, resources, job id of the task)
+        self.running: Dict[str, Tuple[subprocess.Popen, TaskResources, str]] = {}
+        self._commands: Dict[Tuple[str, int], List[str]] = {}
+        self.n_started = 0
+        self.n_completed = 0
+        self.n_failed = 0
+
+    @property
+    def free_cores(self):
+        return self.n_cores - sum(res.n_cores for _, res, _ in self.running.values())
+
+    @property
+    def free_memory(self):
+        return self.memory - sum(res.memory for _, res, _ in self.running.values())
+
+    def run(self):
+        """Runs tasks until there is nothing to run for idle_timeout seconds,
+        or the allocation ends"""
+        self.logger.info(
+            f"Pack worker {self.job_id} running {self.proc_type.str_value} tasks "
+            f"with {self.n_cores} cores and {self.memory}GB"
+        )
+        last_busy = time.time()
+        while True:
+            self.reap()
+            if time.time() < self.end_time and self.free_cores > 0:
+                self.start_tasks()
+            if len(self.running) > 0:
+                last_busy = time.time()
+            elif (
+                time.time() - last_busy > self.idle_timeout
+                or time.time() >= self.end_time
+            ):
+                break
+            time.sleep(self.poll_interval)
+        self.logger.info(
+            f"Pack worker {self.job_id} finished, {self.n_completed} tasks completed "
+            f"and {self.n_failed} failed"
+        )
+
+    def reap(self):
+        """Handles the finished tasks"""
+        for run_name, (process, _, task_job_id) in list(self.running.items()):
+            return_code = process.poll()
+            if return_code is None:
+                continue
+            del self.running[run_name]
+            if return_code == 0:
+                self.n_completed += 1
+            else:
+                self.n_failed += 1
+                self.logger.warning(
+                    f"{self.proc_type.str_value} of {run_name} exited with {return_code}"
+                )
+                add_to_queue(
+                    self.queue_folder,
+                    run_name,
+                    self.proc_type.value,
+                    const.Status.failed.value,
+                    job_id=task_job_id,
+                    error=f"Exited with code {return_code} in pack worker {self.job_id}",
+                    logger=self.logger,
+                )
+            release_task(self.claims_dir, run_name, self.proc_type.value)
+
+    def start_tasks(self):
+        """Starts the runnable tasks that fit the free resources of the allocation"""
+        runnable_tasks = self.mgmt_db.get_runnable_tasks(
+            "%",
+            self.n_cores,
+            os.listdir(self.queue_folder),
+            ComparisonOperator.LIKE,
+            [self.proc_type],
+            self.logger,
+        )
+        for proc_type, run_name, retries in runnable_tasks:
+            if self.free_cores <= 0:
+                break
+            if (
+                run_name in self.running
+                or is_unpackable(self.root_folder, run_name, proc_type)
+                or not claim_task(
+                    self.claims_dir, run_name, proc_type, self.end_time + END_MARGIN
+                )
+            ):
+                continue
+
+            command = self._commands.get((run_name, retries))
+            if command is None:
+                command = create_task_command(
+                    self.proc_type, run_name, self.root_folder, retries, self.logger
+                )
+                self._commands[(run_name, retries)] = command
+            resources = get_task_resources(read_header(command[1]), self.task_memory)
+            # Tasks requesting more than the allocation use all of it
+            resources.n_cores = min(resources.n_cores, self.n_cores)
+            resources.memory = min(resources.memory, self.memory)
+            if resources.wct * 3600 > self.time_limit - END_MARGIN:
+                self.logger.warning(
+                    f"{self.proc_type.str_value} of {run_name} needs {resources.wct} "
+                    f"hours, more than a pack worker allocation of "
+                    f"{self.time_limit / 3600} hours. It is submitted as a normal job"
+                )
+                mark_unpackable(self.root_folder, run_name, proc_type)
+                release_task(self.claims_dir, run_name, proc_type)
+                continue
+            if (
+                resources.n_cores > self.free_cores
+                or resources.memory > self.free_memory
+                or time.time() + resources.wct * 3600 > self.end_time
+            ):
+                release_task(self.claims_dir, run_name, proc_type)
+                continue
+
+            self.start_task(run_name, command, resources)
+
+    def start_task(self, run_name: str, command: List[str], resources: TaskResources):
+        task_job_id = get_pack_task_job_id(self.job_id, self.n_started)
+        self.n_started += 1
+        add_to_queue(
+            self.queue_folder,
+            run_name,
+            self.proc_type.value,
+            const.Status.queued.value,
+            job_id=task_job_id,
+            logger=self.logger,
+        )
+        # Job steps launched by the task script use its share of the allocation
+        env = dict(os.environ)
+        n_tasks = max(1, resources.n_cores // resources.cpus_per_task)
+        env.update(
+            {
+                "MGMT_DB_JOB_ID": task_job_id,
+                "SLURM_NTASKS": str(n_tasks),
+                "SLURM_NPROCS": str(n_tasks),
+                "SLURM_CPUS_PER_TASK": str(resources.cpus_per_task),
+            }
+        )
+        log_prefix = os.path.join(
+            sim_struct.get_sim_dir(self.root_folder, run_name),
+            f"{self.proc_type.str_value}_pack_{task_job_id}",
+        )
+        self.logger.info(
+            f"Starting {self.proc_type.str_value} of {run_name} as {task_job_id} "
+            f"with {resources.n_cores} cores"
+        )
+        with open(f"{log_prefix}.out", "w") as out, open(
+            f"{log_prefix}.err", "w"
+        ) as err:
+            self.running[run_name] = (
+                subprocess.Popen(command, stdout=out, stderr=err, env=env),
+                resources,
+                task_job_id,
+            )
+
+
+def submit_pack_worker(
+    root_folder: str,
+    proc_type: const.ProcessType,
+    n_cores: int,
+    wct: float,
+    memory: float = None,
+    logger: Logger = qclogging.get_basic_logger(),
+):
+    """Submits a pack worker job for the process type, returns its job id
+
+    Parameters
+    ----------
+    n_cores: int
+        The number of cores of the allocation
+    wct: float
+        The wall clock time (hours) of the allocation
+    memory: float, optional
+        The memory (GB) of the allocation, defaults to DEFAULT_TASK_MEMORY per core
+    """
+    proc_type = const.ProcessType(proc_type)
+    target_machine = get_target_machine(proc_type).name
+    if memory is None:
+        memory = DEFAULT_TASK_MEMORY * n_cores
+    pack_dir = os.path.join(root_folder, PACK_DIR_NAME)
+    os.makedirs(pack_dir, exist_ok=True)
+
+    template_dir = platform_config[const.PLATFORM_CONFIG.SCHEDULER_TEMPLATES_DIR.name]
+    header = resolve_header(
+        template_dir,
+        wallclock_limit=estimate_wct.convert_to_wct(wct),
+        job_name=f"pack_{proc_type.str_value}",
+        version=platform_config[const.PLATFORM_CONFIG.SCHEDULER.name],
+        memory=f"{int(memory)}G",
+        exe_time=const.timestamp,
+        job_description=f"Pack worker running {proc_type.str_value} tasks",
+        additional_lines=f"#SBATCH --mem={int(memory)}G",
+        write_directory=pack_dir,
+        platform_specific_args=get_platform_node_requirements(n_cores),
+    )
+    body = generate_context(
+        template_dir,
+        PACK_TEMPLATE,
+        {
+            "root_folder": root_folder,
+            "proc_type": proc_type.str_value,
+            "target_machine": target_machine,
+            "n_cores": n_cores,
+            "memory": memory,
+            "time_limit": int(wct * 3600),
+        },
+    )
+    script = os.path.join(
+        pack_dir,
+        "pack_{}_{}.{}".format(
+            proc_type.str_value,
+            datetime.now().strftime(const.TIMESTAMP_FORMAT),
+            Scheduler.get_scheduler().SCRIPT_EXTENSION,
+        ),
+    )
+    write_to_file("\n".join([header, body]), script)
+
+    job_id = Scheduler.get_scheduler().submit_job(pack_dir, script, target_machine)
+    logger.info(f"Submitted a {proc_type.str_value} pack worker as job {job_id}")
+    return job_id
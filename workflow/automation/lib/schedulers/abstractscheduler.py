@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from logging import Logger
-from typing import List, Dict, Type, Tuple
+from typing import List, Dict, Type, Tuple, Union
 
 from qcore.shared import exe
 from qcore.qclogging import VERYVERBOSE, NOPRINTERROR
@@ -15,6 +15,47 @@ class SchedulerException(EnvironmentError):
     pass
 
 
+# Array tasks have the job id <array job id>_<array task index>
+ARRAY_TASK_SEPARATOR = "_"
+# Tasks run by a pack worker have the job id <worker job id>_p<task number>,
+# the scheduler only knows the worker job
+PACK_TASK_PREFIX = "p"
+
+
+def get_array_task_job_id(array_job_id: Union[int, str], index: int) -> str:
+    """The job id of a task of a job array"""
+    return f"{array_job_id}{ARRAY_TASK_SEPARATOR}{index}"
+
+
+def get_pack_task_job_id(worker_job_id: Union[int, str], index: int) -> str:
+    """The job id of the index-th task run by a pack worker"""
+    return f"{worker_job_id}{ARRAY_TASK_SEPARATOR}{PACK_TASK_PREFIX}{index}"
+
+
+def is_pack_task_job_id(job_id: Union[int, str]) -> bool:
+    return str(job_id).partition(ARRAY_TASK_SEPARATOR)[2].startswith(PACK_TASK_PREFIX)
+
+
+def get_scheduler_job_id(job_id: Union[int, str]) -> Union[int, str]:
+    """The job id the scheduler knows a task by, the worker job for pack tasks"""
+    if is_pack_task_job_id(job_id):
+        return parse_job_id(str(job_id).partition(ARRAY_TASK_SEPARATOR)[0])
+    return job_id
+
+
+def parse_job_id(job_id: str) -> Union[int, str]:
+    """Parses a job id, array task job ids (jobid_arrayidx) and pack task job ids
+    (jobid_pN) are kept as a string"""
+    array_job_id, separator, index = str(job_id).partition(ARRAY_TASK_SEPARATOR)
+    if separator and index.startswith(PACK_TASK_PREFIX):
+        return get_pack_task_job_id(
+            int(array_job_id), int(index[len(PACK_TASK_PREFIX) :])
+        )
+    if separator:
+        return get_array_task_job_id(int(array_job_id), int(index))
+    return int(job_id)
+
+
 class AbstractScheduler(ABC):
     """
     Defines the generic scheduler API to interact with various platform scheduling software
@@ -24,6 +65,7 @@ class AbstractScheduler(ABC):
     SCRIPT_EXTENSION: str
     HEADER_TEMPLATE: str
     QUEUE_NAME: str
+    SUPPORTS_ARRAYS: bool = False
 
     def __init__(
         self, user, account, current_machine, logger: Logger, platform_accounts=None
@@ -51,6 +93,20 @@ class AbstractScheduler(ABC):
         """
         pass
 
+    def submit_array_job(
+        self, log_dir, script_location: str, array_size: int, target_machine=None
+    ) -> int:
+        """
+        Submits a job array with the tasks 0 to array_size - 1. Returns the array job
+        id, the job id of each task is given by get_array_task_job_id
+        :param log_dir: The directory for the output/error files
+        :param script_location: The absolute path to the script to be submitted
+        :param array_size: The number of array tasks
+        :param target_machine: The machine the job is to be submitted to
+        :return: The array job id
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support job arrays")
+
     @abstractmethod
     def cancel_job(self, job_id: int, target_machine=None) -> Tuple[str, str]:
         """
@@ -15,6 +15,7 @@ class Slurm(AbstractScheduler):
     SCRIPT_EXTENSION = "sl"
     QUEUE_NAME = "squeue"
     HEADER_TEMPLATE = "slurm_header.cfg"
+    SUPPORTS_ARRAYS = True
 
     def check_queues(self, user: bool = False, target_machine: HPC = None):
         self.logger.debug(
@@ -28,11 +29,13 @@ class Slurm(AbstractScheduler):
         else:
             account = self.account
         accounts = ",".join(self.platform_accounts)
+        # %i with -r lists every task of a job array as <array job id>_<index>,
+        # including the pending ones
         if user:
             # user is True, so we use the same user as we use for submission
-            cmd = f"squeue -A {accounts} -o '%A %t' -M {target_machine.name} -u {self.user_name}"
+            cmd = f"squeue -A {accounts} -o '%i %t' -r -M {target_machine.name} -u {self.user_name}"
         else:
-            cmd = f"squeue -A {accounts} -o '%A %t' -M {target_machine.name}"
+            cmd = f"squeue -A {accounts} -o '%i %t' -r -M {target_machine.name}"
         self.logger.debug(f"Running squeue command: {cmd}")
         output, err = self._run_command_and_wait(cmd=[cmd], shell=True)
         self.logger.debug(f"Squeue got output: {output}")
@@ -82,17 +85,38 @@ class Slurm(AbstractScheduler):
         self.logger.debug(
             "Submitting {} on machine {}".format(script_location, target_machine)
         )
-        f_name = f"%x_{timestamp}_%j"
+        return self._sbatch(
+            sim_dir, script_location, f"%x_{timestamp}_%j", target_machine
+        )
+
+    def submit_array_job(
+        self, log_dir, script_location, array_size, target_machine=None
+    ):
+        self.logger.debug(
+            f"Submitting {script_location} as an array of {array_size} tasks "
+            f"on machine {target_machine}"
+        )
+        return self._sbatch(
+            log_dir,
+            script_location,
+            f"%x_{timestamp}_%A_%a",
+            target_machine,
+            f"--array=0-{array_size - 1}",
+        )
+
+    def _sbatch(
+        self, log_dir, script_location, f_name, target_machine=None, options=""
+    ):
         if isinstance(self.account, dict):
             account = self.account[target_machine]
         else:
             account = self.account
-        common_pre = f"sbatch -o {join(sim_dir, f'{f_name}.out')} -e {join(sim_dir, f'{f_name}.err')} -A {account}"
+        common_pre = f"sbatch -o {join(log_dir, f'{f_name}.out')} -e {join(log_dir, f'{f_name}.err')} -A {account}"
         if target_machine and target_machine != self.current_machine:
             mid = f"--export=CUR_ENV,CUR_HPC -M {target_machine}"
         else:
             mid = ""
-        command = " ".join([common_pre, mid, script_location])
+        command = " ".join([common_pre, options, mid, script_location])
         self.logger.debug(f"Submitting command {command}")
         out, err = self._run_command_and_wait(cmd=[command], shell=True)
 
@@ -4,6 +4,7 @@ Shared functions only used by the automated workflow
 
 import json
 import os
+import re
 from datetime import datetime
 from logging import Logger
 from typing import List
@@ -12,14 +13,17 @@ import qcore.constants as const
 from qcore import utils as qc_utils
 from qcore import qclogging
 
-from workflow.automation.lib.MgmtDB import MgmtDB
+from workflow.automation.lib.MgmtDB import (
+    ComparisonOperator,
+    MgmtDB,
+    REL_ONLY_PATTERN,
+)
 from workflow.automation.lib.schedulers.scheduler_factory import Scheduler
 
 ALL = "ALL"
 MEDIAN_ONLY = "MEDIAN"
 # MEDIAN_ONLY_PATTERN is negation of REL_ONLY_PATTERN. Has to be done in SQL
 REL_ONLY = "REL_ONLY"
-REL_ONLY_PATTERN = "%_REL%"
 NONE = "NONE"
 
 
@@ -149,6 +153,29 @@ def check_mgmt_queue(
     return False
 
 
+def like_pattern_to_regex(pattern: str):
+    """Converts an SQL LIKE pattern into a compiled regular expression.
+    Matching is case insensitive, as it is for ASCII characters in SQLite."""
+    return re.compile(
+        "".join(
+            ".*" if char == "%" else "." if char == "_" else re.escape(char)
+            for char in pattern
+        ),
+        re.IGNORECASE | re.DOTALL,
+    )
+
+
+def run_name_matches(
+    run_name: str, pattern: str, matcher: ComparisonOperator = ComparisonOperator.LIKE
+):
+    """Checks if the run_name would be selected by the given pattern and matcher,
+    mirroring the behaviour of the equivalent SQL comparison in the mgmt db"""
+    if matcher == ComparisonOperator.EXACT:
+        return run_name == pattern
+    is_match = like_pattern_to_regex(pattern).fullmatch(run_name) is not None
+    return is_match if matcher == ComparisonOperator.LIKE else not is_match
+
+
 def parse_config_file(task_config: str, logger: Logger = qclogging.get_basic_logger()):
     """Takes in the location of a wrapper config file and creates the tasks to be run.
     Requires that the file contains the keys 'run_all_tasks' and 'run_some', even if they are empty
@@ -0,0 +1,157 @@
+"""Priority policies for the order in which auto_submit submits the runnable tasks.
+
+The policies use the estimated run time of each task (e.g. from the estimate_wct
+models, via estimate_cybershake.py --output) and the ProcessType dependency graph:
+    db_order            The order of the tasks in the mgmt db (default)
+    critical_path       Longest downstream work first, i.e. the estimated run time of
+                        the task plus the longest chain of tasks depending on it
+    shortest_job_first  Shortest estimated run time first
+
+With fair share the tasks of the faults with the fewest submitted jobs go first,
+so a few large faults can't take all of the submission slots.
+"""
+import heapq
+from collections import defaultdict
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import qcore.constants as const
+import qcore.simulation_structure as sim_struct
+
+# Run time (hours) used for tasks that have no estimate
+DEFAULT_RUN_TIME = 0.25
+
+# Estimated run time (hours) of each (run_name, process) task
+TaskCosts = Dict[Tuple[str, const.ProcessType], float]
+
+
+class PriorityPolicy(const.ExtendedEnum):
+    db_order = "db_order"
+    critical_path = "critical_path"
+    shortest_job_first = "shortest_job_first"
+
+
+def get_dependency_processes(proc_type: const.ProcessType):
+    """Gets the process types the given process type can depend on,
+    including all alternatives for processes with alternative dependencies"""
+    dependencies = proc_type.dependencies
+    if len(dependencies) > 0 and not isinstance(dependencies[0], const.Dependency):
+        dependencies = [
+            dependency for alternative in dependencies for dependency in alternative
+        ]
+    return [const.ProcessType(dependency.process) for dependency in dependencies]
+
+
+@lru_cache(maxsize=None)
+def get_dependent_processes() -> Dict[const.ProcessType, Tuple[const.ProcessType]]:
+    """Gets the process types depending on each process type"""
+    dependents = defaultdict(list)
+    for proc_type in const.ProcessType:
+        for dependency in get_dependency_processes(proc_type):
+            dependents[dependency].append(proc_type)
+    return {proc_type: tuple(procs) for proc_type, procs in dependents.items()}
+
+
+class TaskPrioritiser:
+    def __init__(
+        self,
+        policy: PriorityPolicy = PriorityPolicy.db_order,
+        costs: TaskCosts = None,
+        processes: Iterable[const.ProcessType] = None,
+        default_run_time: float = DEFAULT_RUN_TIME,
+    ):
+        """
+        policy: The priority policy
+        costs: The estimated run time of the tasks, tasks without an estimate
+            use default_run_time
+        processes: The process types that are run, only these count as
+            downstream work. Defaults to all process types
+        """
+        self.policy = policy
+        self.costs = {} if costs is None else costs
+        self.processes = set(
+            const.ProcessType
+            if processes is None
+            else map(const.ProcessType, processes)
+        )
+        self.default_run_time = default_run_time
+        self._downstream_work = {}
+
+    def run_time(self, run_name: str, proc_type: const.ProcessType):
+        return self.costs.get((run_name, proc_type), self.default_run_time)
+
+    def downstream_work(self, run_name: str, proc_type: const.ProcessType):
+        """The run time of the task plus the longest chain of tasks of the same
+        run depending on it"""
+        key = (run_name, proc_type)
+        if key not in self._downstream_work:
+            self._downstream_work[key] = self.run_time(run_name, proc_type) + max(
+                (
+                    self.downstream_work(run_name, dependent)
+                    for dependent in get_dependent_processes().get(proc_type, ())
+                    if dependent in self.processes
+                ),
+                default=0.0,
+            )
+        return self._downstream_work[key]
+
+    def key(self, run_name: str, proc_type: const.ProcessType) -> Tuple:
+        """The sort key of a task, tasks with a lower key go first.
+        Ties keep their given order"""
+        if self.policy == PriorityPolicy.critical_path:
+            return (-self.downstream_work(run_name, proc_type),)
+        if self.policy == PriorityPolicy.shortest_job_first:
+            return (self.run_time(run_name, proc_type),)
+        return ()
+
+    def prioritise(
+        self,
+        tasks: List,
+        get_run_proc: Callable = lambda task: (task[1], const.ProcessType(task[0])),
+        n_submitted: Dict[str, int] = None,
+    ) -> List:
+        """Sorts the tasks by priority
+
+        Parameters
+        ----------
+        tasks: List
+            The tasks to sort, by default (proc_type, run_name, ...) tuples as returned
+            by MgmtDB.get_runnable_tasks
+        get_run_proc: Callable, optional
+            Gets the (run_name, ProcessType) of a task
+        n_submitted: Dict[str, int], optional
+            Fair share, the number of submitted jobs of each fault. Tasks are taken from
+            the fault with the fewest submitted jobs first, counting the tasks already
+            taken, and in priority order within each fault
+
+        Returns
+        -------
+        The sorted tasks
+        """
+        keys = [
+            (*self.key(*get_run_proc(task)), order) for order, task in enumerate(tasks)
+        ]
+        if n_submitted is None:
+            return [tasks[order] for *_, order in sorted(keys)]
+
+        fault_keys = defaultdict(list)
+        for key in keys:
+            fault = sim_struct.get_fault_from_realisation(
+                get_run_proc(tasks[key[-1]])[0]
+            )
+            fault_keys[fault].append(key)
+        faults = []
+        for fault, cur_keys in fault_keys.items():
+            cur_keys.sort(reverse=True)
+            faults.append((n_submitted.get(fault, 0), cur_keys[-1], fault))
+        heapq.heapify(faults)
+
+        prioritised = []
+        while faults:
+            n_fault_submitted, key, fault = heapq.heappop(faults)
+            prioritised.append(tasks[fault_keys[fault].pop()[-1]])
+            if fault_keys[fault]:
+                heapq.heappush(
+                    faults, (n_fault_submitted + 1, fault_keys[fault][-1], fault)
+                )
+        return prioritised
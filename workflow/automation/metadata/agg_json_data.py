@@ -2,7 +2,8 @@
 """Reads metadata json files created by write_json script and combines
 the data into a single dataframe, which is then saved as a .csv
 
-Searches recursively for the .json files for a given start dir.
+Searches recursively for the .json files and the line-delimited .jsonl metadata logs
+(written by log_metadata.append_metadata) for a given start dir.
 
 Note: This only works in python3, python2.7 glob does not support
 recursive directory traversal.
@@ -14,12 +15,16 @@ import glob
 import json
 import numpy as np
 import pandas as pd
-from typing import List
+from typing import Dict, List, Tuple
 
 from multiprocessing import Pool
 from argparse import ArgumentParser
 
 from workflow.automation.estimation.estimate_wct import get_IM_comp_count
+from workflow.automation.metadata.log_metadata import (
+    apply_metadata_records,
+    read_metadata_records,
+)
 from qcore.constants import (
     ProcessType,
     MetadataField,
@@ -43,13 +48,23 @@ def load_metadata_df(csv_file: str):
 
 
 def get_row(json_file):
-    """Gets a row of metadata for the single simulation json log file"""
-    with open(json_file) as f:
-        data_dict = json.load(f)
+    """Gets a row of metadata for the single simulation json log file,
+    or line-delimited (.jsonl) metadata log"""
+    if json_file.endswith(".jsonl"):
+        records, _ = read_metadata_records(json_file)
+        data_dict = apply_metadata_records({}, records)
+    else:
+        with open(json_file) as f:
+            data_dict = json.load(f)
+
+    return get_row_from_dict(data_dict, json_file)
+
 
+def get_row_from_dict(data_dict: Dict, source: str = None):
+    """Gets a row of metadata from the content of a simulation metadata log"""
     sim_name = data_dict.get(MetadataField.sim_name.value)
     if sim_name is None:
-        print("No simulation name found in json file {}, skipping.".format(json_file))
+        print("No simulation name found in json file {}, skipping.".format(source))
         return None, None, None
 
     columns = []
@@ -144,38 +159,50 @@ def create_dataframe(json_files: List[str], n_procs: int, calc_core_hours: bool)
         )
     )
     if n_procs > 1:
-        p = Pool(n_procs)
-        rows = p.map(get_row, json_files)
+        with Pool(n_procs) as p:
+            rows = p.map(
+                get_row, json_files, chunksize=max(1, len(json_files) // (n_procs * 4))
+            )
     else:
         rows = [get_row(file) for file in json_files]
 
+    return rows_to_dataframe(rows, calc_core_hours)
+
+
+def rows_to_dataframe(rows: List[Tuple[str, List, List]], calc_core_hours: bool):
+    """Creates the metadata dataframe from the (sim_name, columns, data) rows
+
+    The rows are collected as sparse columns (row indices and values per column)
+    and the dataframe is only created once all rows have been processed, so this
+    scales linearly with the number of simulations and columns.
+    A simulation that has several rows is merged into a single row, later values
+    take precedence.
+    """
     print("Creating dataframe...")
-    df = None
+    sim_ixs: Dict[str, int] = {}
+    sparse_columns: Dict[Tuple[str, str], Tuple[List[int], List]] = {}
     for sim_name, columns, data in rows:
-        print(sim_name, columns, data)
         if sim_name is None and columns is None and data is None:
             continue
 
-        # Create the dataframe
-        if df is None:
-            print("df is none")
-            df = pd.DataFrame(
-                index=[sim_name],
-                columns=pd.MultiIndex.from_tuples(columns),
-                data=np.asarray(data, dtype=object).reshape(1, -1),
-            )
-        else:
-            # Check/Add missing columns
-            column_mask = np.asarray(
-                [True if col in df.columns else False for col in columns]
-            )
-            if np.any(~column_mask):
-                for col in columns:
-                    if col not in df.columns:
-                        df[col] = np.nan
-
-            # Add row data
-            df.loc[sim_name, columns] = data
+        sim_ix = sim_ixs.setdefault(sim_name, len(sim_ixs))
+        for col, value in zip(columns, data):
+            col_ixs, col_values = sparse_columns.setdefault(col, ([], []))
+            col_ixs.append(sim_ix)
+            col_values.append(value)
+
+    dense_columns = {}
+    for col, (col_ixs, col_values) in sparse_columns.items():
+        dense_columns[col] = np.full(len(sim_ixs), np.nan, dtype=object)
+        for sim_ix, value in zip(col_ixs, col_values):
+            dense_columns[col][sim_ix] = value
+
+    df = pd.DataFrame(
+        dense_columns,
+        index=list(sim_ixs.keys()),
+        columns=pd.MultiIndex.from_tuples(dense_columns.keys()),
+        dtype=object,
+    )
 
     # Clean the dataframe
     df = convert_df(df)
@@ -233,29 +260,50 @@ def main(args):
         print("Output file already exists. Not proceeding. Exiting.")
         sys.exit()
 
-    # Get all .json files
-    print("Searching for matching json files")
-    file_pattern = (
-        "{}.json".format(args.filename_pattern)
-        if args.not_recursive
-        else os.path.join("**/", "{}*.json".format(args.filename_pattern))
-    )
+    if args.store_dir is not None:
+        # To prevent circular dependency
+        from workflow.automation.metadata.metadata_store import (
+            MetadataStore,
+            find_metadata_logs,
+        )
 
-    json_files = [
-        glob.glob(os.path.join(cur_dir, file_pattern), recursive=not args.not_recursive)
-        for cur_dir in args.input_dirs
-    ]
+        store = MetadataStore(args.store_dir)
+        print("Reading new metadata records")
+        n_records = store.update(find_metadata_logs(args.input_dirs))
+        print("Found {} new metadata records".format(n_records))
+        df = store.create_dataframe(args.calc_core_hours)
+    else:
+        # Get all .json and .jsonl files
+        print("Searching for matching json files")
+        file_patterns = [
+            (
+                "{}.{}".format(args.filename_pattern, extension)
+                if args.not_recursive
+                else os.path.join(
+                    "**/", "{}*.{}".format(args.filename_pattern, extension)
+                )
+            )
+            for extension in ("json", "jsonl")
+        ]
 
-    # Flatten the list of list of files
-    json_files = [file for file_list in json_files for file in file_list]
+        json_files = [
+            glob.glob(
+                os.path.join(cur_dir, file_pattern), recursive=not args.not_recursive
+            )
+            for cur_dir in args.input_dirs
+            for file_pattern in file_patterns
+        ]
 
-    if len(json_files) == 0:
-        print("No matching .json files found. Quitting.")
-        sys.exit()
-    else:
-        print("Found {} matching .json files".format(len(json_files)))
+        # Flatten the list of list of files
+        json_files = [file for file_list in json_files for file in file_list]
+
+        if len(json_files) == 0:
+            print("No matching .json or .jsonl files found. Quitting.")
+            sys.exit()
+        else:
+            print("Found {} matching .json or .jsonl files".format(len(json_files)))
 
-    df = create_dataframe(json_files, args.n_procs, True)
+        df = create_dataframe(json_files, args.n_procs, True)
 
     print("Saving the final dataframe in {}".format(args.output_file))
     df.to_csv(args.output_file)
@@ -295,9 +343,17 @@ if __name__ == "__main__":
         "--filename_pattern",
         type=str,
         default="metadata_log",
-        help="The json file pattern to search. "
+        help="The json file pattern to search, .json and .jsonl files are read. "
         "Do not add .json. Defaults to 'metadata_log'.",
     )
+    parser.add_argument(
+        "--store_dir",
+        type=str,
+        default=None,
+        help="Aggregates the line-delimited metadata logs (metadata_log.jsonl) "
+        "incrementally, using the metadata store in this directory. Only records added "
+        "since the last run are read. --not_recursive and --filename_pattern are ignored.",
+    )
     parser.add_argument(
         "--calc_core_hours",
         action="store_true",
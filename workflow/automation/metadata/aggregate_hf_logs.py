@@ -1,152 +1,331 @@
 #!/usr/bin/env python3
 
 """
-Scrapes the HF logs passed in via a glob string and calculates the amount of core hours lost to thread idling
-Takes in a single or glob path to HF log files.
+Scrapes the HF and BB logs passed in via a glob string and calculates the amount of core hours lost to
+ranks idling, i.e. ranks that have finished their stations and are waiting for the last rank to finish.
+Takes in a single or glob path to HF.log/BB.log files.
+
+Writes three csv files:
+    <out_file>                  One row per log, with the duration, efficiency and core hours lost
+    <out_file>_idle_hist.csv    Histogram of the per rank idle time fraction, for each process type
+    <out_file>_faults.csv       Core hours lost and efficiency per fault and process type,
+                                to inform the station distribution/core counts used for hf_sim/bb_sim
 """
 
 import argparse
+import os
+from dataclasses import dataclass, field
 from datetime import datetime
 from glob import glob
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Optional
 
 import numpy as np
+import pandas as pd
+import qcore.constants as const
+import qcore.simulation_structure as sim_struct
+
+LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+# The logging format used by hf_sim/bb_sim is "%(asctime)s:%(name)s:%(levelname)s:%(message)s",
+# the time contains two colons
+N_LOG_FIELDS = 6
+
+COMPLETED_MESSAGE = "Simulation completed"
+RANK_MESSAGE = "Process "
+
+LOG_PROCESS_TYPES = {
+    "HF.log": const.ProcessType.HF,
+    "BB.log": const.ProcessType.BB,
+}
+
+IDLE_HIST_BINS = np.linspace(0, 1, 11)
+DEFAULT_RANKS_PER_NODE = 80
+READ_BLOCK_SIZE = 64 * 1024
+
+
+@dataclass
+class LogEfficiency:
+    """Rank idle times of a single HF/BB run, all times are in seconds"""
+
+    log_file: str
+    fault: str
+    proc_type: const.ProcessType
+    duration: Optional[float] = None
+    n_ranks: Optional[int] = None
+    idle_times: List[float] = field(default_factory=list)
+
+    @property
+    def valid(self):
+        return self.duration is not None and self.duration > 0
+
+    @property
+    def efficiency(self):
+        """Fraction of the allocated core time spent working"""
+        if not self.valid:
+            return np.nan
+        return 1 - np.mean(self.idle_times) / self.duration
+
+    @property
+    def core_hours_lost(self):
+        """Core hours lost to idling ranks, adjusted for hyperthreading"""
+        if not self.valid:
+            return 0.0
+        return np.sum(self.idle_times) / 3600 / (2 if self.proc_type.is_hyperth else 1)
+
+
+def reverse_lines(file_name: str, block_size: int = READ_BLOCK_SIZE):
+    """Yields the lines of a file from the last to the first,
+    only reading as much of the file as is consumed"""
+    with open(file_name, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + remainder).split(b"\n")
+            # The first line may be incomplete, keep it for the next block
+            remainder = lines[0]
+            for line in reversed(lines[1:]):
+                if line:
+                    yield line.decode("utf-8", errors="replace")
+        if remainder:
+            yield remainder.decode("utf-8", errors="replace")
+
+
+def parse_log_line(line: str):
+    """Splits a log line into its time, logger name and message
+    Returns None if the line is not a log line"""
+    parts = line.split(":", N_LOG_FIELDS - 1)
+    if len(parts) < N_LOG_FIELDS:
+        return None
+    try:
+        time = datetime.strptime(":".join(parts[:3]), LOG_TIME_FORMAT)
+    except ValueError:
+        return None
+    return time, parts[3], parts[5]
 
 
-def get_duration_and_dead_ratio(file_name):
+def get_log_efficiency(
+    log_file: str, ranks_per_node: int = DEFAULT_RANKS_PER_NODE, verbose: bool = False
+):
     """
-    Takes a log filename and extracts the amount of wasted core hours.
-    :returns: A tuple containing the sim duration, percent of time lost, number of cores with valid times and the time lost for each core
+    Reads the log from the end and extracts the time each rank spent idling, i.e. waiting for the last
+    rank to complete. Only the last run in the log is considered, which allows to stop reading once the
+    completion message of every rank has been found.
+    If the number of ranks is not a multiple of the number of ranks per node, the idle time of the
+    unused part of the last node is counted as the mean idle time.
     """
-    with open(file_name) as f:
-        lines = f.readlines()
-    final_times = {}
-    j = 1
-    release = lines[-j].split(":")
-    while (
-        len(release) < 6
-        or not release[5].startswith("Simulation completed.")
-        and j < len(lines)
-    ):
-        j += 1
-        release = lines[-j].split(":")
-    try:
-        assert j < len(lines)
-        end_time = datetime.strptime(":".join(release[:3]), "%Y-%m-%d %H:%M:%S,%f")
-    except:
-        if verbose:
-            print(file_name, "Couldn't get a start time")
-        return None, None, None, None
-    for line in lines[-(j + 1) :: -1]:
-        line = line.split(":")
-        if len(line) < 6 or not line[5].startswith("Process "):
-            continue
-        try:
-            time = datetime.strptime(":".join(line[:3]), "%Y-%m-%d %H:%M:%S,%f")
-        except:
+    log_efficiency = LogEfficiency(
+        log_file,
+        sim_struct.get_fault_from_realisation(
+            os.path.abspath(log_file).split(os.sep)[-4]
+        ),
+        LOG_PROCESS_TYPES.get(os.path.basename(log_file), const.ProcessType.HF),
+    )
+
+    end_time = None
+    rank_times: Dict[str, datetime] = {}
+    n_ranks = None
+    for line in reverse_lines(log_file):
+        parsed_line = parse_log_line(line)
+        if parsed_line is None:
             continue
-        rank = line[3].split("_")[-1]
-        if rank not in final_times.keys():
-            final_times.update({rank: time})
-    if len(final_times) < 2:
+        time, logger_name, message = parsed_line
+        if end_time is None:
+            if message.startswith(COMPLETED_MESSAGE):
+                end_time = time
+            elif message.startswith(RANK_MESSAGE):
+                # Ranks completed in the last run, but the simulation did not
+                break
+        elif message.startswith(RANK_MESSAGE):
+            # Process <rank> of <size> completed ...
+            words = message.split()
+            if n_ranks is None and len(words) > 3 and words[3].isdigit():
+                n_ranks = int(words[3])
+            rank = logger_name.split("_")[-1]
+            rank_times.setdefault(rank, time)
+            if n_ranks is not None and len(rank_times) >= n_ranks:
+                break
+        elif message.startswith(COMPLETED_MESSAGE):
+            # Reached the previous run of the simulation (restart from checkpoints)
+            break
+
+    if end_time is None:
         if verbose:
-            print(file_name, "Not enough times")
-        return None, None, None, None
-    times = sorted(final_times.values())
-    first_time = times[0]
-    duration = (end_time - first_time).total_seconds()
-    total_dead_time = 0
-    lost_times = []
-    for time in times:
-        lost_times.append((end_time - time).total_seconds())
-        if very_verbose:
-            print("adding {}".format((end_time - time).total_seconds() / duration))
-        total_dead_time += (end_time - time).total_seconds() / duration
-    total_dead_time *= 1 / len(times)
-    return duration, total_dead_time, len(times), lost_times
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "log_glob", help='log file selection expression. eg: "Runs/*/*/HF/Acc/HF.log"'
-)
-parser.add_argument(
-    "-o", "--out_file", help="The file to write the data to", default="hf_ch_burn.csv"
-)
-parser.add_argument("-v", "--verbose", help="Additional print statements enabled.")
-parser.add_argument(
-    "-vv",
-    "--very_verbose",
-    help="Even more print statements enabled. Intended for use with a single realisation, or part log.",
-)
-args = parser.parse_args()
-log_files = glob(args.log_glob)
-
-verbose = args.verbose or args.very_verbose
-very_verbose = args.very_verbose
-
-rels = len(log_files)
-
-values = np.ndarray(
-    rels,
-    dtype=[
-        ("f_name", "U128"),
-        ("fault", "U32"),
-        ("duration", "f8"),
-        ("efficiency", "f8"),
-        ("ch_burned", "f8"),
-    ],
-)
-
-for i, file in enumerate(log_files):
-    (
-        dead_duration,
-        decimal_dead_time,
-        node_count,
-        dead_times,
-    ) = get_duration_and_dead_ratio(file)
-    if dead_duration is None:
-        dead_times = [0]
-    parts = file.split("/")
-    runs_idex = parts.index("Runs")
-    fault = parts[runs_idex + 1]
-    if node_count is not None and node_count % 40 != 0:
+            print(log_file, "Couldn't find the completion time")
+        return log_efficiency
+    if len(rank_times) < 2:
         if verbose:
-            print(file, "Nodes off: {}".format(node_count))
-        extra_nodes = np.ceil(node_count / 80) * 80
-        dead_times.extend(
-            [np.mean(dead_times) for i in range(extra_nodes - node_count)]
-        )
-    if verbose:
-        print(
-            file,
-            dead_duration,
-            sum(dead_times) / 3600,
-            node_count * dead_duration * (decimal_dead_time / 3600),
+            print(log_file, "Not enough times")
+        return log_efficiency
+
+    times = sorted(rank_times.values())
+    log_efficiency.duration = (end_time - times[0]).total_seconds()
+    log_efficiency.n_ranks = len(times)
+    log_efficiency.idle_times = [(end_time - time).total_seconds() for time in times]
+
+    if ranks_per_node > 0 and log_efficiency.n_ranks % ranks_per_node != 0:
+        if verbose:
+            print(log_file, "Nodes not fully used: {}".format(log_efficiency.n_ranks))
+        n_unused = ranks_per_node - log_efficiency.n_ranks % ranks_per_node
+        log_efficiency.idle_times.extend(
+            [np.mean(log_efficiency.idle_times)] * n_unused
         )
-    values[i] = (file, fault, dead_duration, decimal_dead_time, sum(dead_times) / 3600)
+    return log_efficiency
+
+
+def _get_log_efficiency(args):
+    return get_log_efficiency(*args)
 
-faults = np.unique(values["fault"])
 
-for fault in faults:
-    fault_mask = values["fault"] == fault
-    avg = np.mean(values[fault_mask]["duration"])
-    stdev = np.std(values[fault_mask]["duration"])
-    outliers = values["duration"] > avg * 2
-    values = values[~np.logical_and(fault_mask, outliers)]
-    if sum(np.logical_and(fault_mask, outliers)) > 0:
+def analyse_logs(
+    log_files: Iterable[str],
+    n_procs: int = 1,
+    ranks_per_node: int = DEFAULT_RANKS_PER_NODE,
+    verbose: bool = False,
+) -> List[LogEfficiency]:
+    """Gets the rank idle times of every log, in parallel if n_procs > 1"""
+    tasks = [(log_file, ranks_per_node, verbose) for log_file in log_files]
+    if n_procs > 1:
+        with Pool(n_procs) as p:
+            return p.map(
+                _get_log_efficiency,
+                tasks,
+                chunksize=max(1, len(tasks) // (n_procs * 4)),
+            )
+    return [_get_log_efficiency(task) for task in tasks]
+
+
+def get_log_df(log_efficiencies: List[LogEfficiency]):
+    """One row per log, logs with a duration more than twice the mean
+    duration of its fault are removed as outliers"""
+    df = pd.DataFrame(
+        [
+            (
+                log_efficiency.log_file,
+                log_efficiency.fault,
+                log_efficiency.proc_type.str_value,
+                log_efficiency.duration,
+                log_efficiency.n_ranks,
+                log_efficiency.efficiency,
+                log_efficiency.core_hours_lost,
+            )
+            for log_efficiency in log_efficiencies
+        ],
+        columns=[
+            "f_name",
+            "fault",
+            "proc_type",
+            "duration",
+            "n_ranks",
+            "efficiency",
+            "ch_lost",
+        ],
+    )
+
+    mean_duration = df.groupby(["fault", "proc_type"])["duration"].transform("mean")
+    outliers = df["duration"] > mean_duration * 2
+    for (fault, proc_type), count in (
+        df[outliers].groupby(["fault", "proc_type"]).size().items()
+    ):
+        print("Removing {} {} outliers for fault {}".format(count, proc_type, fault))
+    return df[~outliers]
+
+
+def get_idle_histogram(
+    log_efficiencies: List[LogEfficiency], bins: np.ndarray = IDLE_HIST_BINS
+):
+    """Histogram of the idle time fraction (idle time / duration) of every rank,
+    for each process type"""
+    idle_fractions = {}
+    for log_efficiency in log_efficiencies:
+        if log_efficiency.valid:
+            idle_fractions.setdefault(log_efficiency.proc_type.str_value, []).extend(
+                np.asarray(log_efficiency.idle_times) / log_efficiency.duration
+            )
+
+    hist_df = pd.DataFrame(
+        {"bin_start": bins[:-1], "bin_end": bins[1:]}, dtype=np.float64
+    )
+    for proc_type, fractions in idle_fractions.items():
+        hist_df[proc_type], _ = np.histogram(np.clip(fractions, 0, 1), bins=bins)
+    return hist_df
+
+
+def get_fault_df(log_df: pd.DataFrame):
+    """Core hours lost and efficiency per fault and process type"""
+    log_df = log_df[log_df["ch_lost"] > 0]
+    return log_df.groupby(["fault", "proc_type"]).agg(
+        n_rels=("f_name", "size"),
+        mean_duration=("duration", "mean"),
+        mean_n_ranks=("n_ranks", "mean"),
+        mean_efficiency=("efficiency", "mean"),
+        min_efficiency=("efficiency", "min"),
+        ch_lost=("ch_lost", "sum"),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "log_glob",
+        help='log file selection expression. eg: "Runs/*/*/HF/Acc/HF.log" or "Runs/*/*/BB/Acc/BB.log"',
+    )
+    parser.add_argument(
+        "-o",
+        "--out_file",
+        help="The file to write the data to",
+        default="hf_ch_burn.csv",
+    )
+    parser.add_argument(
+        "-n", "--n_procs", type=int, default=1, help="Number of processes to use"
+    )
+    parser.add_argument(
+        "--ranks_per_node",
+        type=int,
+        default=DEFAULT_RANKS_PER_NODE,
+        help="Number of ranks per node, the unused ranks of partially used nodes are counted as idle. "
+        "Use 0 to disable",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Additional print statements enabled.",
+    )
+    args = parser.parse_args()
+
+    log_files = glob(args.log_glob)
+    log_efficiencies = analyse_logs(
+        log_files, args.n_procs, args.ranks_per_node, args.verbose
+    )
+
+    log_df = get_log_df(log_efficiencies)
+    log_df.to_csv(args.out_file, index=False)
+
+    out_prefix = os.path.splitext(args.out_file)[0]
+    get_idle_histogram(log_efficiencies).to_csv(
+        f"{out_prefix}_idle_hist.csv", index=False
+    )
+    get_fault_df(log_df).to_csv(f"{out_prefix}_faults.csv")
+
+    n_logs = pd.Series(
+        [log_efficiency.proc_type.str_value for log_efficiency in log_efficiencies]
+    ).value_counts()
+    for proc_type, proc_df in log_df[log_df["ch_lost"] > 0].groupby("proc_type"):
+        print(proc_type)
+        print("Average duration: {}s".format(proc_df["duration"].mean()))
+        print("Average efficiency: {}".format(proc_df["efficiency"].mean()))
+        print("Average ch burned: {}".format(proc_df["ch_lost"].mean()))
+        print("Total known ch burned: {}".format(proc_df["ch_lost"].sum()))
         print(
-            "Removing {} outliers for fault {}".format(
-                sum(np.logical_and(fault_mask, outliers)), fault
+            "Extrapolated ch burned: {}".format(
+                proc_df["ch_lost"].mean() * n_logs[proc_type]
             )
         )
 
-np.savetxt(args.out_file, values, delimiter=", ", fmt="%s")
-values = values[values["ch_burned"] > 0]
-print("Average duration: {}s".format(sum(values["duration"]) / len(values)))
-print("Average ch burned: {}".format(sum(values["ch_burned"]) / len(values) / 2))
-print("Total known ch burned: {}".format(sum(values["ch_burned"]) / 2))
-print(
-    "Extrapolated ch burned: {}".format(
-        sum(values["ch_burned"]) / len(values) / 2 * rels
-    )
-)
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@
 This script is used after the workflow has been run to collect metadata and compile it all to a csv
 """
 import argparse
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Dict, List
 
 import numpy as np
 import pandas as pd
@@ -111,13 +114,11 @@ class DbStat:
         return f"{self.low}-{self.high}"
 
 
-def add_db_stat(df: pd.DataFrame, rel_name: str, df_location: str, new_val: int):
+def combine_db_stat(prev_val, new_val: int):
     """
-    Adds the db stat to the dataframe
-    But first checks if there is a current non_zero value in the df location
-    If there is one then it adds the values as a low-high format
+    Combines the db stat with the current value
+    If the current value is non_zero then the values are combined in a low-high format
     """
-    prev_val = df.loc[rel_name, df_location]
     if prev_val != 0:
         if isinstance(prev_val, DbStat):
             prev_val.add_value(new_val)
@@ -126,9 +127,20 @@ def add_db_stat(df: pd.DataFrame, rel_name: str, df_location: str, new_val: int)
                 low, high = new_val, prev_val
             else:
                 low, high = prev_val, new_val
-            df.loc[rel_name, df_location] = DbStat(low, high)
-    else:
-        df.loc[rel_name, df_location] = new_val
+            return DbStat(low, high)
+        return prev_val
+    return new_val
+
+
+def add_db_stat(df: pd.DataFrame, rel_name: str, df_location: str, new_val: int):
+    """
+    Adds the db stat to the dataframe
+    But first checks if there is a current non_zero value in the df location
+    If there is one then it adds the values as a low-high format
+    """
+    df.loc[rel_name, df_location] = combine_db_stat(
+        df.loc[rel_name, df_location], new_val
+    )
     return df
 
 
@@ -141,28 +153,14 @@ def get_rel_info(
     """
     Loads the given relisations info and populates the dataframe row
     """
-    fault_name = simulation_structure.get_fault_from_realisation(rel_name)
-    params = sim_params.load_sim_params(
-        simulation_structure.get_sim_params_yaml_path(
-            f"{root_dir}/Runs/{fault_name}/{rel_name}"
-        ),
-        load_vm=True,
-    )
-
     # Create relisation df
     df = pd.DataFrame(
         columns=COLUMNS, index=[rel_name], data=np.zeros(shape=(1, len(COLUMNS)))
     )
 
-    # General Parameter Metadata
-    for k, v in GENERAL_PARAM_LOCATIONS.items():
-        if isinstance(v, list):
-            value = params
-            for index in v:
-                value = value[index]
-        else:
-            value = params[v]
-        df.loc[rel_name, k] = value
+    # Parameter and IM calc csv Metadata
+    for k, v in get_rel_params_info(rel_name, root_dir).items():
+        df.loc[rel_name, k] = v
 
     states = db.get_core_hour_states(rel_name, ch_count_type)
     resub_counter = dict()
@@ -199,29 +197,131 @@ def get_rel_info(
     for k, v in resub_counter.items():
         df.loc[rel_name, f"{k}_resubmits"] = v
 
+    return df
+
+
+@lru_cache(maxsize=None)
+def get_n_stations(stat_file: str):
+    """Number of stations in the station file, realisations generally share the same file"""
+    return len(shared.get_stations(stat_file))
+
+
+def get_im_csv_counts(csv_ffp: str):
+    """Gets the number of pSA and FAS columns of the IM calc csv, only reads the header"""
+    csv_columns = pd.read_csv(csv_ffp, nrows=0).columns.values
+    return (
+        len([True for column in csv_columns if "pSA" in column]),
+        len([True for column in csv_columns if "FAS" in column]),
+    )
+
+
+def get_rel_params_info(rel_name: str, root_dir: str):
+    """
+    Gets the metadata of the realisation that comes from the sim params and IM calc csv
+    Returns a dictionary with a subset of the COLUMNS as keys
+    """
+    fault_name = simulation_structure.get_fault_from_realisation(rel_name)
+    params = sim_params.load_sim_params(
+        simulation_structure.get_sim_params_yaml_path(
+            f"{root_dir}/Runs/{fault_name}/{rel_name}"
+        ),
+        load_vm=True,
+    )
+
+    row = {}
+    # General Parameter Metadata
+    for k, v in GENERAL_PARAM_LOCATIONS.items():
+        if isinstance(v, list):
+            value = params
+            for index in v:
+                value = value[index]
+        else:
+            value = params[v]
+        row[k] = value
+
     # Extra Metadata
-    df.loc[rel_name, "IM_calc_components"] = len(params["ims"]["component"])
-    df.loc[rel_name, "EMOD3D_nt"] = params["sim_duration"] / params["dt"]
-    df.loc[rel_name, "HF_nt"] = params["sim_duration"] / params["hf"]["dt"]
-    df.loc[rel_name, "BB_nt"] = params["sim_duration"] / params["bb"]["dt"]
-    df.loc[rel_name, "advanced_IM_models"] = len(params["advanced_IM"]["models"])
-    stations = shared.get_stations(params["stat_file"])
-    df.loc[rel_name, "HF_n_stats"] = len(stations)
-    df.loc[rel_name, "BB_n_stats"] = len(stations)
-    df.loc[rel_name, "advanced_IM_stations"] = len(stations)
+    row["IM_calc_components"] = len(params["ims"]["component"])
+    row["EMOD3D_nt"] = params["sim_duration"] / params["dt"]
+    row["HF_nt"] = params["sim_duration"] / params["hf"]["dt"]
+    row["BB_nt"] = params["sim_duration"] / params["bb"]["dt"]
+    row["advanced_IM_models"] = len(params["advanced_IM"]["models"])
+    n_stations = get_n_stations(params["stat_file"])
+    row["HF_n_stats"] = n_stations
+    row["BB_n_stats"] = n_stations
+    row["advanced_IM_stations"] = n_stations
 
     # From IM calc csv
     csv_ffp = f"{root_dir}/Runs/{fault_name}/{rel_name}/IM_calc/{rel_name}.csv"
     try:
-        csv_columns = pd.read_csv(csv_ffp).columns.values
-        df.loc[rel_name, "IM_calc_pSA_count"] = len(
-            [True for column in csv_columns if "pSA" in column]
-        )
-        df.loc[rel_name, "IM_calc_FAS_count"] = len(
-            [True for column in csv_columns if "FAS" in column]
-        )
+        row["IM_calc_pSA_count"], row["IM_calc_FAS_count"] = get_im_csv_counts(csv_ffp)
     except FileNotFoundError:
         print(f"Could not find file {csv_ffp} (Will not exist if IM_calc was not run)")
+    return row
+
+
+def _get_rel_params_info(args):
+    return get_rel_params_info(*args)
+
+
+def get_all_rel_info(
+    rel_names: List[str],
+    root_dir: str,
+    db: MgmtDB,
+    ch_count_type: constants.ChCountType,
+    n_procs: int = 1,
+):
+    """
+    Gets the info of all the given realisations
+    The job info is retrieved from the db with a single query, the sim params and
+    IM calc csv headers are loaded in parallel and the dataframe is only created once.
+    """
+    tasks = [(rel_name, root_dir) for rel_name in rel_names]
+    if n_procs > 1:
+        with Pool(n_procs) as p:
+            param_rows = p.map(_get_rel_params_info, tasks)
+    else:
+        param_rows = [_get_rel_params_info(task) for task in tasks]
+    rows: Dict[str, Dict] = dict(zip(rel_names, param_rows))
+
+    resub_counter = dict()
+    # DB Metadata
+    for (
+        rel_name,
+        proc_type,
+        job_id,
+        queued_time,
+        start_time,
+        end_time,
+        nodes,
+        cores,
+        memory,
+        WCT,
+    ) in db.get_core_hour_jobs(ch_count_type):
+        row = rows.get(rel_name)
+        if row is None or proc_type not in METADATA_PROC_TYPES:
+            continue
+        proc_type_name = const.ProcessType(proc_type).str_value
+        # Add runtime and cores to row
+        runtime = end_time - start_time
+        runtime_col = f"{proc_type_name}_runtime"
+        row[runtime_col] = row.get(runtime_col, 0) + runtime / 60
+        cores_col = f"{proc_type_name}_cores"
+        row[cores_col] = combine_db_stat(row.get(cores_col, 0), cores)
+        # Add to core hours
+        ch_col = f"{proc_type_name}_core_hours"
+        row[ch_col] = row.get(ch_col, 0) + cores * runtime / 3600
+        row["Total_core_hours"] = (
+            row.get("Total_core_hours", 0) + cores * runtime / 3600
+        )
+        # Count the resubmits
+        key = (rel_name, proc_type_name)
+        resub_counter[key] = resub_counter.get(key, -1) + 1
+    # Add resubmits to the rows
+    for (rel_name, proc_type_name), v in resub_counter.items():
+        rows[rel_name][f"{proc_type_name}_resubmits"] = v
+
+    df = pd.DataFrame.from_dict(rows, orient="index", columns=COLUMNS)
+    df = df.fillna(0)
     return df
 
 
@@ -239,6 +339,20 @@ def parse_args():
         " 'Needed' counts the core hours it should have used without fails",
     )
     parser.add_argument("output_ffp", type=str)
+    parser.add_argument(
+        "-n",
+        "--n_procs",
+        type=int,
+        default=1,
+        help="Number of processes to use for loading the realisation parameters",
+    )
+    parser.add_argument(
+        "--per_realisation",
+        action="store_true",
+        default=False,
+        help="Queries the database separately for each realisation and job, "
+        "instead of using a single query for all realisations",
+    )
     return parser.parse_args()
 
 
@@ -253,17 +367,19 @@ def main():
 
     # Generate dataframe
     db = MgmtDB.MgmtDB(f"{root_dir}/slurm_mgmt.db")
-    rel_names = db.get_rel_names()
-    df = pd.DataFrame(
-        columns=COLUMNS, data=np.zeros(shape=(len(rel_names), len(COLUMNS)))
-    )
-    df.index = [name_tuple[0] for name_tuple in rel_names]
+    rel_names = [name_tuple[0] for name_tuple in db.get_rel_names()]
+    if args.per_realisation:
+        df = pd.DataFrame(
+            columns=COLUMNS, data=np.zeros(shape=(len(rel_names), len(COLUMNS)))
+        )
+        df.index = rel_names
+        for rel_name in rel_names:
+            df.loc[rel_name] = get_rel_info(rel_name, root_dir, db, ch_count_type).loc[
+                rel_name
+            ]
+    else:
+        df = get_all_rel_info(rel_names, root_dir, db, ch_count_type, args.n_procs)
     df.index.name = "Rel_name"
-    for ix, name_tuple in enumerate(rel_names):
-        rel_name = name_tuple[0]
-        df.loc[rel_name] = get_rel_info(rel_name, root_dir, db, ch_count_type).loc[
-            rel_name
-        ]
     df.to_csv(output_ffp)
 
 
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
-"""This script is used from inside the submit/run slurm scripts to store metadata in a
-json file.
+"""This script is used from inside the submit/run slurm scripts to store metadata in the
+line-delimited metadata log (ch_log/metadata_log.jsonl) of a realisation.
 Example:
 python3 log_metadata.py ./log_dir LF cores=12 run_time=12.5
 """
@@ -25,6 +25,12 @@ LOCK_FILENAME = "{}.lock".format(const.METADATA_LOG_FILENAME)
 
 METACONST_TO_ADD = [const.MetadataField.run_time.value]
 
+# Append-only, line-delimited metadata log
+METADATA_RECORDS_FILENAME = "{}l".format(const.METADATA_LOG_FILENAME)
+RECORD_SIM_NAME = "sim_name"
+RECORD_PROC_TYPE = "proc_type"
+RECORD_VALUES = "values"
+
 
 class KeyValuePairsAction(argparse.Action):
     """Allows passing key=value pairs to the parser."""
@@ -64,6 +70,131 @@ def convert_to_numeric(str_value):
     return str_value
 
 
+def merge_metadata(proc_data: Dict, metadata_dict: Dict[str, str]):
+    """Adds the metadata key, value pairs to the process data of a metadata log.
+
+    If a key already exists, it is not changed and instead new values are added
+    with a postfix such as _1, _2, etc
+    """
+    for k, v in metadata_dict.items():
+        if type(v) is str:
+            v = convert_to_numeric(v)
+
+        # Key doesn't exists yet
+        if k not in proc_data.keys():
+            proc_data[k] = v
+            continue
+
+        # Key already exists
+        k_count = sum([1 for cur_k in proc_data.keys() if k in cur_k])
+
+        # Key has only been added once before (i.e. primary value)
+        # Duplicate and add _1 postfix
+        if k_count == 1:
+            proc_data["{}_1".format(k)] = proc_data[k]
+
+            # Add new value
+            proc_data["{}_2".format(k)] = v
+        # Several keys already exists, just add additional with count postfix
+        else:
+            # Don't need a +1 as the count includes the primary value
+            proc_data["{}_{}".format(k, k_count)] = v
+
+
+def append_metadata(
+    log_dir: str,
+    proc_type: str,
+    metadata_dict: Dict[str, str],
+    sim_name: str = None,
+    logger: Logger = get_basic_logger(),
+):
+    """Appends a metadata record to the line-delimited metadata log of a realisation.
+
+    Each call writes a single json line with one append write, so no lock is required
+    and the existing content is never rewritten. The records are combined into the
+    same structure as the json metadata log by load_metadata_records.
+
+    Parameters
+    ----------
+    log_dir: str
+        The ch_log directory of the realisation
+    proc_type: str
+        The process type this is for, one of LF/HF/BB/IM
+    metadata_dict: Dictionary with string keys and values
+        The metadata key and value pairs
+    sim_name: str, optional
+        The simulation/realisation name, defaults to the name of the
+        directory containing the log_dir
+    logger:
+        Logger to pass log messages to
+    """
+    if not const.ProcessType.has_str_value(proc_type):
+        logger.warning(
+            "{} is not a valid process type. Logged anyway.".format(proc_type)
+        )
+    if sim_name is None:
+        sim_name = os.path.basename(os.path.dirname(os.path.abspath(log_dir)))
+
+    record = {
+        RECORD_SIM_NAME: sim_name,
+        RECORD_PROC_TYPE: proc_type,
+        RECORD_VALUES: {
+            k: convert_to_numeric(v) if type(v) is str else v
+            for k, v in metadata_dict.items()
+        },
+    }
+    line = (json.dumps(record) + "\n").encode("utf-8")
+
+    os.makedirs(log_dir, exist_ok=True)
+    fd = os.open(
+        os.path.join(log_dir, METADATA_RECORDS_FILENAME),
+        os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+        0o664,
+    )
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def read_metadata_records(records_file: str, offset: int = 0):
+    """Reads the complete records of a line-delimited metadata log,
+    starting at the given byte offset.
+
+    Returns the list of records and the offset after the last complete record,
+    a partially written last line is left for the next read.
+    """
+    with open(records_file, "rb") as f:
+        f.seek(offset)
+        content = f.read()
+
+    end = content.rfind(b"\n") + 1
+    records = []
+    for line in content[:end].splitlines():
+        if line.strip():
+            records.append(json.loads(line))
+    return records, offset + end
+
+
+def apply_metadata_records(json_data: Dict, records: List[Dict]):
+    """Applies the records to the json metadata log structure, in order"""
+    for record in records:
+        json_data.setdefault(
+            const.MetadataField.sim_name.value, record[RECORD_SIM_NAME]
+        )
+        merge_metadata(
+            json_data.setdefault(record[RECORD_PROC_TYPE], {}), record[RECORD_VALUES]
+        )
+    return json_data
+
+
+def load_metadata_records(log_dir: str):
+    """Loads the line-delimited metadata log of a realisation in the
+    same structure as the json metadata log"""
+    records, _ = read_metadata_records(os.path.join(log_dir, METADATA_RECORDS_FILENAME))
+    return apply_metadata_records({}, records)
+
+
 def store_metadata(
     log_file: str,
     proc_type: str,
@@ -154,31 +285,7 @@ def store_metadata(
         proc_data = {}
         json_data[proc_type] = proc_data
 
-    for k, v in metadata_dict.items():
-        if type(v) is str:
-            v = convert_to_numeric(v)
-
-        # Key doesn't exists yet
-        if k not in proc_data.keys():
-            proc_data[k] = v
-            print("{} not in proc_Data.keys(),value {}\n".format(k, v))
-            continue
-
-        # Key already exists
-        if k in proc_data.keys():
-            k_count = sum([1 for cur_k in proc_data.keys() if k in cur_k])
-
-            # Key has only been added once before (i.e. primary value)
-            # Duplicate and add _1 postfix
-            if k_count == 1:
-                proc_data["{}_1".format(k)] = proc_data[k]
-
-                # Add new value
-                proc_data["{}_2".format(k)] = v
-            # Several keys already exists, just add additional with count postfix
-            else:
-                # Don't need a +1 as the count includes the primary value
-                proc_data["{}_{}".format(k, k_count)] = v
+    merge_metadata(proc_data, metadata_dict)
 
     # Write the json
     with open(log_file, "w") as f:
@@ -188,8 +295,7 @@ def store_metadata(
 
 
 def main(args):
-    # This should come from constants
-    log_dir = os.path.join(args.sim_dir, "ch_log", const.METADATA_LOG_FILENAME)
+    log_dir = os.path.join(args.sim_dir, "ch_log")
 
     metadata_dict = getattr(args, METADATA_VALUES)
     # Determine run_time from start and end time
@@ -264,7 +370,7 @@ def main(args):
                 float(params["sim_duration"]) / float(bb_dt)
             )
 
-    store_metadata(
+    append_metadata(
         log_dir, args.proc_type, metadata_dict, sim_name=os.path.basename(args.sim_dir)
     )
 
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Incremental, columnar store for the realisation metadata logs.
+
+The line-delimited metadata logs (ch_log/metadata_log.jsonl, written by
+log_metadata.append_metadata) are only ever appended to. The store keeps the byte
+offset up to which each log has been read, so every update only reads the records
+added since the previous one. New records are written as a parquet partition, and
+compaction folds the partitions into a single table holding the combined metadata
+of each realisation.
+
+Store directory layout:
+    state.json                  Read offsets of each metadata log
+    partition_<n>.parquet       Records added by one update
+    realisations.parquet        Compacted metadata, one row per realisation
+"""
+import glob
+import json
+import os
+from typing import Dict, Iterable, List
+
+import pandas as pd
+
+from workflow.automation.metadata import agg_json_data
+from workflow.automation.metadata.log_metadata import (
+    METADATA_RECORDS_FILENAME,
+    RECORD_PROC_TYPE,
+    RECORD_SIM_NAME,
+    RECORD_VALUES,
+    apply_metadata_records,
+    read_metadata_records,
+)
+
+STATE_FILENAME = "state.json"
+PARTITION_FILENAME = "partition_{:06d}.parquet"
+PARTITION_PATTERN = "partition_*.parquet"
+COMPACTED_FILENAME = "realisations.parquet"
+
+COL_SIM_NAME = "sim_name"
+COL_PROC_TYPE = "proc_type"
+COL_VALUES = "values"
+COL_METADATA = "metadata"
+
+
+def find_metadata_logs(input_dirs: Iterable[str]):
+    """Recursively finds all line-delimited metadata logs in the given directories"""
+    return [
+        log_file
+        for input_dir in input_dirs
+        for log_file in glob.glob(
+            os.path.join(input_dir, "**", METADATA_RECORDS_FILENAME), recursive=True
+        )
+    ]
+
+
+class MetadataStore:
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+        self._state_file = os.path.join(store_dir, STATE_FILENAME)
+        self._compacted_file = os.path.join(store_dir, COMPACTED_FILENAME)
+
+        if os.path.isfile(self._state_file):
+            with open(self._state_file, "r") as f:
+                self._state = json.load(f)
+        else:
+            self._state = {"offsets": {}, "next_partition": 0}
+
+    def _save_state(self):
+        # Write then rename, so an interrupted update never leaves a corrupt state
+        tmp_file = f"{self._state_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_file, self._state_file)
+
+    def _partitions(self):
+        return sorted(glob.glob(os.path.join(self.store_dir, PARTITION_PATTERN)))
+
+    def update(self, log_files: Iterable[str]):
+        """Reads the records added to the metadata logs since the last update
+        and writes them to a new partition.
+
+        Returns the number of new records
+        """
+        offsets = self._state["offsets"]
+        sim_names, proc_types, values = [], [], []
+        for log_file in log_files:
+            log_file = os.path.abspath(log_file)
+            stat = os.stat(log_file)
+            inode, offset = offsets.get(log_file, (stat.st_ino, 0))
+            if inode != stat.st_ino or stat.st_size < offset:
+                print(
+                    f"Metadata log {log_file} has been replaced, reading it again. "
+                    f"Records that were already read will be duplicated."
+                )
+                offset = 0
+            if stat.st_size == offset:
+                continue
+
+            records, offset = read_metadata_records(log_file, offset)
+            offsets[log_file] = (stat.st_ino, offset)
+            for record in records:
+                sim_names.append(record[RECORD_SIM_NAME])
+                proc_types.append(record[RECORD_PROC_TYPE])
+                values.append(json.dumps(record[RECORD_VALUES]))
+
+        if len(sim_names) > 0:
+            pd.DataFrame(
+                {COL_SIM_NAME: sim_names, COL_PROC_TYPE: proc_types, COL_VALUES: values}
+            ).to_parquet(
+                os.path.join(
+                    self.store_dir,
+                    PARTITION_FILENAME.format(self._state["next_partition"]),
+                ),
+                index=False,
+            )
+            self._state["next_partition"] += 1
+        self._save_state()
+
+        return len(sim_names)
+
+    def _load_compacted(self) -> Dict[str, Dict]:
+        if not os.path.isfile(self._compacted_file):
+            return {}
+        df = pd.read_parquet(self._compacted_file)
+        return {
+            sim_name: json.loads(metadata)
+            for sim_name, metadata in zip(df[COL_SIM_NAME], df[COL_METADATA])
+        }
+
+    def compact(self):
+        """Folds all partitions into the compacted realisation table.
+        Only the realisations with new records are changed."""
+        partitions = self._partitions()
+        if len(partitions) == 0:
+            return
+
+        metadata = self._load_compacted()
+        for partition in partitions:
+            df = pd.read_parquet(partition)
+            for sim_name, sim_df in df.groupby(COL_SIM_NAME, sort=False):
+                apply_metadata_records(
+                    metadata.setdefault(sim_name, {}),
+                    [
+                        {
+                            RECORD_SIM_NAME: sim_name,
+                            RECORD_PROC_TYPE: proc_type,
+                            RECORD_VALUES: json.loads(values),
+                        }
+                        for proc_type, values in zip(
+                            sim_df[COL_PROC_TYPE], sim_df[COL_VALUES]
+                        )
+                    ],
+                )
+
+        tmp_file = f"{self._compacted_file}.tmp"
+        pd.DataFrame(
+            {
+                COL_SIM_NAME: list(metadata.keys()),
+                COL_METADATA: [json.dumps(value) for value in metadata.values()],
+            }
+        ).to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, self._compacted_file)
+
+        for partition in partitions:
+            os.remove(partition)
+
+    def get_metadata(self) -> Dict[str, Dict]:
+        """Returns the metadata of every realisation, in the same structure
+        as the json metadata logs"""
+        self.compact()
+        return self._load_compacted()
+
+    def create_dataframe(self, calc_core_hours: bool):
+        """Creates the aggregated metadata dataframe, see agg_json_data"""
+        rows: List = [
+            agg_json_data.get_row_from_dict(data_dict, sim_name)
+            for sim_name, data_dict in self.get_metadata().items()
+        ]
+        return agg_json_data.rows_to_dataframe(rows, calc_core_hours)
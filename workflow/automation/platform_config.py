@@ -14,6 +14,11 @@ from qcore.constants import PLATFORM_CONFIG, ProcessType
 
 WORKFLOW_DIR = abspath(join(dirname(__file__), ".."))
 
+# Platform config keys that may be left out of the config file, with their defaults
+#   ADMISSION_CONTROL: The per machine core and core hour budgets of auto_submit,
+#       see workflow.automation.lib.admission_control
+OPTIONAL_PLATFORM_CONFIG = {"ADMISSION_CONTROL": {}}
+
 
 class Platforms(Enum):
     LOCAL = auto()
@@ -60,8 +65,13 @@ for key, value in platform_config.items():
     if isinstance(value, str) and "$workflow" in value:
         platform_config[key] = value.replace("$workflow", WORKFLOW_DIR)
 
-errors = set(platform_config.keys()).symmetric_difference(
-    set([key.name for key in PLATFORM_CONFIG])
+for key, value in OPTIONAL_PLATFORM_CONFIG.items():
+    platform_config.setdefault(key, value)
+
+errors = (
+    set(platform_config.keys())
+    .symmetric_difference(set([key.name for key in PLATFORM_CONFIG]))
+    .difference(OPTIONAL_PLATFORM_CONFIG.keys())
 )
 if errors:
     missing_keys = []
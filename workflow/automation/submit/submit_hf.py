@@ -170,6 +170,8 @@ def main(
             logger=logger,
         )
 
+    return script_file_path
+
 
 def load_args():
     """
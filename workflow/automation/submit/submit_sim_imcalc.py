@@ -30,8 +30,10 @@ def submit_im_calc_slurm(
     retries: int = 0,
     target_machine: str = get_target_machine(const.ProcessType.IM_calculation).name,
     logger: Logger = get_basic_logger(),
+    submit: bool = True,
 ):
-    """Creates the IM calc slurm scrip, also submits if specified
+    """Creates the IM calc slurm scrip, also submits if specified.
+    Returns the path of the script
 
     The options_dict is populated by the DEFAULT_OPTIONS, values can be changed by
     passing in a dict containing the entries that require changing. Merges the
@@ -218,12 +220,14 @@ def submit_im_calc_slurm(
         command_options,
     )
 
-    submit_script_to_scheduler(
-        script_file_path,
-        proc_type.value,
-        sim_struct.get_mgmt_db_queue(params["mgmt_db_location"]),
-        sim_dir,
-        realisation_name,
-        target_machine=target_machine,
-        logger=logger,
-    )
+    if submit:
+        submit_script_to_scheduler(
+            script_file_path,
+            proc_type.value,
+            sim_struct.get_mgmt_db_queue(params["mgmt_db_location"]),
+            sim_dir,
+            realisation_name,
+            target_machine=target_machine,
+            logger=logger,
+        )
+    return script_file_path
@@ -0,0 +1,164 @@
+"""Unit tests for the discrete-event campaign simulation"""
+
+import pandas as pd
+import pytest
+import qcore.constants as const
+
+from workflow.automation.estimation.simulate_cybershake import (
+    REASON_DEPENDENCY,
+    compare_priority_policies,
+    get_task_costs,
+    simulate_campaign,
+)
+from workflow.automation.lib.task_priority import PriorityPolicy, TaskPrioritiser
+from workflow.automation.platform_config import HPC
+
+LF_RUN_TIME = 3.0
+HF_RUN_TIME = 1.0
+BB_RUN_TIME = 0.5
+
+TASK_CONFIG = {
+    const.ProcessType.EMOD3D.str_value: "REL_ONLY",
+    const.ProcessType.HF.str_value: "REL_ONLY",
+    const.ProcessType.BB.str_value: "REL_ONLY",
+}
+
+
+@pytest.fixture(scope="module")
+def estimation_df():
+    index = pd.MultiIndex.from_tuples(
+        [("Fault", "Fault_REL01"), ("Fault", "Fault_REL02")]
+    )
+    data = {}
+    for proc, run_time in [
+        (const.ProcessType.EMOD3D, LF_RUN_TIME),
+        (const.ProcessType.HF, HF_RUN_TIME),
+        (const.ProcessType.BB, BB_RUN_TIME),
+    ]:
+        data[(proc.str_value, const.MetadataField.core_hours.value)] = run_time * 2
+        data[(proc.str_value, const.MetadataField.run_time.value)] = run_time
+        data[(proc.str_value, const.MetadataField.n_cores.value)] = 2
+    return pd.DataFrame(data, index=index)
+
+
+def test_unlimited_runs(estimation_df):
+    """With enough slots all realisations run in parallel"""
+    simulation = simulate_campaign(
+        estimation_df, TASK_CONFIG, n_runs={hpc: 100 for hpc in HPC}
+    )
+
+    assert simulation.n_unfinished == 0
+    assert len(simulation.tasks) == 6
+    assert simulation.makespan == pytest.approx(
+        max(LF_RUN_TIME, HF_RUN_TIME) + BB_RUN_TIME
+    )
+    assert simulation.critical_path[-1][1] == const.ProcessType.BB.str_value
+    assert simulation.critical_path[-1][4] == REASON_DEPENDENCY
+    assert sum(simulation.machine_core_hours.values()) == pytest.approx(
+        2 * 2 * (LF_RUN_TIME + HF_RUN_TIME + BB_RUN_TIME)
+    )
+
+
+def test_single_run(estimation_df):
+    """Limiting every machine to a single job can only increase the makespan"""
+    unlimited = simulate_campaign(
+        estimation_df, TASK_CONFIG, n_runs={hpc: 100 for hpc in HPC}
+    )
+    limited = simulate_campaign(
+        estimation_df, TASK_CONFIG, n_runs={hpc: 1 for hpc in HPC}
+    )
+
+    assert limited.makespan > unlimited.makespan
+    assert limited.makespan <= 2 * (LF_RUN_TIME + HF_RUN_TIME + BB_RUN_TIME)
+
+
+def test_retries(estimation_df):
+    """Every attempt fails, so each task is attempted n_max_retries times and
+    nothing depending on them runs"""
+    simulation = simulate_campaign(
+        estimation_df,
+        TASK_CONFIG,
+        n_runs={hpc: 100 for hpc in HPC},
+        n_max_retries=2,
+        failure_rate=1.0,
+        seed=1,
+    )
+
+    assert all(task.failed for task in simulation.tasks)
+    # EMOD3D and HF are attempted twice each for both realisations
+    assert len(simulation.tasks) == 8
+    # BB never runs
+    assert simulation.n_unfinished == 2
+
+
+def test_task_prioritiser(estimation_df):
+    """The tasks are ordered by the estimated costs of the policy"""
+    costs = get_task_costs(estimation_df)
+    processes = [const.ProcessType.EMOD3D, const.ProcessType.HF, const.ProcessType.BB]
+    tasks = [
+        (proc_type.value, rel)
+        for rel in ["Fault_REL01", "Fault_REL02", "Other_REL01"]
+        for proc_type in reversed(processes)
+    ]
+
+    db_order = TaskPrioritiser(PriorityPolicy.db_order, costs, processes)
+    assert db_order.prioritise(tasks) == tasks
+
+    critical_path = TaskPrioritiser(PriorityPolicy.critical_path, costs, processes)
+    # BB depends on both EMOD3D and HF
+    assert critical_path.downstream_work(
+        "Fault_REL01", const.ProcessType.HF
+    ) == pytest.approx(HF_RUN_TIME + BB_RUN_TIME)
+    assert (
+        critical_path.downstream_work("Fault_REL01", const.ProcessType.EMOD3D)
+        >= LF_RUN_TIME + BB_RUN_TIME
+    )
+    assert critical_path.prioritise(tasks)[:2] == [
+        (const.ProcessType.EMOD3D.value, "Fault_REL01"),
+        (const.ProcessType.EMOD3D.value, "Fault_REL02"),
+    ]
+
+    shortest_job_first = TaskPrioritiser(
+        PriorityPolicy.shortest_job_first, costs, processes
+    )
+    # Other_REL01 has no estimates, so its tasks use the (shorter) default run time
+    assert shortest_job_first.prioritise(tasks) == tasks[6:] + [
+        (const.ProcessType.BB.value, "Fault_REL01"),
+        (const.ProcessType.BB.value, "Fault_REL02"),
+        (const.ProcessType.HF.value, "Fault_REL01"),
+        (const.ProcessType.HF.value, "Fault_REL02"),
+        (const.ProcessType.EMOD3D.value, "Fault_REL01"),
+        (const.ProcessType.EMOD3D.value, "Fault_REL02"),
+    ]
+
+    # Fair share takes the first task from the fault with fewer submitted jobs
+    fair_share = critical_path.prioritise(tasks, n_submitted={"Fault": 1})
+    assert fair_share[:2] == [
+        (const.ProcessType.EMOD3D.value, "Other_REL01"),
+        (const.ProcessType.EMOD3D.value, "Fault_REL01"),
+    ]
+
+
+def test_compare_priority_policies(estimation_df):
+    """Every policy completes all tasks, the order only matters with limited slots"""
+    policies = list(PriorityPolicy)
+    unlimited = compare_priority_policies(
+        estimation_df,
+        TASK_CONFIG,
+        policies,
+        [False, True],
+        n_runs={hpc: 100 for hpc in HPC},
+    )
+    limited = compare_priority_policies(
+        estimation_df,
+        TASK_CONFIG,
+        policies,
+        [False, True],
+        n_runs={hpc: 1 for hpc in HPC},
+    )
+
+    assert len(unlimited) == len(limited) == 2 * len(policies)
+    assert (unlimited.n_unfinished == 0).all()
+    assert (limited.n_unfinished == 0).all()
+    assert unlimited.makespan.nunique() == 1
+    assert (limited.makespan >= unlimited.makespan.max()).all()
@@ -17,6 +17,7 @@ from workflow.automation.metadata.agg_json_data import (
     load_metadata_df,
     DATE_COLUMNS,
 )
+from workflow.automation.metadata.log_metadata import append_metadata
 import qcore.constants as const
 
 
@@ -119,6 +120,7 @@ class TestAggJsonData:
             filename_pattern="*",
             calc_core_hours=True,
             not_recursive=False,
+            store_dir=None,
         )
         df = main(args)
 
@@ -131,6 +133,65 @@ class TestAggJsonData:
         # Check that the dataframes are the same
         pd.testing.assert_frame_equal(df, loaded_df)
 
+    def test_many_files(self, tmp_path):
+        """Each simulation gets its own row with only its own values, also when the
+        simulations have different columns, and the rows of a simulation that has
+        several files are merged"""
+        n_files = 300
+        json_files = []
+        for ix in range(n_files):
+            file = os.path.join(tmp_path, self.test_input_file_template.format(ix))
+            content = dict(self.json_files_content[(ix % 3) + 1])
+            content["sim_name"] = "simulation_{}".format(ix)
+            with open(file, "w") as f:
+                json.dump(content, f)
+            json_files.append(file)
+        # A later attempt of the first simulation
+        file = os.path.join(tmp_path, self.test_input_file_template.format(n_files))
+        with open(file, "w") as f:
+            json.dump({"sim_name": "simulation_0", "BB": {"nt": 100}}, f)
+        json_files.append(file)
+
+        df = create_dataframe(json_files, 1, True)
+        assert df.shape[0] == n_files
+        for ix in range(n_files):
+            content = self.json_files_content[(ix % 3) + 1]
+            row = df.loc["simulation_{}".format(ix)]
+            for proc_type in ["EMOD3D", "HF", "IM_calc"]:
+                if proc_type in content:
+                    assert row[(proc_type, "nt")] == content[proc_type]["nt"]
+                else:
+                    assert np.isnan(row[(proc_type, "nt")])
+        assert df.loc["simulation_0", ("BB", "nt")] == 100
+        assert df.loc["simulation_0", ("HF", "nt")] == 7284
+        assert df[("BB", "nt")].count() == 1
+
+        pd.testing.assert_frame_equal(df, create_dataframe(json_files, 3, True))
+
+    def test_output_jsonl(self, tmp_path):
+        """The line-delimited metadata logs are aggregated, also with the
+        metadata store"""
+        for ix, content in self.json_files_content.items():
+            log_dir = tmp_path / "Runs" / content["sim_name"] / "ch_log"
+            for proc_type, values in content.items():
+                if proc_type != "sim_name":
+                    append_metadata(str(log_dir), proc_type, values)
+
+        dfs = []
+        for store_dir in [None, str(tmp_path / "store")]:
+            args = argparse.Namespace(
+                input_dirs=[str(tmp_path / "Runs")],
+                output_file=str(tmp_path / f"metadata_{len(dfs)}.csv"),
+                n_procs=1,
+                filename_pattern="metadata_log",
+                calc_core_hours=True,
+                not_recursive=False,
+                store_dir=store_dir,
+            )
+            dfs.append(main(args))
+            self.df_check(dfs[-1])
+        pd.testing.assert_frame_equal(dfs[0].sort_index(), dfs[1].sort_index())
+
     def df_check(self, df: pd.DataFrame):
         """Tests general aggregation of simulation json log files"""
         # Check the shape (this has to updated if the content is changed)
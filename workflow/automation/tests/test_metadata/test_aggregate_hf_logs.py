@@ -0,0 +1,137 @@
+"""Unit tests for the rank idle time analysis of the HF and BB logs"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+import qcore.constants as const
+
+from workflow.automation.metadata import aggregate_hf_logs
+
+START_TIME = datetime(2023, 1, 2, 3, 4, 5)
+# Seconds after the start at which each rank of the last run completed
+RANK_TIMES = [10, 20, 30, 40]
+
+
+def log_line(seconds, logger_name, message):
+    time = START_TIME + timedelta(seconds=seconds)
+    return f"{time.strftime('%Y-%m-%d %H:%M:%S')},000:{logger_name}:DEBUG:{message}\n"
+
+
+def write_log(log_dir, log_name, rank_times, completed=True):
+    """Writes a log of a run that was restarted, the first run has to be ignored"""
+    log_dir.mkdir(parents=True)
+    lines = [
+        log_line(-100, "rank_0", "Process 0 of 2 completed 5 stations (1.00)."),
+        log_line(-90, "rank_1", "Process 1 of 2 completed 5 stations (1.00)."),
+        log_line(-90, "rank_0", "Simulation completed."),
+        "Traceback (most recent call last):\n",
+    ]
+    for rank, seconds in enumerate(rank_times):
+        lines.append(log_line(seconds - 5, f"rank_{rank}", "Working on station: A"))
+        lines.append(
+            log_line(
+                seconds,
+                f"rank_{rank}",
+                f"Process {rank} of {len(rank_times)} completed 5 stations (1.00).",
+            )
+        )
+    if completed:
+        lines.append(log_line(max(rank_times), "rank_0", "Simulation completed."))
+    log_file = log_dir / log_name
+    log_file.write_text("".join(lines))
+    return str(log_file)
+
+
+@pytest.fixture
+def runs_dir(tmp_path):
+    runs_dir = tmp_path / "Runs"
+    write_log(runs_dir / "Fault" / "Fault_REL01" / "HF" / "Acc", "HF.log", RANK_TIMES)
+    write_log(runs_dir / "Fault" / "Fault_REL02" / "HF" / "Acc", "HF.log", RANK_TIMES)
+    write_log(runs_dir / "Fault" / "Fault_REL01" / "BB" / "Acc", "BB.log", RANK_TIMES)
+    write_log(
+        runs_dir / "Fault" / "Fault_REL03" / "HF" / "Acc",
+        "HF.log",
+        RANK_TIMES,
+        completed=False,
+    )
+    return runs_dir
+
+
+def get_log_files(runs_dir):
+    return sorted(str(log_file) for log_file in runs_dir.glob("*/*/*/Acc/*.log"))
+
+
+def test_parse_log_line():
+    time, logger_name, message = aggregate_hf_logs.parse_log_line(
+        log_line(0, "rank_3", "Working on station: A")
+    )
+    assert time == START_TIME
+    assert logger_name == "rank_3"
+    assert message == "Working on station: A\n"
+    assert (
+        aggregate_hf_logs.parse_log_line("Traceback (most recent call last):") is None
+    )
+    assert aggregate_hf_logs.parse_log_line("a:b:c:d:e:f") is None
+
+
+@pytest.mark.parametrize("content", ["a\nbb\n\nccc\n", "a\nbb\nccc", "a"])
+def test_reverse_lines(tmp_path, content):
+    """Lines spanning several blocks are joined, empty lines are skipped"""
+    file = tmp_path / "log"
+    file.write_text(content)
+    assert list(aggregate_hf_logs.reverse_lines(str(file), block_size=2)) == [
+        line for line in reversed(content.split("\n")) if line
+    ]
+
+
+def test_get_log_efficiency(runs_dir):
+    """Only the ranks of the last run are counted, idle until the last rank finished"""
+    log_file = str(runs_dir / "Fault" / "Fault_REL01" / "HF" / "Acc" / "HF.log")
+    log_efficiency = aggregate_hf_logs.get_log_efficiency(log_file, ranks_per_node=0)
+    assert log_efficiency.fault == "Fault"
+    assert log_efficiency.proc_type == const.ProcessType.HF
+    assert log_efficiency.n_ranks == 4
+    assert log_efficiency.duration == 30
+    assert sorted(log_efficiency.idle_times) == [0, 10, 20, 30]
+    assert log_efficiency.efficiency == pytest.approx(0.5)
+    # HF is hyperthreaded
+    assert log_efficiency.core_hours_lost == pytest.approx(60 / 3600 / 2)
+
+    # The 4 unused ranks of the node idle for the mean idle time
+    log_efficiency = aggregate_hf_logs.get_log_efficiency(log_file, ranks_per_node=8)
+    assert len(log_efficiency.idle_times) == 8
+    assert log_efficiency.core_hours_lost == pytest.approx(120 / 3600 / 2)
+
+
+def test_get_log_efficiency_incomplete(runs_dir):
+    log_file = str(runs_dir / "Fault" / "Fault_REL03" / "HF" / "Acc" / "HF.log")
+    log_efficiency = aggregate_hf_logs.get_log_efficiency(log_file)
+    assert not log_efficiency.valid
+    assert np.isnan(log_efficiency.efficiency)
+    assert log_efficiency.core_hours_lost == 0
+
+
+def test_aggregation(runs_dir):
+    log_files = get_log_files(runs_dir)
+    log_efficiencies = aggregate_hf_logs.analyse_logs(log_files, ranks_per_node=0)
+    assert [log_efficiency.log_file for log_efficiency in log_efficiencies] == log_files
+    assert [
+        log_efficiency.n_ranks
+        for log_efficiency in aggregate_hf_logs.analyse_logs(
+            log_files, n_procs=2, ranks_per_node=0
+        )
+    ] == [log_efficiency.n_ranks for log_efficiency in log_efficiencies]
+
+    log_df = aggregate_hf_logs.get_log_df(log_efficiencies)
+    assert len(log_df) == 4
+
+    fault_df = aggregate_hf_logs.get_fault_df(log_df)
+    assert fault_df.loc[("Fault", "HF"), "n_rels"] == 2
+    assert fault_df.loc[("Fault", "HF"), "ch_lost"] == pytest.approx(60 / 3600)
+    assert fault_df.loc[("Fault", "BB"), "ch_lost"] == pytest.approx(60 / 3600)
+    assert fault_df.loc[("Fault", "BB"), "mean_efficiency"] == pytest.approx(0.5)
+
+    hist_df = aggregate_hf_logs.get_idle_histogram(log_efficiencies)
+    # Idle fractions 0, 1/3, 2/3 and 1 of every rank
+    assert hist_df["HF"].sum() == 8
+    assert hist_df["BB"].tolist() == [1, 0, 0, 1, 0, 0, 1, 0, 0, 1]
@@ -0,0 +1,61 @@
+"""Unit tests for collecting the metadata of realisations from the mgmt db"""
+import pytest
+import qcore.constants as const
+
+from workflow.automation.install_scripts import create_mgmt_db
+from workflow.automation.lib.MgmtDB import SchedulerTask
+from workflow.automation.lib.constants import ChCountType
+from workflow.automation.metadata import collect_metadata
+
+RUN_NAME = "Fault_REL01"
+
+
+@pytest.fixture
+def mgmt_db(tmp_path, monkeypatch):
+    """A mgmt db with a HF attempt killed by WCT followed by a completed one, and a
+    completed BB attempt of the realisation"""
+    # The sim params are not part of the test
+    monkeypatch.setattr(collect_metadata, "get_rel_params_info", lambda *args: {})
+    mgmt_db = create_mgmt_db.create_mgmt_db(
+        [], str(tmp_path / "slurm_mgmt.db"), {"Fault": 1}
+    )
+    for proc_type, job_id, end_status, cores in [
+        (const.ProcessType.HF.value, 1, const.Status.killed_WCT.value, 40),
+        (const.ProcessType.HF.value, 2, const.Status.completed.value, 40),
+        (const.ProcessType.BB.value, 3, const.Status.completed.value, 4),
+    ]:
+        for status, kwargs in [
+            (const.Status.queued.value, {"queued_time": 0}),
+            (const.Status.running.value, {"start_time": 0, "nodes": 1, "cores": cores}),
+            (end_status, {"end_time": 3600}),
+        ]:
+            mgmt_db.update_entries_live(
+                [SchedulerTask(RUN_NAME, proc_type, status, job_id, **kwargs)],
+                retry_max=3,
+            )
+    mgmt_db.close_conn()
+    return mgmt_db
+
+
+@pytest.mark.parametrize("ch_count_type", list(ChCountType))
+def test_get_rel_info(mgmt_db, ch_count_type):
+    """The per realisation collection has to match the collection of all
+    realisations with a single query"""
+    states = mgmt_db.get_core_hour_states(RUN_NAME, ch_count_type)
+    assert all(len(state) == 6 for state in states)
+
+    df = collect_metadata.get_rel_info(RUN_NAME, "", mgmt_db, ch_count_type)
+    assert df.loc[RUN_NAME, "HF_core_hours"] == pytest.approx(80)
+    assert df.loc[RUN_NAME, "BB_core_hours"] == pytest.approx(4)
+    assert df.loc[RUN_NAME, "Total_core_hours"] == pytest.approx(84)
+    assert df.loc[RUN_NAME, "HF_runtime"] == pytest.approx(120)
+    assert df.loc[RUN_NAME, "HF_resubmits"] == 1
+
+    all_df = collect_metadata.get_all_rel_info([RUN_NAME], "", mgmt_db, ch_count_type)
+    for column in [
+        "HF_core_hours",
+        "BB_core_hours",
+        "Total_core_hours",
+        "HF_resubmits",
+    ]:
+        assert df.loc[RUN_NAME, column] == all_df.loc[RUN_NAME, column]
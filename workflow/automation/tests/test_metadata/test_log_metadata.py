@@ -9,7 +9,14 @@ from typing import Union, Dict
 
 import pytest
 
-from workflow.automation.metadata.log_metadata import store_metadata, METACONST_TO_ADD
+from workflow.automation.metadata.log_metadata import (
+    store_metadata,
+    append_metadata,
+    load_metadata_records,
+    read_metadata_records,
+    METACONST_TO_ADD,
+    METADATA_RECORDS_FILENAME,
+)
 from qcore.constants import ProcessType, METADATA_LOG_FILENAME
 
 
@@ -100,6 +107,34 @@ class TestLogMetadata:
             },
         )
 
+    def test_append_metadata(self, tmp_path, log_file):
+        """Tests that the line-delimited log results in the same metadata
+        as the json log, and that reading from an offset only returns new records
+        """
+        log_dir = os.path.join(tmp_path, "ch_log")
+        proc_type = ProcessType.EMOD3D.str_value
+        metadata_values = [
+            {"test1": "22", METACONST_TO_ADD[0]: "5"},
+            {"test1": "25", METACONST_TO_ADD[0]: "3"},
+        ]
+
+        append_metadata(log_dir, proc_type, metadata_values[0], sim_name="sim")
+        records_file = os.path.join(log_dir, METADATA_RECORDS_FILENAME)
+        records, offset = read_metadata_records(records_file)
+        assert len(records) == 1
+
+        append_metadata(log_dir, proc_type, metadata_values[1], sim_name="sim")
+        records, _ = read_metadata_records(records_file, offset)
+        assert len(records) == 1
+        assert records[0]["values"]["test1"] == 25
+
+        for values in metadata_values:
+            store_metadata(log_file, proc_type, values)
+        with open(log_file, "r") as f:
+            json_data = json.load(f)
+
+        assert load_metadata_records(log_dir)[proc_type] == json_data[proc_type]
+
 
 if __name__ == "__main__":
     pytest.main(sys.argv)
@@ -0,0 +1,103 @@
+"""Unit tests for the incremental aggregation of the line-delimited metadata logs"""
+import os
+
+import pytest
+
+from workflow.automation.metadata.log_metadata import (
+    METADATA_RECORDS_FILENAME,
+    append_metadata,
+    load_metadata_records,
+)
+from workflow.automation.metadata.metadata_store import (
+    COMPACTED_FILENAME,
+    STATE_FILENAME,
+    MetadataStore,
+    find_metadata_logs,
+)
+
+SIM_NAMES = ["Fault_REL01", "Fault_REL02"]
+
+
+@pytest.fixture
+def runs_dir(tmp_path):
+    """Metadata logs of two realisations, with a retried HF attempt"""
+    runs_dir = tmp_path / "Runs"
+    for sim_name in SIM_NAMES:
+        log_dir = str(runs_dir / "Fault" / sim_name / "ch_log")
+        append_metadata(log_dir, "IM_calc", {"cores": "40", "run_time": "10.5"})
+        append_metadata(log_dir, "HF", {"cores": 80, "status": "failed"})
+        append_metadata(log_dir, "HF", {"cores": 80, "status": "completed"})
+    return str(runs_dir)
+
+
+def get_log_dir(runs_dir, sim_name):
+    return os.path.join(runs_dir, "Fault", sim_name, "ch_log")
+
+
+def test_find_metadata_logs(runs_dir):
+    assert sorted(find_metadata_logs([runs_dir])) == [
+        os.path.join(get_log_dir(runs_dir, sim_name), METADATA_RECORDS_FILENAME)
+        for sim_name in SIM_NAMES
+    ]
+
+
+def test_update(runs_dir, tmp_path):
+    """Each update only reads the records added since the previous one,
+    also when the store is reopened"""
+    store_dir = str(tmp_path / "store")
+    store = MetadataStore(store_dir)
+    assert store.update(find_metadata_logs([runs_dir])) == 6
+    assert store.update(find_metadata_logs([runs_dir])) == 0
+
+    append_metadata(get_log_dir(runs_dir, SIM_NAMES[0]), "BB", {"cores": 40})
+    store = MetadataStore(store_dir)
+    assert store.update(find_metadata_logs([runs_dir])) == 1
+
+    # The compacted metadata is the same as reading the logs
+    assert store.get_metadata() == {
+        sim_name: load_metadata_records(get_log_dir(runs_dir, sim_name))
+        for sim_name in SIM_NAMES
+    }
+    metadata = store.get_metadata()
+    assert metadata[SIM_NAMES[0]]["HF"]["status_2"] == "completed"
+    assert metadata[SIM_NAMES[0]]["IM_calc"]["run_time"] == 10.5
+    # The partitions are folded into the compacted table
+    assert sorted(os.listdir(store_dir)) == [COMPACTED_FILENAME, STATE_FILENAME]
+
+
+def test_partial_record(runs_dir, tmp_path):
+    """A partially written last line is read once it is complete"""
+    store = MetadataStore(str(tmp_path / "store"))
+    log_file = os.path.join(
+        get_log_dir(runs_dir, SIM_NAMES[0]), METADATA_RECORDS_FILENAME
+    )
+    with open(log_file, "a") as f:
+        f.write('{"sim_name": "Fault_REL01", "proc_type": "BB", ')
+    assert store.update([log_file]) == 3
+
+    with open(log_file, "a") as f:
+        f.write('"values": {"cores": 40}}\n')
+    assert store.update([log_file]) == 1
+    assert store.get_metadata()[SIM_NAMES[0]]["BB"] == {"cores": 40}
+
+
+def test_replaced_log(runs_dir, tmp_path):
+    """A log that has been replaced is read again"""
+    store = MetadataStore(str(tmp_path / "store"))
+    log_dir = get_log_dir(runs_dir, SIM_NAMES[0])
+    log_file = os.path.join(log_dir, METADATA_RECORDS_FILENAME)
+    assert store.update([log_file]) == 3
+
+    os.remove(log_file)
+    append_metadata(log_dir, "BB", {"cores": 40})
+    assert store.update([log_file]) == 1
+    assert store.get_metadata()[SIM_NAMES[0]]["BB"] == {"cores": 40}
+
+
+def test_create_dataframe(runs_dir, tmp_path):
+    store = MetadataStore(str(tmp_path / "store"))
+    store.update(find_metadata_logs([runs_dir]))
+    df = store.create_dataframe(True)
+    assert sorted(df.index) == SIM_NAMES
+    assert (df["IM_calc", "cores"] == 40).all()
+    assert df["IM_calc", "core_hours"].tolist() == pytest.approx([40 * 10.5 / 3600] * 2)
@@ -3,8 +3,14 @@ from pathlib import Path
 import shutil
 import pytest
 
-from workflow.automation.lib.MgmtDB import connect_db_ctx, SchedulerTask
+from workflow.automation.lib.MgmtDB import (
+    connect_db_ctx,
+    MgmtDB,
+    SchedulerTask,
+    STATE_INDEXES,
+)
 from workflow.automation.install_scripts import create_mgmt_db
+from workflow.automation.lib.constants import ChCountType
 from qcore import utils, constants
 from qcore.qclogging import get_basic_logger
 
@@ -66,5 +72,217 @@ def test_update_live_db(mgmt_db):
     mgmt_db.close_conn()
 
 
+def test_progress_summary(tmp_path):
+    """The progress summary maintained by update_entries_live has to match
+    the summary rebuilt from the state and job duration tables"""
+    run_name = "Fault_REL01"
+    proc_type = constants.ProcessType.HF.value
+    mgmt_db = create_mgmt_db.create_mgmt_db(
+        [], str(tmp_path / "slurm_mgmt.db"), {"Fault": 1}
+    )
+
+    # First attempt is killed by WCT, the retry completes
+    for job_id, end_status in [
+        (1, constants.Status.killed_WCT.value),
+        (2, constants.Status.completed.value),
+    ]:
+        for status, kwargs in [
+            (constants.Status.queued.value, {"queued_time": 0}),
+            (
+                constants.Status.running.value,
+                {"start_time": 0, "nodes": 1, "cores": 40},
+            ),
+            (end_status, {"end_time": 3600}),
+        ]:
+            mgmt_db.update_entries_live(
+                [SchedulerTask(run_name, proc_type, status, job_id, **kwargs)],
+                retry_max=3,
+            )
+    mgmt_db.close_conn()
+
+    summary = mgmt_db.get_progress_summary()
+    assert summary == [("Fault", proc_type, 1, 80.0)]
+
+    with connect_db_ctx(mgmt_db.db_file) as cur:
+        mgmt_db._rebuild_progress_summary(cur)
+    assert mgmt_db.get_progress_summary() == summary
+
+
+def test_progress_summary_failures(tmp_path):
+    """Failed attempts, including the failures cascaded to the dependant tasks,
+    keep the progress summary in sync with the rebuilt summary"""
+    run_name = "Fault_REL01"
+    hf, bb = constants.ProcessType.HF.value, constants.ProcessType.BB.value
+    mgmt_db = create_mgmt_db.create_mgmt_db(
+        [], str(tmp_path / "slurm_mgmt.db"), {"Fault": 1}
+    )
+
+    def run_attempt(proc_type, job_id, end_status):
+        for status, kwargs in [
+            (constants.Status.queued.value, {"queued_time": 0}),
+            (
+                constants.Status.running.value,
+                {"start_time": 0, "nodes": 1, "cores": 40},
+            ),
+            (end_status, {"end_time": 3600}),
+        ]:
+            mgmt_db.update_entries_live(
+                [SchedulerTask(run_name, proc_type, status, job_id, **kwargs)],
+                retry_max=10,
+            )
+
+        # The rebuilt summary has no rows for process types without progress
+        summary = {
+            proc_type: (n_completed, core_hours)
+            for _, proc_type, n_completed, core_hours in mgmt_db.get_progress_summary()
+            if n_completed > 0 or abs(core_hours) > 1e-9
+        }
+        with connect_db_ctx(mgmt_db.db_file) as cur:
+            mgmt_db._rebuild_progress_summary(cur)
+        rebuilt = {row[1]: row[2:] for row in mgmt_db.get_progress_summary()}
+        assert summary == pytest.approx(rebuilt)
+        return rebuilt
+
+    run_attempt(hf, 1, constants.Status.killed_WCT.value)
+    # Failing twice only removes the core hours of the attempts before the failures once
+    run_attempt(hf, 2, constants.Status.failed.value)
+    run_attempt(hf, 3, constants.Status.failed.value)
+    run_attempt(hf, 4, constants.Status.completed.value)
+    assert run_attempt(bb, 5, constants.Status.completed.value)[bb] == (1, 40.0)
+    # The completed BB task fails in cascade with the completed HF task
+    summary = run_attempt(hf, 4, constants.Status.failed.value)
+    assert hf not in summary and bb not in summary
+    mgmt_db.close_conn()
+
+
+def test_migrate(tmp_path):
+    """A db with the state table of the previous schema gets the fault_name and
+    is_median columns and the indexes"""
+    db_file = tmp_path / "slurm_mgmt.db"
+    with connect_db_ctx(db_file) as cur:
+        cur.execute(
+            "CREATE TABLE state (id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE, "
+            "run_name TEXT NOT NULL, proc_type INTEGER NOT NULL, status INTEGER, "
+            "job_id INTEGER UNIQUE, last_modified INTEGER)"
+        )
+        cur.executemany(
+            "INSERT INTO state (run_name, proc_type, status) VALUES (?, ?, 1)",
+            [("Fault", 1), ("Fault_REL01", 1), ("Fault_REL01", 4)],
+        )
+
+    mgmt_db = MgmtDB(db_file)
+    with connect_db_ctx(mgmt_db.db_file) as cur:
+        assert cur.execute(
+            "SELECT run_name, fault_name, is_median FROM state ORDER BY id"
+        ).fetchall() == [
+            ("Fault", "Fault", 1),
+            ("Fault_REL01", "Fault", 0),
+            ("Fault_REL01", "Fault", 0),
+        ]
+        indexes = [
+            row[0]
+            for row in cur.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        ]
+    assert all(index in indexes for index in STATE_INDEXES)
+
+
+def test_insert_tasks(tmp_path):
+    """Bulk inserts skip duplicates and tasks that already exist,
+    and the indexes dropped for the load are rebuilt"""
+    mgmt_db = create_mgmt_db.create_mgmt_db(
+        [], str(tmp_path / "slurm_mgmt.db"), {"Fault": 2}
+    )
+    n_rows = len(get_rows(mgmt_db.db_file, "state", "1", 1))
+    assert n_rows == 3 * INIT_DB_ROWS
+
+    tasks = [(f"New_REL{i:02d}", constants.ProcessType.HF.value) for i in range(50)]
+    assert mgmt_db.insert_tasks(tasks + tasks + [("Fault", 1)]) == len(tasks)
+
+    rows = get_rows(mgmt_db.db_file, "state", "proc_type", 4, "run_name, fault_name")
+    assert len(rows) == 3 + len(tasks)
+    assert ("New_REL01", "New") in rows
+    with connect_db_ctx(mgmt_db.db_file) as cur:
+        indexes = [
+            row[0]
+            for row in cur.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        ]
+    assert all(index in indexes for index in STATE_INDEXES)
+
+
+def test_archive(tmp_path):
+    """Archiving the retried attempts doesn't change the retry counts or core hours,
+    and only the latest attempt is left in the state table"""
+    run_name = "Fault_REL01"
+    proc_type = constants.ProcessType.HF.value
+    mgmt_db = create_mgmt_db.create_mgmt_db(
+        [], str(tmp_path / "slurm_mgmt.db"), {"Fault": 1}
+    )
+
+    # Killed by WCT twice, then completed
+    for job_id, end_status in [
+        (1, constants.Status.killed_WCT.value),
+        (2, constants.Status.killed_WCT.value),
+        (3, constants.Status.completed.value),
+    ]:
+        for status, kwargs in [
+            (constants.Status.queued.value, {"queued_time": 0}),
+            (
+                constants.Status.running.value,
+                {"start_time": 0, "nodes": 1, "cores": 40},
+            ),
+            (end_status, {"end_time": 3600}),
+        ]:
+            mgmt_db.update_entries_live(
+                [SchedulerTask(run_name, proc_type, status, job_id, **kwargs)],
+                retry_max=4,
+            )
+    mgmt_db.close_conn()
+
+    retries = [mgmt_db.get_retries(proc_type, run_name, get_WCT=b) for b in (0, 1)]
+    core_hour_jobs = mgmt_db.get_core_hour_jobs(ChCountType.Actual)
+    summary = mgmt_db.get_progress_summary()
+
+    assert mgmt_db.archive() == 2
+    assert mgmt_db.archive() == 0
+    assert get_rows(mgmt_db.db_file, "state", "proc_type", proc_type, "job_id") == [
+        (None,),
+        (3,),
+    ]
+    assert [
+        mgmt_db.get_retries(proc_type, run_name, get_WCT=b) for b in (0, 1)
+    ] == retries
+    assert mgmt_db.get_core_hour_jobs(ChCountType.Actual) == core_hour_jobs
+    with connect_db_ctx(mgmt_db.db_file) as cur:
+        mgmt_db._rebuild_progress_summary(cur)
+    assert mgmt_db.get_progress_summary() == summary
+    mgmt_db.optimise()
+
+
 def teardown_module(module):
     shutil.rmtree(os.path.dirname(TEST_DB_FILE))
+
+
+def test_array_job_ids(tmp_path):
+    """Tasks of job arrays are matched by their jobid_arrayidx job id"""
+    proc_type = constants.ProcessType.HF.value
+    mgmt_db = create_mgmt_db.create_mgmt_db(
+        [], str(tmp_path / "slurm_mgmt.db"), {"Fault": 2}
+    )
+
+    for status, kwargs in [
+        (constants.Status.queued.value, {"queued_time": 0}),
+        (constants.Status.running.value, {"start_time": 0, "cores": 40}),
+        (constants.Status.completed.value, {"end_time": 3600}),
+    ]:
+        mgmt_db.update_entries_live(
+            [
+                SchedulerTask(f"Fault_REL0{index + 1}", proc_type, status, job_id)
+                for index, job_id in enumerate(["1234_0", "1234_1"])
+            ],
+            retry_max=3,
+        )
+    mgmt_db.close_conn()
+
+    for run_name, job_id in [("Fault_REL01", "1234_0"), ("Fault_REL02", "1234_1")]:
+        assert mgmt_db.is_task_complete([proc_type, run_name])
+        assert mgmt_db.get_job_duration_info(job_id)
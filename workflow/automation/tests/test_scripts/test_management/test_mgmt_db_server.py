@@ -0,0 +1,118 @@
+"""Tests of the mgmt db server with clients in the same process, using a Unix socket"""
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from workflow.automation.install_scripts import create_mgmt_db
+from workflow.automation.lib.MgmtDB import MgmtDB, SchedulerTask
+from workflow.automation.lib.mgmt_db_server import (
+    MgmtDBClient,
+    MgmtDBServer,
+    connect_mgmt_db,
+    get_server_file,
+)
+from qcore import constants
+from qcore.qclogging import get_basic_logger
+
+N_CLIENTS = 8
+RUN_NAME = "Fault_REL01"
+
+
+@pytest.fixture
+def server(tmp_path):
+    db_file = tmp_path / "slurm_mgmt.db"
+    create_mgmt_db.create_mgmt_db([], str(db_file), {"Fault": 1})
+
+    server = MgmtDBServer(db_file, str(tmp_path / "slurm_mgmt.sock"))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+    while not get_server_file(db_file).exists():
+        time.sleep(0.01)
+
+    yield server
+
+    server.shutdown()
+    server_thread.join()
+
+
+def test_connect(server):
+    """Clients connect to the server while it runs and to the db file otherwise"""
+    client = connect_mgmt_db(server.db_file)
+    assert isinstance(client, MgmtDBClient)
+    assert [RUN_NAME] in [list(row) for row in client.get_rel_names()]
+    client.close_conn()
+
+    server.shutdown()
+    while get_server_file(server.db_file).exists():
+        time.sleep(0.01)
+    assert isinstance(connect_mgmt_db(server.db_file), MgmtDB)
+
+
+def test_concurrent_updates(server):
+    """Updates from several clients at once are all applied"""
+    proc_types = [proc_type.value for proc_type in constants.ProcessType][:N_CLIENTS]
+
+    def queue_task(job_id, proc_type):
+        client = connect_mgmt_db(server.db_file)
+        assert client.update_entries_live(
+            [
+                SchedulerTask(
+                    RUN_NAME,
+                    proc_type,
+                    constants.Status.queued.value,
+                    job_id,
+                    queued_time=0,
+                )
+            ],
+            3,
+            get_basic_logger(),
+        )
+        client.close_conn()
+
+    threads = [
+        threading.Thread(target=queue_task, args=(job_id, proc_type))
+        for job_id, proc_type in enumerate(proc_types, start=1)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    client = connect_mgmt_db(server.db_file)
+    submitted = client.get_submitted_tasks()
+    assert sorted(task.proc_type for task in submitted) == sorted(proc_types)
+    assert client.call_batch(
+        [("get_retries", (proc_type, RUN_NAME), {}) for proc_type in proc_types]
+    ) == [1] * len(proc_types)
+
+
+def test_errors(server):
+    """Exceptions are raised in the client, only MgmtDB methods can be called"""
+    client = connect_mgmt_db(server.db_file)
+    with pytest.raises(TypeError):
+        client.get_retries()
+    with pytest.raises(AttributeError):
+        client.close()
+    with pytest.raises(AttributeError):
+        client.call_batch([("__del__", (), {})])
+    assert client.get_retries(constants.ProcessType.HF.value, RUN_NAME) == 1
+
+
+def test_shutdown_signal(tmp_path):
+    """The server stops when shutdown is called by a signal handler of the thread
+    serving, and shutdown can be called again once it stopped"""
+    db_file = tmp_path / "slurm_mgmt.db"
+    create_mgmt_db.create_mgmt_db([], str(db_file), {"Fault": 1})
+    server = MgmtDBServer(db_file, str(tmp_path / "slurm_mgmt.sock"))
+
+    handler = signal.signal(signal.SIGTERM, lambda *_: server.shutdown())
+    try:
+        threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM)).start()
+        server.serve_forever()
+    finally:
+        signal.signal(signal.SIGTERM, handler)
+    assert not get_server_file(db_file).exists()
+    server.shutdown()
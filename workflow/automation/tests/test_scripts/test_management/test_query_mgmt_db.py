@@ -0,0 +1,165 @@
+"""Tests of the query_mgmt_db modes on synthetic mgmt dbs"""
+import numpy as np
+import pytest
+
+from workflow.automation.execution_scripts import query_mgmt_db
+from workflow.automation.install_scripts import create_mgmt_db
+from workflow.automation.lib.MgmtDB import (
+    ComparisonOperator,
+    SchedulerTask,
+    connect_db_ctx,
+)
+from qcore import constants
+
+N_FAULTS = 50
+N_RELS = 20
+N_ROWS = 20_000
+RUN_NAME = "Fault_REL01"
+ERRORS = ["HF error 1", "BB error 1", "BB error 2"]
+TASK_CONFIG = {
+    constants.ProcessType.EMOD3D.str_value: "ALL",
+    constants.ProcessType.HF.str_value: "REL_ONLY",
+    constants.ProcessType.BB.str_value: ["Fault1%", "Fault2%_REL01"],
+    constants.ProcessType.IM_calculation.str_value: "MEDIAN_ONLY",
+}
+
+
+@pytest.fixture(scope="module")
+def large_db(tmp_path_factory):
+    """Mgmt db with a state table of N_ROWS rows"""
+    db_file = tmp_path_factory.mktemp("query_mgmt_db") / "slurm_mgmt.db"
+    mgmt_db = create_mgmt_db.create_mgmt_db([], str(db_file))
+
+    rng = np.random.default_rng(1)
+    run_names = [
+        f"Fault{i}_REL{j:02d}" if j > 0 else f"Fault{i}"
+        for i in range(N_FAULTS)
+        for j in range(N_RELS + 1)
+    ]
+    proc_types = [proc_type.value for proc_type in constants.ProcessType]
+    rows = zip(
+        rng.choice(run_names, N_ROWS).tolist(),
+        rng.choice(proc_types, N_ROWS).tolist(),
+        rng.integers(1, 8, N_ROWS).tolist(),
+    )
+    with connect_db_ctx(mgmt_db.db_file) as cur:
+        cur.executemany(
+            "INSERT INTO state (run_name, proc_type, status) VALUES (?, ?, ?)", rows
+        )
+    return mgmt_db
+
+
+def test_pattern_counts(large_db):
+    """The aggregated counts match the per pattern, process type and status queries"""
+    with connect_db_ctx(large_db.db_file) as cur:
+        counts = query_mgmt_db.get_state_counts(cur)
+        for pattern, run_name_type in [
+            ("%_REL%", ComparisonOperator.LIKE),
+            ("%_REL%", ComparisonOperator.NOTLIKE),
+            ("Fault2%_REL01", ComparisonOperator.LIKE),
+        ]:
+            proc_counts = query_mgmt_db.sum_state_counts(counts, pattern, run_name_type)
+            proc_type = constants.ProcessType.HF.value
+            expected = [
+                cur.execute(
+                    query_mgmt_db.state_table_query_builder(
+                        "COUNT(*)",
+                        state=True,
+                        process_type=True,
+                        run_name_type=run_name_type,
+                    ),
+                    (pattern, status, proc_type),
+                ).fetchone()[0]
+                for status in query_mgmt_db.COUNT_STATUSES
+            ]
+            assert proc_counts[proc_type] == expected
+
+
+@pytest.mark.parametrize(
+    "show_counts",
+    [
+        query_mgmt_db.show_pattern_state_counts,
+        query_mgmt_db.show_detailed_config_counts,
+    ],
+)
+def test_counts(large_db, show_counts, capsys):
+    """The first line has the counts of all runs (of EMOD3D, the only task of all runs)"""
+    with connect_db_ctx(large_db.db_file) as cur:
+        show_counts(TASK_CONFIG, cur)
+        query = "SELECT COUNT(*) FROM state WHERE status <= ?"
+        params = [max(query_mgmt_db.COUNT_STATUSES)]
+        if show_counts is query_mgmt_db.show_detailed_config_counts:
+            query += " AND proc_type = ?"
+            params.append(constants.ProcessType.EMOD3D.value)
+        expected = cur.execute(query, params).fetchone()[0]
+    lines = capsys.readouterr().out.splitlines()
+    assert int(lines[0].split()[-1]) == expected
+    assert len(lines) > len(TASK_CONFIG)
+
+
+def test_old_schema(tmp_path, capsys):
+    """A db without the state_history view is queried without being modified"""
+    db_file = tmp_path / "slurm_mgmt.db"
+    create_mgmt_db.create_mgmt_db([], str(db_file), {"Fault": 1})
+    with connect_db_ctx(db_file) as cur:
+        cur.execute("DROP VIEW state_history")
+    schema = get_schema(db_file)
+
+    with connect_db_ctx(db_file) as cur:
+        query_mgmt_db.add_history_views(cur)
+        query_mgmt_db.show_state_counts(cur)
+    assert capsys.readouterr().out
+    assert get_schema(db_file) == schema
+
+
+def get_schema(db_file):
+    with connect_db_ctx(db_file) as cur:
+        return cur.execute("SELECT * FROM sqlite_master").fetchall()
+
+
+def test_archived_errors(tmp_path, capsys):
+    """The errors and attempts archived by MgmtDB.archive are still shown"""
+    mgmt_db = create_mgmt_db.create_mgmt_db(
+        [], str(tmp_path / "slurm_mgmt.db"), {"Fault": 1}
+    )
+    # HF fails and then completes, BB fails twice and reaches the retry max
+    for proc_type, job_id, end_status, error in [
+        (constants.ProcessType.HF, 1, constants.Status.failed, "HF error 1"),
+        (constants.ProcessType.HF, 2, constants.Status.completed, None),
+        (constants.ProcessType.BB, 3, constants.Status.failed, "BB error 1"),
+        (constants.ProcessType.BB, 4, constants.Status.failed, "BB error 2"),
+    ]:
+        # Each attempt is created, as auto_submit does for retries
+        for status, kwargs in [
+            (constants.Status.created, {}),
+            (constants.Status.queued, {"queued_time": 0}),
+            (constants.Status.running, {"start_time": 0, "nodes": 1, "cores": 40}),
+            (end_status, {"end_time": 3600, "error": error}),
+        ]:
+            mgmt_db.update_entries_live(
+                [
+                    SchedulerTask(
+                        RUN_NAME, proc_type.value, status.value, job_id, **kwargs
+                    )
+                ],
+                retry_max=2,
+            )
+    mgmt_db.close_conn()
+    assert mgmt_db.archive() == 2
+
+    with connect_db_ctx(mgmt_db.db_file) as cur:
+        query_mgmt_db.show_all_error_entries(cur, RUN_NAME)
+        errors = capsys.readouterr().out
+        assert all(f"Error: {error}" in errors for error in ERRORS)
+
+        query_mgmt_db.show_all_error_entries(cur, RUN_NAME, max_retries=True)
+        errors = capsys.readouterr().out
+        assert "HF error 1" not in errors
+        assert "BB error 1" in errors and "BB error 2" in errors
+
+        entries = query_mgmt_db.get_all_entries(
+            cur, RUN_NAME, query_mgmt_db.QueryModes()
+        )
+        # The other tasks have not been submitted
+        job_ids = [entry[3] for entry in entries if entry[3] is not None]
+        assert sorted(job_ids) == [1, 2, 3, 4]
@@ -0,0 +1,64 @@
+"""Unit tests for the core-hour budget admission of auto_submit"""
+import qcore.constants as const
+
+from workflow.automation.lib.admission_control import (
+    AdmissionController,
+    MachineBudget,
+)
+from workflow.automation.platform_config import HPC, get_target_machine
+
+LF = const.ProcessType.EMOD3D
+IM = const.ProcessType.IM_calculation
+
+ESTIMATES = {
+    ("Fault_REL01", LF): (10.0, 100),
+    ("Fault_REL02", LF): (10.0, 100),
+    ("Fault_REL01", IM): (0.5, 10),
+    ("Fault_REL02", IM): (0.5, 10),
+}
+
+
+def get_controller(**budget):
+    return AdmissionController({hpc: MachineBudget(**budget) for hpc in HPC}, ESTIMATES)
+
+
+def test_core_budget():
+    """Large jobs are skipped once the cores are used, smaller jobs fill the gap"""
+    controller = get_controller(max_cores=120)
+
+    assert controller.admit("Fault_REL01", LF)
+    assert not controller.admit("Fault_REL02", LF)
+    assert controller.admit("Fault_REL01", IM)
+    assert controller.admit("Fault_REL02", IM)
+    assert not controller.admit("Fault_REL03", IM.value)
+    assert controller.cores[get_target_machine(LF)] == 120
+
+
+def test_core_hour_budget():
+    """The estimated core hours in flight are limited, including submitted jobs"""
+    controller = get_controller(max_core_hours=1500)
+    controller.reset([("Fault_REL01", LF.value)])
+
+    assert controller.core_hours[get_target_machine(LF)] == 1000
+    assert not controller.admit("Fault_REL02", LF)
+    assert controller.admit("Fault_REL01", IM)
+
+
+def test_backfill():
+    """Short jobs are admitted over the budget, up to the backfill cores"""
+    controller = get_controller(
+        max_cores=100, max_core_hours=1000, backfill_window=1.0, backfill_cores=15
+    )
+
+    assert controller.admit("Fault_REL01", LF)
+    assert not controller.admit("Fault_REL02", LF)
+    assert controller.admit("Fault_REL01", IM)
+    assert not controller.admit("Fault_REL02", IM)
+
+
+def test_idle_machine():
+    """Jobs larger than the budget still run on an idle machine"""
+    controller = get_controller(max_cores=10)
+
+    assert controller.admit("Fault_REL01", LF)
+    assert not controller.admit("Fault_REL02", LF)
@@ -0,0 +1,116 @@
+"""Unit tests for the submission of tasks as job arrays"""
+import json
+import os
+
+import pytest
+import qcore.constants as const
+
+from workflow.automation.lib.job_array import JobArrayBuilder
+from workflow.automation.lib.schedulers import abstractscheduler
+from workflow.automation.lib.schedulers.scheduler_factory import Scheduler
+
+HEADER = """#!/bin/bash
+#SBATCH --job-name={job_name}
+#SBATCH --ntasks={n_tasks}
+#SBATCH --time={wct}
+
+## END HEADER
+wct={wct}
+"""
+
+
+class ArrayScheduler:
+    SCRIPT_EXTENSION = "sl"
+
+    def __init__(self):
+        self.arrays = []
+
+    def submit_array_job(self, log_dir, script_location, array_size, target_machine):
+        self.arrays.append((script_location, array_size))
+        return str(1000 + len(self.arrays))
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = ArrayScheduler()
+    monkeypatch.setattr(Scheduler, "get_scheduler", lambda: scheduler)
+    return scheduler
+
+
+def write_script(sim_dir, run_name, n_tasks, wct="00:30:00"):
+    os.makedirs(sim_dir, exist_ok=True)
+    script = os.path.join(sim_dir, f"run_hf_mpi_{run_name}.sl")
+    with open(script, "w") as f:
+        f.write(HEADER.format(job_name=f"hf.{run_name}", n_tasks=n_tasks, wct=wct))
+    return script
+
+
+@pytest.mark.parametrize(
+    ["job_id", "expected"],
+    [("1234", 1234), ("1234_5", "1234_5"), ("1234_p5", "1234_p5"), (77, 77)],
+)
+def test_parse_job_id(job_id, expected):
+    assert abstractscheduler.parse_job_id(job_id) == expected
+
+
+def test_job_array_builder(tmp_path, scheduler):
+    """Tasks with the same resource shape share an array, the array tasks are queued
+    with their jobid_arrayidx job ids"""
+    root_folder = str(tmp_path)
+    os.makedirs(os.path.join(root_folder, "mgmt_db_queue"))
+    builder = JobArrayBuilder(root_folder, max_array_size=2)
+    for rel, n_tasks in [(1, 80), (2, 80), (3, 80), (4, 40)]:
+        run_name = f"Fault_REL0{rel}"
+        sim_dir = str(tmp_path / "Runs" / "Fault" / run_name)
+        builder.add(
+            const.ProcessType.HF.value,
+            run_name,
+            sim_dir,
+            write_script(sim_dir, run_name, n_tasks),
+        )
+    assert len(builder) == 4
+
+    assert builder.submit() == ["1001", "1002", "1003"]
+    assert len(builder) == 0
+    assert [array_size for _, array_size in scheduler.arrays] == [2, 1, 1]
+
+    with open(scheduler.arrays[0][0]) as f:
+        array_script = f.read()
+    assert "#SBATCH --ntasks=80" in array_script
+    assert f"--job-name={const.ProcessType.HF.str_value}_array" in array_script
+    assert "Fault_REL02" in array_script and "Fault_REL03" not in array_script
+
+    job_ids = {}
+    queue_folder = os.path.join(root_folder, "mgmt_db_queue")
+    for file_name in os.listdir(queue_folder):
+        with open(os.path.join(queue_folder, file_name)) as f:
+            job_ids[file_name.split(".")[1]] = json.load(f)["job_id"]
+    assert job_ids == {
+        "Fault_REL01": "1001_0",
+        "Fault_REL02": "1001_1",
+        "Fault_REL03": "1002_0",
+        "Fault_REL04": "1003_0",
+    }
+
+
+def test_job_array_wct(tmp_path, scheduler):
+    """Tasks that only differ in their WCT share an array, with the longest WCT"""
+    root_folder = str(tmp_path)
+    os.makedirs(os.path.join(root_folder, "mgmt_db_queue"))
+    builder = JobArrayBuilder(root_folder)
+    for rel, wct in [(1, "00:30:00"), (2, "02:15:00"), (3, "01:00:00")]:
+        run_name = f"Fault_REL0{rel}"
+        sim_dir = str(tmp_path / "Runs" / "Fault" / run_name)
+        builder.add(
+            const.ProcessType.HF.value,
+            run_name,
+            sim_dir,
+            write_script(sim_dir, run_name, 80, wct),
+        )
+
+    assert builder.submit() == ["1001"]
+    assert [array_size for _, array_size in scheduler.arrays] == [3]
+    with open(scheduler.arrays[0][0]) as f:
+        array_script = f.read()
+    assert "#SBATCH --time=02:15:00" in array_script
+    assert "#SBATCH --time=00:30:00" not in array_script
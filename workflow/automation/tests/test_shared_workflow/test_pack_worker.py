@@ -0,0 +1,185 @@
+"""Unit tests for running many small tasks within one allocation"""
+import json
+import os
+import sys
+import time
+
+import pytest
+import qcore.constants as const
+import qcore.simulation_structure as sim_struct
+
+from workflow.automation.execution_scripts import add_to_mgmt_queue
+from workflow.automation.execution_scripts.queue_monitor import get_queue_entry
+from workflow.automation.install_scripts import create_mgmt_db
+from workflow.automation.lib import pack_worker
+from workflow.automation.lib.MgmtDB import connect_db_ctx, MgmtDB
+from workflow.automation.lib.schedulers import abstractscheduler
+
+HEADER = [
+    "#!/bin/bash",
+    "#SBATCH --job-name=im_calc.REL01",
+    "#SBATCH --ntasks=4",
+    "#SBATCH --cpus-per-task=2",
+    "#SBATCH --time=01:30:00",
+    "",
+    "## END HEADER",
+]
+
+
+@pytest.mark.parametrize(
+    "memory, expected", [("16G", 16), ("2048", 2), ("512M", 0.5), ("1T", 1024)]
+)
+def test_parse_memory(memory, expected):
+    assert pack_worker.parse_memory(memory) == pytest.approx(expected)
+
+
+def test_parse_memory_invalid():
+    with pytest.raises(ValueError):
+        pack_worker.parse_memory("lots")
+
+
+def test_get_task_resources():
+    resources = pack_worker.get_task_resources(HEADER, default_memory=3)
+    assert resources.n_tasks == 4
+    assert resources.cpus_per_task == 2
+    assert resources.n_cores == 8
+    assert resources.memory == 3
+    assert resources.wct == pytest.approx(1.5)
+
+    resources = pack_worker.get_task_resources(HEADER + ["#SBATCH --mem-per-cpu=1G"])
+    assert resources.memory == pytest.approx(8)
+    resources = pack_worker.get_task_resources(HEADER + ["#SBATCH --mem=10G"])
+    assert resources.memory == pytest.approx(10)
+
+
+def test_claim_task(tmp_path):
+    claims_dir = str(tmp_path)
+    expiry = time.time() + 3600
+
+    assert pack_worker.claim_task(claims_dir, "REL01", 6, expiry)
+    # Held by the first claim
+    assert not pack_worker.claim_task(claims_dir, "REL01", 6, expiry)
+    # Other tasks of the realisation are claimed separately
+    assert pack_worker.claim_task(claims_dir, "REL01", 5, expiry)
+
+    pack_worker.release_task(claims_dir, "REL01", 6)
+    assert pack_worker.claim_task(claims_dir, "REL01", 6, expiry)
+
+
+def test_claim_expired_task(tmp_path):
+    claims_dir = str(tmp_path)
+    assert pack_worker.claim_task(claims_dir, "REL01", 6, time.time() - 1)
+
+    expiry = time.time() + 3600
+    assert pack_worker.claim_task(claims_dir, "REL01", 6, expiry)
+    with open(os.path.join(claims_dir, "REL01.6")) as f:
+        assert json.load(f)["expiry"] == expiry
+    assert os.listdir(claims_dir) == ["REL01.6"]
+
+
+@pytest.mark.parametrize(
+    ["job_id", "scheduler_job_id"], [("1234_p5", 1234), ("1234_5", "1234_5"), (77, 77)]
+)
+def test_get_scheduler_job_id(job_id, scheduler_job_id):
+    assert abstractscheduler.get_scheduler_job_id(job_id) == scheduler_job_id
+    assert abstractscheduler.is_pack_task_job_id(job_id) == (job_id == "1234_p5")
+
+
+@pytest.fixture
+def pack_root(tmp_path, monkeypatch):
+    """A simulation root with a mgmt db of three rrup tasks, their scripts post the
+    running and completed updates with the job id given by the worker, as the
+    templates do"""
+    root_folder = str(tmp_path)
+    create_mgmt_db.create_mgmt_db([], sim_struct.get_mgmt_db(root_folder), {"Fault": 2})
+    queue_folder = sim_struct.get_mgmt_db_queue(root_folder)
+    os.makedirs(queue_folder)
+
+    def create_task_command(proc_type, run_name, *args):
+        sim_dir = sim_struct.get_sim_dir(root_folder, run_name)
+        os.makedirs(sim_dir, exist_ok=True)
+        post = (
+            f"{sys.executable} {add_to_mgmt_queue.__file__} {queue_folder} "
+            f"{run_name} {proc_type.str_value}"
+        )
+        script = os.path.join(sim_dir, "task.sl")
+        with open(script, "w") as f:
+            f.write(
+                "\n".join(
+                    HEADER[:2]
+                    + ["#SBATCH --ntasks=1", "#SBATCH --time=00:10:00", HEADER[-1]]
+                    + [
+                        f"{post} running $MGMT_DB_JOB_ID "
+                        "--start_time 2024-01-01_00:00:00 --nodes 1 --cores 2",
+                        f"{post} completed $MGMT_DB_JOB_ID "
+                        "--end_time 2024-01-01_01:00:00",
+                    ]
+                )
+            )
+        return ["bash", script]
+
+    monkeypatch.setattr(pack_worker, "create_task_command", create_task_command)
+    return root_folder
+
+
+RUN_NAMES = ["Fault", "Fault_REL01", "Fault_REL02"]
+
+
+def test_pack_worker_mgmt_db(pack_root):
+    """Every task run by a worker gets its own job id, so the updates of all of them
+    are applied to the mgmt db"""
+    worker = pack_worker.PackWorker(
+        pack_root, const.ProcessType.rrup, 4, 8, 777, 3600, poll_interval=0
+    )
+    worker.start_tasks()
+    assert sorted(worker.running) == RUN_NAMES
+    while worker.running:
+        worker.reap()
+        time.sleep(0.1)
+    assert worker.n_completed == len(RUN_NAMES)
+
+    queue_folder = sim_struct.get_mgmt_db_queue(pack_root)
+    entries = [
+        get_queue_entry(os.path.join(queue_folder, entry_file))
+        for entry_file in sorted(os.listdir(queue_folder))
+    ]
+    assert len(entries) == 3 * len(RUN_NAMES)
+    mgmt_db = MgmtDB(sim_struct.get_mgmt_db(pack_root))
+    assert mgmt_db.update_entries_live(entries, retry_max=2)
+    mgmt_db.close_conn()
+
+    job_ids = {"777_p0", "777_p1", "777_p2"}
+    with connect_db_ctx(mgmt_db.db_file) as cur:
+        states = cur.execute(
+            "SELECT run_name, status, job_id FROM state WHERE proc_type = ?",
+            (const.ProcessType.rrup.value,),
+        ).fetchall()
+        durations = cur.execute(
+            "SELECT job_id, start_time, end_time, cores FROM job_duration_log"
+        ).fetchall()
+    assert sorted(run_name for run_name, _, _ in states) == RUN_NAMES
+    assert {status for _, status, _ in states} == {const.Status.completed.value}
+    assert {job_id for _, _, job_id in states} == job_ids
+    assert {job_id for job_id, *_ in durations} == job_ids
+    assert all(end - start == 3600 and cores == 2 for _, start, end, cores in durations)
+    assert mgmt_db.get_progress_summary() == [
+        ("Fault", const.ProcessType.rrup.value, 3, 6.0)
+    ]
+
+
+def test_pack_worker_unpackable(pack_root):
+    """Tasks longer than the allocation of a worker (10 minutes in 5) are left
+    to auto_submit"""
+    worker = pack_worker.PackWorker(
+        pack_root, const.ProcessType.rrup, 4, 8, 777, 5 * 60, poll_interval=0
+    )
+    worker.start_tasks()
+    assert worker.running == {}
+    assert os.listdir(worker.claims_dir) == []
+    for run_name in RUN_NAMES:
+        assert pack_worker.is_unpackable(
+            pack_root, run_name, const.ProcessType.rrup.value
+        )
+    assert not pack_worker.is_unpackable(
+        pack_root, "Fault", const.ProcessType.clean_up.value
+    )
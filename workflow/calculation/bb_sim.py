@@ -4,6 +4,8 @@ Combines low frequency and high frequency seismograms.
 """
 
 from argparse import ArgumentParser
+from collections import deque
+import heapq
 import os
 import logging
 import numpy as np
@@ -18,6 +20,7 @@ from qcore.siteamp_models import (
 )
 from qcore import timeseries, utils
 from qcore.constants import VM_PARAMS_FILE_NAME, Components, PLATFORM_CONFIG
+from workflow.calculation import station_stats
 from workflow.calculation.site_response_BB import site_response
 from workflow.automation import platform_config
 
@@ -33,6 +36,42 @@ HEAD_SIZE = timeseries.BBSeis.HEAD_SIZE
 HEAD_STAT = timeseries.BBSeis.HEAD_STAT
 FLOAT_SIZE = 0x4
 N_COMP = 3
+# Rough run time (s) per time step of the vs30 based amplification of a station
+VS30_SECONDS_PER_STEP = 1e-6
+SITE_RESPONSE_TIMINGS_FILE = "site_response_timings.json"
+
+
+def get_station_costs(station_names, site_response_dir, nt, timings=None):
+    """
+    Estimates the run time (s) of each station.
+    Stations with a site response file run OpenSees, see site_response.estimate_run_time
+    """
+    costs = np.full(len(station_names), VS30_SECONDS_PER_STEP * nt)
+    if site_response_dir:
+        for j, name in enumerate(station_names):
+            station_yaml = os.path.join(str(site_response_dir), f"{name}.yaml")
+            if os.path.isfile(station_yaml):
+                costs[j] = site_response.estimate_run_time(
+                    site_response.SiteProp.from_file(station_yaml), nt, timings
+                )
+    return costs
+
+
+def distribute_stations(costs, n_ranks):
+    """
+    Assigns the stations to the ranks, the most expensive first, each to the rank with
+    the lowest total cost so far. The expensive stations are spread over the ranks
+    and the cheap stations fill the remaining time.
+    Equal costs result in the round robin split
+    :return: The rank of each station
+    """
+    station_rank = np.empty(len(costs), dtype=int)
+    loads = [(0.0, rank) for rank in range(n_ranks)]
+    for j in np.argsort(-np.asarray(costs), kind="stable"):
+        load, rank = heapq.heappop(loads)
+        station_rank[j] = rank
+        heapq.heappush(loads, (load + costs[j], rank))
+    return station_rank
 
 
 def args_parser(cmd=None):
@@ -73,6 +112,20 @@ def args_parser(cmd=None):
         ],
         nargs="?",
     )
+    arg(
+        "--site_response_n_procs",
+        help="Number of concurrent OpenSees processes per rank. "
+        "vs30 based stations are processed while OpenSees runs",
+        type=int,
+        default=1,
+    )
+    arg(
+        "--site_response_timings",
+        help="JSON file with the past OpenSees run times of the stations, used to "
+        "balance the stations over the ranks and updated with this run. "
+        f"Defaults to {SITE_RESPONSE_TIMINGS_FILE} next to the output file",
+        default=None,
+    )
     arg(
         "--site-amp-uncertainty",
         help="Use site amplification uncertainty. Optionally provide a seed to give reproducible behaviour. Maximum seed value is 2^64-1",
@@ -389,32 +442,130 @@ def main():
                 )
                 initialise()
                 station_mask = np.ones(lf.stations.size, dtype=bool)
+        # per station checksums and statistics, completed stations missing them
+        # (e.g. from a previous version) are filled in from the binary
+        stats_path = station_stats.get_stats_path(args.out_file)
+        if (
+            station_mask.all()
+            or station_stats.load(stats_path, lf.stations.size) is None
+        ):
+            station_stats.initialise(stats_path, lf.stations.size)
+        missing_stats = np.flatnonzero(
+            ~station_mask
+            & (station_stats.load(stats_path, lf.stations.size)["done"] == 0)
+        )
+        if missing_stats.size > 0:
+            logger.info(
+                f"Computing the station statistics of {missing_stats.size} completed stations."
+            )
+            station_stats.update(
+                args.out_file, stats_path, head_total, bb_nt, missing_stats
+            )
     station_mask = comm.bcast(station_mask, root=master)
-    stations_todo = hf.stations[station_mask][rank::size]
-    stations_todo_idx = np.arange(hf.stations.size)[station_mask][rank::size]
+
+    # Balances the expensive site response stations over the ranks
+    if args.site_response_timings is None:
+        args.site_response_timings = os.path.join(
+            os.path.dirname(args.out_file), SITE_RESPONSE_TIMINGS_FILE
+        )
+    station_costs = None
+    if is_master:
+        station_costs = get_station_costs(
+            hf.stations.name[station_mask],
+            args.site_response_dir,
+            bb_nt,
+            site_response.load_timings(args.site_response_timings),
+        )
+    station_costs = comm.bcast(station_costs, root=master)
+    station_rank = distribute_stations(station_costs, size)
+    stations_todo = hf.stations[station_mask][station_rank == rank]
+    stations_todo_idx = np.arange(hf.stations.size)[station_mask][station_rank == rank]
+    stations_todo_costs = station_costs[station_rank == rank]
 
     # load container to write to
     bin_data = open(args.out_file, "r+b")
     bin_seek = head_total + stations_todo_idx * bb_nt * N_COMP * FLOAT_SIZE
     bin_seek_vsite = HEAD_SIZE + stations_todo_idx * HEAD_STAT + 40
+    stats_data = open(station_stats.get_stats_path(args.out_file), "r+b")
 
     # work on station subset
     fmin = args.fmin
     fmidbot = args.fmidbot
     t0 = MPI.Wtime()
     bb_acc = np.empty((bb_nt, N_COMP), dtype="f4")
-    for i, stat in enumerate(stations_todo):
+
+    def write_station(i, station_acc):
+        bin_data.seek(bin_seek[i])
+        station_acc.tofile(bin_data)
+        station_stats.write_station(stats_data, stations_todo_idx[i], station_acc)
+        # write vsite as used for checkpointing
+        bin_data.seek(bin_seek_vsite[i])
+        vs30s[stations_todo_idx[i]].tofile(bin_data)
+
+    # OpenSees runs in the background, the site response stations are written
+    # once all of their components are collected
+    site_response_pool = None
+    if args.site_response_dir:
+        site_response_pool = site_response.SiteResponsePool(
+            args.site_response_n_procs, logger=logger
+        )
+        # Every rank has its own curve cache, the ranks of a node share its budget
+        node_size = comm.Split_type(MPI.COMM_TYPE_SHARED).Get_size()
+        site_response.curve_cache.resize(
+            min(
+                site_response.DEFAULT_CURVE_CACHE_BYTES,
+                site_response.NODE_CURVE_CACHE_BYTES // node_size,
+            )
+        )
+    # station index -> [accelerations, number of components left]
+    site_response_acc = {}
+
+    def collect_site_response(wait=False):
+        for (i, c), acc in site_response_pool.collect(wait=wait):
+            site_response_acc[i][0][:, c] = acc / 9.81
+            site_response_acc[i][1] -= 1
+            if site_response_acc[i][1] == 0:
+                write_station(i, site_response_acc.pop(i)[0])
+
+    def station_order():
+        """
+        The site response stations (the most expensive first) are submitted whenever
+        the pool has room for them, the vs30 based stations fill the time OpenSees runs
+        """
+        site_response_stations, vs30_stations = deque(), deque()
+        for i in np.argsort(-stations_todo_costs, kind="stable"):
+            station_yaml = os.path.join(
+                str(args.site_response_dir), f"{stations_todo[i].name}.yaml"
+            )
+            if args.site_response_dir and os.path.isfile(station_yaml):
+                site_response_stations.append((i, station_yaml))
+            else:
+                vs30_stations.append((i, None))
+        while site_response_stations or vs30_stations:
+            if site_response_stations and (
+                not vs30_stations
+                or len(site_response_pool) < N_COMPONENTS * site_response_pool.n_procs
+            ):
+                yield site_response_stations.popleft()
+            else:
+                yield vs30_stations.popleft()
+
+    for n_done, (i, station_yaml) in enumerate(station_order()):
+        stat = stations_todo[i]
         logger.debug(
-            f"Working on {stat.name}, {100*i/len(stations_todo):.2f}% complete"
+            f"Working on {stat.name}, {100*n_done/len(stations_todo):.2f}% complete"
         )
         lf_acc = np.copy(lf.acc(stat.name, dt=bb_dt))
         hf_acc = np.copy(hf.acc(stat.name, dt=bb_dt))
-        station_yaml = os.path.join(str(args.site_response_dir), f"{stat.name}.yaml")
-        if args.site_response_dir and os.path.isfile(station_yaml):
+        if station_yaml is not None:
             logger.debug(
                 f"Station {stat.name} has a site specific file. Running OpenSees"
             )
             site_properties = site_response.SiteProp.from_file(station_yaml)
+            # Limits the number of queued runs (and their input files)
+            while len(site_response_pool) >= N_COMPONENTS * site_response_pool.n_procs:
+                collect_site_response(wait=True)
+            site_response_acc[i] = [np.empty((bb_nt, N_COMP), dtype="f4"), N_COMPONENTS]
             for c in range(N_COMPONENTS):
                 hf_filtered = bwfilter(
                     hf_acc[:, c],
@@ -430,15 +581,12 @@ def main():
                 )
                 hf_c = np.hstack((hf_start_padding_ts, hf_filtered, hf_end_padding_ts))
                 lf_c = np.hstack((lf_start_padding_ts, lf_filtered, lf_end_padding_ts))
-                bb_acc[:, c] = (
-                    site_response.deconvolve_timeseries_and_run_site_response(
-                        hf_c + lf_c,
-                        Components(c),
-                        site_properties,
-                        dt=bb_dt,
-                        logger=logger,
-                    )
-                    / 9.81
+                site_response_pool.submit(
+                    (i, c),
+                    hf_c + lf_c,
+                    Components(c),
+                    site_properties,
+                    dt=bb_dt,
                 )
 
         else:
@@ -518,13 +666,32 @@ def main():
                         )
                         comm.Abort()
                 bb_acc[:, c] = (hf_c + lf_c) / 981.0
+            write_station(i, bb_acc)
 
-        bin_data.seek(bin_seek[i])
-        bb_acc.tofile(bin_data)
-        # write vsite as used for checkpointing
-        bin_data.seek(bin_seek_vsite[i])
-        vs30s[stations_todo_idx[i]].tofile(bin_data)
+        if site_response_pool is not None:
+            collect_site_response()
+
+    if site_response_pool is not None:
+        while len(site_response_pool) > 0:
+            collect_site_response(wait=True)
+        site_response_pool.close()
+        logger.debug(
+            f"Site response curve cache: {site_response.curve_cache.cache_info()}, "
+            f"hit rate {site_response.curve_cache.hit_rate:.2f}"
+        )
     bin_data.close()
+    stats_data.close()
+
+    # Records the OpenSees run times for balancing later runs
+    timings = comm.gather(
+        {} if site_response_pool is None else dict(site_response_pool.timings),
+        root=master,
+    )
+    if is_master and any(timings):
+        all_timings = site_response.load_timings(args.site_response_timings)
+        for rank_timings in timings:
+            all_timings.update(rank_timings)
+        site_response.save_timings(args.site_response_timings, all_timings)
 
     print("Process %03d of %03d finished (%.2fs)." % (rank, size, MPI.Wtime() - t0))
     logger.debug(
@@ -12,6 +12,7 @@ import numpy as np
 import logging
 
 from qcore import binary_version, constants, utils
+from workflow.calculation import station_stats
 from workflow.automation.platform_config import platform_config
 
 if __name__ == "__main__":
@@ -408,6 +409,21 @@ if __name__ == "__main__":
                 )
                 initialise()
                 station_mask = np.ones(stations.size, dtype=bool)
+        # per station checksums and statistics, completed stations missing them
+        # (e.g. from a previous version) are filled in from the binary
+        stats_path = station_stats.get_stats_path(args.out_file)
+        if station_mask.all() or station_stats.load(stats_path, stations.size) is None:
+            station_stats.initialise(stats_path, stations.size)
+        missing_stats = np.flatnonzero(
+            ~station_mask & (station_stats.load(stats_path, stations.size)["done"] == 0)
+        )
+        if missing_stats.size > 0:
+            logger.info(
+                f"Computing the station statistics of {missing_stats.size} completed stations."
+            )
+            station_stats.update(
+                args.out_file, stats_path, head_total, nt, missing_stats
+            )
     station_mask = comm.bcast(station_mask, root=master)
     stations_todo = stations[station_mask]
     stations_todo_idx = np.arange(stations.size)[station_mask]
@@ -506,6 +522,15 @@ if __name__ == "__main__":
                 e.write(stderr)
             comm.Abort(1)
 
+        # checksums and statistics of the stations written by HF, before the checkpoint
+        with open(args.out_file, "rb") as out:
+            for i in range(idx_0, idx_0 + n_stat):
+                station_stats.write_station(
+                    stats_data,
+                    i,
+                    station_stats.read_station_acc(out, head_total, nt, i),
+                )
+
         # write e_dist and vs to file
         with open(args.out_file, "r+b") as out:
             out.seek(HEAD_SIZE + idx_0 * HEAD_STAT)
@@ -523,6 +548,7 @@ if __name__ == "__main__":
     # process data to give Fortran code
     t0 = MPI.Wtime()
     in_stats = mkstemp()[1]
+    stats_data = open(station_stats.get_stats_path(args.out_file), "r+b")
 
     v1d_path = args.hf_vel_mod_1d
     for s in range(work.size):
@@ -539,6 +565,7 @@ if __name__ == "__main__":
         )  # passing in_stat with the seed adjustment work_idx[s]
 
     os.remove(in_stats)
+    stats_data.close()
     logger.debug(
         "Process {} of {} completed {} stations ({:.2f}).".format(
             rank, size, work.size, MPI.Wtime() - t0
@@ -1,6 +1,6 @@
-if { $argc != 3 } {
+if { $argc != 3 && $argc != 4 } {
     puts "The add.tcl script requires arguments."
-    puts "For example, OpenSees run_site_amp.tcl ground_motion_path site_parameter_path output_directory"
+    puts "For example, OpenSees run_site_amp.tcl ground_motion_path site_parameter_path output_directory \[binary\]"
     puts "Please try again."
     exit
 } else {
@@ -13,6 +13,10 @@ if { $argc != 3 } {
     set output_dir [lindex $argv 2]
     puts "output_dir = output_dir"
 
+    # With binary, the ground motion is read as little endian doubles and the
+    # output is recorded in binary format
+    set binaryIO [expr {$argc == 4 && [lindex $argv 3] eq "binary"}]
+    puts "binaryIO = $binaryIO"
 }
 
 # Load all the site specific parameters
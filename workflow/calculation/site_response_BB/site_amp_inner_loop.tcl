@@ -559,7 +559,11 @@ set recDT  [expr 10*$motionDT]
 
 # # record nodal displacment, acceleration, and porepressure
 # record horizontal acceleration at the top node
-eval "recorder Node -file $output_dir/out.txt -dT $dT -node $nNodeT -dof 1 accel"
+if {$binaryIO} {
+    eval "recorder Node -binary $output_dir/out.bin -dT $dT -node $nNodeT -dof 1 accel"
+} else {
+    eval "recorder Node -file $output_dir/out.txt -dT $dT -node $nNodeT -dof 1 accel"
+}
 puts "Finished creating all recorders..."
 
 #-----------------------------------------------------------------------------------------
@@ -576,7 +580,15 @@ set velocityFile $gMotion
 
 
 # timeseries object for force history
-set mSeries "Path -dt $motionDT -filePath $velocityFile -factor $cFactor"
+if {$binaryIO} {
+    set velocityChannel [open $velocityFile r]
+    fconfigure $velocityChannel -translation binary
+    binary scan [read $velocityChannel] q* velocityValues
+    close $velocityChannel
+    set mSeries "Path -dt $motionDT -values {$velocityValues} -factor $cFactor"
+} else {
+    set mSeries "Path -dt $motionDT -filePath $velocityFile -factor $cFactor"
+}
 
 # loading object
 pattern Plain 10 $mSeries {
@@ -1,8 +1,14 @@
 import argparse
+import collections
+import contextlib
+import json
+import os
+import shutil
 import subprocess
 import dataclasses
 import pathlib
 import tempfile
+import time
 import typing
 
 import numpy as np
@@ -17,6 +23,9 @@ BASE_COMPONENTS = [
     constants.Components.cver,
 ]
 CM_TO_M_MULTIPLIER = 1.0 / 100
+N_COMPONENTS = 3
+G_TO_CM_MULTIPLIER = 980.665
+M_TO_G_DIVISOR = 9.81
 
 vs_ref = 500.0  # reference Vs at the ground surface in the HF GM simulation (m/s)
 vp_ref = 1800.0  # reference Vp at the ground surface in the HF GM simulation (m/s)
@@ -32,6 +41,35 @@ dampP_soil = 1.0 / (2.0 * Qp)  # damping ratio - compression (dimensionless)
 
 SITE_AMP_SCRIPT = pathlib.Path(__file__).parent / "run_site_amp.tcl"
 
+# Node local, memory backed directory used for the OpenSees inputs and outputs
+SHM_DIR = pathlib.Path("/dev/shm")
+OUT_FILE = "out.txt"
+BINARY_OUT_FILE = "out.bin"
+# dtype of the binary ground motion, as read by run_site_amp.tcl
+BINARY_DTYPE = "<f8"
+
+# Highest resolved frequency (Hz) and elements per wavelength of the soil column mesh,
+# as in site_amp_inner_loop.tcl
+MESH_F_MAX = 25.0
+MESH_ELEMENTS_PER_WAVELENGTH = 8
+# Rough OpenSees run time (s) per mesh element and time step of a component.
+# Only used for stations without past timings
+SECONDS_PER_ELEMENT_STEP = 5e-5
+
+# Memory bound of the cached transfer functions and amplification spectra of a process.
+# Processes sharing a node (e.g. the bb_sim ranks) split NODE_CURVE_CACHE_BYTES
+DEFAULT_CURVE_CACHE_BYTES = 64 * 1024**2
+NODE_CURVE_CACHE_BYTES = 256 * 1024**2
+# Float inputs of the cached curves are rounded to this many significant digits
+QUANTISE_SIGNIFICANT_DIGITS = 4
+
+# Output of the batch driver, in the BB.bin layout
+BATCH_OUTPUT_FILE = "BB_site_response.bin"
+# Offset of the vsite in the station header, set once a station is written
+VSITE_OFFSET = 40
+# Stations between the progress reports of the batch driver
+PROGRESS_INTERVAL = 20
+
 
 @dataclasses.dataclass
 class SiteProp:
@@ -97,6 +135,14 @@ class SiteProp:
     def vs_base(self):
         return self.Vs[0]
 
+    @property
+    def n_elements(self):
+        """The number of vertical elements of the soil column mesh"""
+        return sum(
+            int(np.floor(thick / (vs / MESH_F_MAX / MESH_ELEMENTS_PER_WAVELENGTH)) + 1)
+            for thick, vs in zip(self.layerThick, self.Vs)
+        )
+
     def __post_init__(self):
         assert len(self.rho) == self.numLayers + 1, f"{self.rho}, {self.numLayers + 1}"
         assert len(self.Vs) == self.numLayers + 1, f"{self.Vs}, {self.numLayers + 1}"
@@ -178,6 +224,163 @@ class TimeOutError(Exception):
     pass
 
 
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "n_curves", "nbytes", "max_bytes"]
+)
+
+
+class CurveCache:
+    """
+    LRU cache of the transfer functions and amplification spectra.
+    Curves are keyed by the function computing them and its quantised inputs, i.e. float
+    inputs rounded to significant_digits, and computed from the quantised inputs.
+    The least recently used curves are dropped once the cached arrays exceed max_bytes
+    """
+
+    def __init__(
+        self,
+        max_bytes=DEFAULT_CURVE_CACHE_BYTES,
+        significant_digits=QUANTISE_SIGNIFICANT_DIGITS,
+    ):
+        self.max_bytes = max_bytes
+        self.significant_digits = significant_digits
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._curves = collections.OrderedDict()
+
+    def quantise(self, value):
+        if isinstance(value, (float, np.floating)):
+            return float(f"{value:.{self.significant_digits}g}")
+        return value
+
+    def get(self, function, *args):
+        """
+        Gets the curve function(*args) from the cache, computing it on a miss.
+        The returned array is read only
+        """
+        args = tuple(self.quantise(arg) for arg in args)
+        key = (function, *args)
+        curve = self._curves.get(key)
+        if curve is not None:
+            self.hits += 1
+            self._curves.move_to_end(key)
+            return curve
+
+        self.misses += 1
+        curve = np.asarray(function(*args))
+        curve.flags.writeable = False
+        if curve.nbytes <= self.max_bytes:
+            self._curves[key] = curve
+            self.nbytes += curve.nbytes
+            self._evict()
+        return curve
+
+    def resize(self, max_bytes):
+        """Changes the memory bound, dropping the least recently used curves above it"""
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            _, dropped = self._curves.popitem(last=False)
+            self.nbytes -= dropped.nbytes
+
+    @property
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def cache_info(self):
+        return CacheInfo(
+            self.hits, self.misses, len(self._curves), self.nbytes, self.max_bytes
+        )
+
+    def clear(self):
+        self._curves.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+# Shared by run_deamp and the deconvolution of all stations of a process
+curve_cache = CurveCache()
+
+
+def get_io_dir():
+    """
+    Gets the directory for the temporary OpenSees files.
+    /dev/shm if available, otherwise None for the default temporary directory
+    """
+    if SHM_DIR.is_dir() and os.access(SHM_DIR, os.W_OK):
+        return SHM_DIR
+    return None
+
+
+@contextlib.contextmanager
+def site_params_file(site_properties: SiteProp, nt: int, io_dir=None):
+    """
+    Writes the tcl site parameters of a station to a temporary directory,
+    so they can be shared by the site response runs of its components
+    :param site_properties: A SiteProp object for the location
+    :param nt: The number of time steps of the waveforms
+    :param io_dir: The directory to create the temporary directory in, defaults to get_io_dir()
+    :return: The path to the params file, removed on exit
+    """
+    with tempfile.TemporaryDirectory(
+        dir=get_io_dir() if io_dir is None else io_dir
+    ) as td:
+        params_path = pathlib.Path(td) / "params.tcl"
+        site_properties.to_tcl(params_path, nt=nt)
+        yield params_path
+
+
+def estimate_run_time(site_properties: SiteProp, nt: int, timings=None):
+    """
+    Estimates the OpenSees run time (s) of all components of a station
+    :param site_properties: A SiteProp object for the location
+    :param nt: The number of time steps of the waveforms
+    :param timings: Past run times per time step of the stations, see SiteResponsePool.timings.
+        Stations without a past run time are estimated from the size of their mesh
+    """
+    if timings and site_properties.name in timings:
+        return timings[site_properties.name] * nt
+    return (
+        len(BASE_COMPONENTS)
+        * SECONDS_PER_ELEMENT_STEP
+        * site_properties.n_elements
+        * nt
+    )
+
+
+def load_timings(file_path):
+    """Loads the past run times per time step of the stations, if the file exists"""
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_timings(file_path, timings):
+    with open(file_path, "w") as f:
+        json.dump(timings, f, indent=2, sort_keys=True)
+
+
+def read_binary_output(file_path):
+    """
+    Reads the output of a binary OpenSees recorder with a single column.
+    OpenSees terminates each record with a newline, which is skipped if present
+    """
+    data = np.fromfile(file_path, dtype=np.uint8)
+    record_dtype = np.dtype([("value", "f8"), ("end", "u1")])
+    if data.size % record_dtype.itemsize == 0 and np.all(
+        data[record_dtype.itemsize - 1 :: record_dtype.itemsize] == ord("\n")
+    ):
+        return data.view(record_dtype)["value"].copy()
+    return data.view("f8").copy()
+
+
 def cumulative_trapezoid(y, dx=1.0, initial=0):
     """
     Cumulatively integrate y(x) using the composite trapezoidal rule.
@@ -242,29 +445,30 @@ def run_deamp(waveform, component: constants.Components, dt, vs_site, hf_pga):
     # "remove" it from the BBGM simulation
     # TODO: have multiple deamp functions
     if component in [constants.Components.c000, constants.Components.c090]:
-        ampf = siteamp_models.cb_amp(dt, ft_len, vs_ref, vs_site, vs_pga, hf_pga)
+        ampf = curve_cache.get(
+            siteamp_models.cb_amp, dt, ft_len, vs_ref, vs_site, vs_pga, hf_pga
+        )
     else:  # TODO we should have different site amp for hor and ver components
-        ampf = siteamp_models.cb_amp(dt, ft_len, vs_ref, vs_site, vs_pga, hf_pga)
+        ampf = curve_cache.get(
+            siteamp_models.cb_amp, dt, ft_len, vs_ref, vs_site, vs_pga, hf_pga
+        )
     ft[:-1] *= 1.0 / ampf
     return fft.irfft(ft)[:npts]
 
 
-def deconvolve_timeseries_and_run_site_response(
+def deconvolve_timeseries(
     acceleration_waveform: np.ndarray,
     component: constants.Components,
     site_properties: SiteProp,
     dt=0.005,
-    logger=qclogging.get_basic_logger(),
 ):
     """
-    Deconvolves a surface waveform to a waveform at a given depth
-    No deamplification occurs here
-    :param acceleration_waveform: a 1d array of the component velocities to be run in cm/s/s
+    Deconvolves a surface waveform to a waveform at the base of the soil column
+    :param acceleration_waveform: a 1d array of the component accelerations in cm/s/s
     :param component: The name of the component. Used to determine the transfer function to use
     :param site_properties: A SiteProp object for the location
     :param dt: The timestep for the given waveform
-    :param logger: Logger to send messages to
-    :return: A waveform with site specific amplification applied. Has the same shape as waveform and units of m/s/s
+    :return: The deconvolved velocity in m/s, the input for OpenSees
     """
     size = acceleration_waveform.size
 
@@ -276,7 +480,8 @@ def deconvolve_timeseries_and_run_site_response(
     acceleration_waveform.resize(ft_len, refcheck=False)
 
     if component in BASE_COMPONENTS[:2]:
-        transfer = timeseries.transf(
+        transfer = curve_cache.get(
+            timeseries.transf,
             vs_ref,
             rho_ref,
             dampS_soil,
@@ -289,7 +494,8 @@ def deconvolve_timeseries_and_run_site_response(
         )
     elif component is constants.Components.cver:
         # TODO: Get ver transfer function
-        transfer = timeseries.transf(
+        transfer = curve_cache.get(
+            timeseries.transf,
             vp_ref,
             rho_ref,
             dampP_soil,
@@ -312,25 +518,75 @@ def deconvolve_timeseries_and_run_site_response(
     bbgm_decon = np.fft.irfft(deconv_ft)[:size]
 
     # integrate acceleration to get velocity (in m/s) for input to OpenSees
-    bbgm_decon_vel = (
-        cumulative_trapezoid(bbgm_decon, dx=dt, initial=0) * CM_TO_M_MULTIPLIER
+    return cumulative_trapezoid(bbgm_decon, dx=dt, initial=0) * CM_TO_M_MULTIPLIER
+
+
+def write_velocity(out_dir, velocity, binary=True):
+    """Writes the OpenSees input velocity to the directory, returns the file path"""
+    if binary:
+        velocity_path = pathlib.Path(out_dir) / "velocity.bin"
+        velocity.astype(BINARY_DTYPE).tofile(velocity_path)
+    else:
+        velocity_path = pathlib.Path(out_dir) / "velocity.txt"
+        np.savetxt(velocity_path, velocity)
+    return velocity_path
+
+
+def read_output(out_file, binary=True):
+    """Reads the OpenSees output acceleration in m/s/s"""
+    if binary:
+        return read_binary_output(out_file)
+    return np.loadtxt(out_file)
+
+
+def deconvolve_timeseries_and_run_site_response(
+    acceleration_waveform: np.ndarray,
+    component: constants.Components,
+    site_properties: SiteProp,
+    dt=0.005,
+    logger=qclogging.get_basic_logger(),
+    binary=True,
+    params_path=None,
+    io_dir=None,
+):
+    """
+    Deconvolves a surface waveform to a waveform at a given depth
+    No deamplification occurs here
+    :param acceleration_waveform: a 1d array of the component velocities to be run in cm/s/s
+    :param component: The name of the component. Used to determine the transfer function to use
+    :param site_properties: A SiteProp object for the location
+    :param dt: The timestep for the given waveform
+    :param logger: Logger to send messages to
+    :param binary: Pass the velocity to and the acceleration from OpenSees in binary format,
+        instead of text files
+    :param params_path: The tcl site parameters of the station, as written by site_params_file.
+        Written for this run if not given
+    :param io_dir: The directory for the temporary OpenSees files, defaults to get_io_dir()
+    :return: A waveform with site specific amplification applied. Has the same shape as waveform and units of m/s/s
+    """
+    size = acceleration_waveform.size
+    bbgm_decon_vel = deconvolve_timeseries(
+        acceleration_waveform, component, site_properties, dt
     )
 
-    with tempfile.TemporaryDirectory() as td:
+    with tempfile.TemporaryDirectory(
+        dir=get_io_dir() if io_dir is None else io_dir
+    ) as td:
         td = pathlib.Path(td)
-        with tempfile.NamedTemporaryFile(dir=td) as file_name:
-            # File name doesn't matter for temp file
-            np.savetxt(file_name, bbgm_decon_vel)
+        if params_path is None:
             params_path = td / "params.tcl"
             site_properties.to_tcl(params_path, nt=size)
-            try:
-                out_file = call_opensees(file_name.name, params_path, td, logger=logger)
-            except RuntimeError as e:
-                logger.error(f"This didn't work: {component}, {site_properties.name}")
-                raise e
-            else:
-                # Acceleration in m/s/s
-                return np.loadtxt(out_file)
+        velocity_path = write_velocity(td, bbgm_decon_vel, binary=binary)
+        try:
+            out_file = call_opensees(
+                velocity_path, params_path, td, binary=binary, logger=logger
+            )
+        except RuntimeError as e:
+            logger.error(f"This didn't work: {component}, {site_properties.name}")
+            raise e
+        else:
+            # Acceleration in m/s/s
+            return read_output(out_file, binary=binary)
 
 
 def check_status(component_outdir, check_fail=False):
@@ -359,20 +615,28 @@ def check_status(component_outdir, check_fail=False):
     return result
 
 
+def get_opensees_command(input_file, params_path, out_dir, binary=False):
+    command = [
+        config.qconfig["OpenSees"],
+        SITE_AMP_SCRIPT,
+        input_file,
+        params_path,
+        out_dir,
+    ]
+    if binary:
+        command.append("binary")
+    return command
+
+
 def call_opensees(
     input_file,
     params_path,
     out_dir,
     timeout_threshold=600,
+    binary=False,
     logger=qclogging.get_basic_logger(),
 ):
-    script = [
-        config.qconfig["OpenSees"],
-        SITE_AMP_SCRIPT,
-        input_file,
-        params_path,
-        out_dir,
-    ]
+    script = get_opensees_command(input_file, params_path, out_dir, binary=binary)
 
     try:
         subp = subprocess.run(
@@ -388,10 +652,181 @@ def call_opensees(
     logger.debug(f'got stdout line from subprocess: {subp.stdout.decode("utf-8")}')
     logger.debug(f'got stderr line from subprocess: {subp.stderr.decode("utf-8")}')
 
-    out_file_path = out_dir / "out.txt"
+    out_file_path = out_dir / (BINARY_OUT_FILE if binary else OUT_FILE)
     return out_file_path
 
 
+@dataclasses.dataclass
+class _SiteResponseRun:
+    key: typing.Hashable
+    params_key: typing.Tuple[str, int]
+    work_dir: pathlib.Path
+    command: typing.List
+    process: subprocess.Popen = None
+    start_time: float = None
+
+
+class SiteResponsePool:
+    """
+    Runs the OpenSees site response of many station components concurrently,
+    with at most n_procs OpenSees processes at a time.
+    Runs are submitted without waiting for OpenSees and their results are collected
+    as they finish, so the caller can keep working on other stations in the meantime.
+    The tcl site parameters are written once per station and shared by its components.
+    The run time per time step of each station, summed over its components, is
+    recorded in timings
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(
+        self,
+        n_procs=1,
+        io_dir=None,
+        timeout_threshold=600,
+        binary=True,
+        logger=qclogging.get_basic_logger(),
+    ):
+        """
+        :param n_procs: The maximum number of concurrent OpenSees processes
+        :param io_dir: The directory for the temporary OpenSees files, defaults to get_io_dir()
+        :param timeout_threshold: Seconds after which an OpenSees process is killed
+        :param binary: Pass the velocity to and the acceleration from OpenSees in binary format
+        """
+        self.n_procs = max(1, n_procs)
+        self.timeout_threshold = timeout_threshold
+        self.binary = binary
+        self.logger = logger
+        self._root = tempfile.TemporaryDirectory(
+            dir=get_io_dir() if io_dir is None else io_dir
+        )
+        self._queued = collections.deque()
+        self._running = []
+        # (station name, nt) -> [params path, number of unfinished runs]
+        self._params = {}
+        self.timings = collections.defaultdict(float)
+
+    def __len__(self):
+        """The number of unfinished runs"""
+        return len(self._queued) + len(self._running)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(
+        self,
+        key: typing.Hashable,
+        acceleration_waveform: np.ndarray,
+        component: constants.Components,
+        site_properties: SiteProp,
+        dt=0.005,
+    ):
+        """
+        Deconvolves the waveform and queues its OpenSees run
+        :param key: Identifies the run in the results of collect
+        See deconvolve_timeseries_and_run_site_response for the other parameters
+        """
+        velocity = deconvolve_timeseries(
+            acceleration_waveform, component, site_properties, dt
+        )
+        params_key = (site_properties.name, velocity.size)
+        if params_key not in self._params:
+            station_dir = pathlib.Path(
+                tempfile.mkdtemp(prefix=f"{site_properties.name}_", dir=self._root.name)
+            )
+            params_path = station_dir / "params.tcl"
+            site_properties.to_tcl(params_path, nt=velocity.size)
+            self._params[params_key] = [params_path, 0]
+        params_path = self._params[params_key][0]
+        self._params[params_key][1] += 1
+
+        work_dir = pathlib.Path(tempfile.mkdtemp(dir=params_path.parent))
+        velocity_path = write_velocity(work_dir, velocity, binary=self.binary)
+        self._queued.append(
+            _SiteResponseRun(
+                key,
+                params_key,
+                work_dir,
+                get_opensees_command(
+                    velocity_path, params_path, work_dir, binary=self.binary
+                ),
+            )
+        )
+        self._start()
+
+    def _start(self):
+        while self._queued and len(self._running) < self.n_procs:
+            run = self._queued.popleft()
+            with open(run.work_dir / "stdout.txt", "w") as stdout, open(
+                run.work_dir / "stderr.txt", "w"
+            ) as stderr:
+                run.process = subprocess.Popen(
+                    run.command, stdout=stdout, stderr=stderr
+                )
+            run.start_time = time.time()
+            self._running.append(run)
+
+    def collect(self, wait=False):
+        """
+        Collects the results of the finished runs
+        :param wait: Block until at least one run finishes, if any are unfinished
+        :return: A list of (key, acceleration in m/s/s) of the finished runs
+        """
+        while True:
+            finished = []
+            for run in self._running:
+                if run.process.poll() is not None:
+                    finished.append(run)
+                elif time.time() - run.start_time > self.timeout_threshold:
+                    run.process.kill()
+                    run.process.wait()
+                    e = subprocess.TimeoutExpired(run.command, self.timeout_threshold)
+                    self.logger.error(str(e))
+                    raise e
+            for run in finished:
+                self._running.remove(run)
+            results = [(run.key, self._finish(run)) for run in finished]
+            self._start()
+            if results or not wait or len(self) == 0:
+                return results
+            time.sleep(self.POLL_INTERVAL)
+
+    def _finish(self, run: _SiteResponseRun):
+        station, nt = run.params_key
+        self.timings[station] += (time.time() - run.start_time) / nt
+        self.logger.debug(
+            f"got stdout from subprocess: {(run.work_dir / 'stdout.txt').read_text()}"
+        )
+        self.logger.debug(
+            f"got stderr from subprocess: {(run.work_dir / 'stderr.txt').read_text()}"
+        )
+        try:
+            return read_output(
+                run.work_dir / (BINARY_OUT_FILE if self.binary else OUT_FILE),
+                binary=self.binary,
+            )
+        finally:
+            shutil.rmtree(run.work_dir, ignore_errors=True)
+            params = self._params[run.params_key]
+            params[1] -= 1
+            if params[1] == 0:
+                shutil.rmtree(params[0].parent, ignore_errors=True)
+                del self._params[run.params_key]
+
+    def close(self):
+        """Kills the unfinished runs and removes the temporary files"""
+        for run in self._running:
+            run.process.kill()
+            run.process.wait()
+        self._running.clear()
+        self._queued.clear()
+        self._params.clear()
+        self._root.cleanup()
+
+
 def run_deamp_decon_and_site_response_ascii(folder, station_folder, output_dir):
     files = folder.glob("*.*")
     stations = {x.stem for x in files}
@@ -404,25 +839,35 @@ def run_deamp_decon_and_site_response_ascii(folder, station_folder, output_dir):
 
     for site_name, site_path in sites.items():
         site_prop = SiteProp.from_file(site_path)
-        for i, waveform_component in enumerate(BASE_COMPONENTS):
-            vel_waveform, meta = timeseries.read_ascii(
+        waveforms = [
+            timeseries.read_ascii(
                 folder / f"{site_name}.{waveform_component.str_value}", meta=True
             )
-            acc_waveform = timeseries.vel2acc(vel_waveform, meta["dt"])
-            deamp_wave = run_deamp(
-                acc_waveform,
-                waveform_component,
-                meta["dt"],
-                site_prop.Vs[0],
-                np.max(acc_waveform),
-            )
-            deconv = deconvolve_timeseries_and_run_site_response(
-                deamp_wave[:], waveform_component, site_prop, meta["dt"]
-            )
-            np.savetxt(
-                output_dir / f"{site_name}_{waveform_component.str_value}.csv",
-                deconv,
-            )
+            for waveform_component in BASE_COMPONENTS
+        ]
+        with site_params_file(site_prop, waveforms[0][0].size) as params_path:
+            for waveform_component, (vel_waveform, meta) in zip(
+                BASE_COMPONENTS, waveforms
+            ):
+                acc_waveform = timeseries.vel2acc(vel_waveform, meta["dt"])
+                deamp_wave = run_deamp(
+                    acc_waveform,
+                    waveform_component,
+                    meta["dt"],
+                    site_prop.Vs[0],
+                    np.max(acc_waveform),
+                )
+                deconv = deconvolve_timeseries_and_run_site_response(
+                    deamp_wave[:],
+                    waveform_component,
+                    site_prop,
+                    meta["dt"],
+                    params_path=params_path,
+                )
+                np.savetxt(
+                    output_dir / f"{site_name}_{waveform_component.str_value}.csv",
+                    deconv,
+                )
 
 
 def run_deamp_decon_and_site_response_binary(bb_bin, station_folder, output_dir):
@@ -438,21 +883,282 @@ def run_deamp_decon_and_site_response_binary(bb_bin, station_folder, output_dir)
     for site_name, site_path in sites.items():
         site_prop = SiteProp.from_file(site_path)
         acc_waveforms = bb.acc(site_name) * 980.665  # Convert g to cm/s/s
-        for i, waveform_component in enumerate(BASE_COMPONENTS):
-            deamp_wave = run_deamp(
-                acc_waveforms[i],
-                waveform_component,
-                dt,
-                site_prop.Vs[0],
-                np.max(acc_waveforms[i]),  # ????
-            )
-            deconv = deconvolve_timeseries_and_run_site_response(
-                deamp_wave[:], waveform_component, site_prop, dt
-            )
-            np.savetxt(
-                output_dir / f"{site_name}_{waveform_component.str_value}.csv",
-                deconv,
-            )
+        with site_params_file(site_prop, acc_waveforms[0].size) as params_path:
+            for i, waveform_component in enumerate(BASE_COMPONENTS):
+                deamp_wave = run_deamp(
+                    acc_waveforms[i],
+                    waveform_component,
+                    dt,
+                    site_prop.Vs[0],
+                    np.max(acc_waveforms[i]),  # ????
+                )
+                deconv = deconvolve_timeseries_and_run_site_response(
+                    deamp_wave[:],
+                    waveform_component,
+                    site_prop,
+                    dt,
+                    params_path=params_path,
+                )
+                np.savetxt(
+                    output_dir / f"{site_name}_{waveform_component.str_value}.csv",
+                    deconv,
+                )
+
+
+class SiteResponseBinary:
+    """
+    Output of the batch driver, in the layout of BB.bin files (acceleration in g).
+    As in bb_sim, the vsite of a station header is only set once its waveforms are
+    written, which checkpoints the progress so interrupted runs can resume
+    """
+
+    def __init__(
+        self, out_file, station_headers, nt, dt, start_sec=0.0, sources=("", "", "")
+    ):
+        """
+        :param out_file: The path of the output file
+        :param station_headers: The station headers (HEAD_STAT bytes each) of the
+            stations, as in the input BB.bin
+        :param nt, dt, start_sec: The time steps of the waveforms
+        :param sources: Three strings recorded in the header, in place of the
+            LF, VM and HF paths of BB.bin files
+        """
+        self.out_file = pathlib.Path(out_file)
+        self.head_size = timeseries.BBSeis.HEAD_SIZE
+        self.head_stat = timeseries.BBSeis.HEAD_STAT
+        self.station_headers = np.asarray(station_headers).copy()
+        self.nstat = self.station_headers.size
+        self.nt = nt
+        self.vsite_dtype = {
+            "names": ["name", "vsite"],
+            "formats": ["|S8", "f4"],
+            "offsets": [8, VSITE_OFFSET],
+            "itemsize": self.head_stat,
+        }
+        self.vsites = self.station_headers.view(self.vsite_dtype)["vsite"].copy()
+        self.station_headers.view(self.vsite_dtype)["vsite"] = 0
+
+        self.header = np.array([self.nstat, nt], dtype="i4").tobytes()
+        self.header += np.array([nt * dt, dt, start_sec], dtype="f4").tobytes()
+        self.header += np.array(sources, dtype="|S256").tobytes()
+        self.file_size = (
+            self.head_size
+            + self.nstat * self.head_stat
+            + self.nstat * nt * N_COMPONENTS * 4
+        )
+
+    def initialise(self):
+        """
+        Creates the output file, unless a matching one exists
+        :return: The completed stations
+        """
+        completed = self.completed()
+        if completed is not None:
+            return completed
+        with open(self.out_file, "w+b") as out:
+            out.write(self.header)
+            out.seek(self.head_size)
+            self.station_headers.tofile(out)
+            out.seek(self.file_size - 4)
+            np.float32().tofile(out)
+        return np.zeros(self.nstat, dtype=bool)
+
+    def completed(self):
+        """The completed stations of an existing output file, None if there is no
+        output file for the same stations and time steps"""
+        if (
+            not self.out_file.is_file()
+            or self.out_file.stat().st_size != self.file_size
+        ):
+            return None
+        with open(self.out_file, "rb") as out:
+            if out.read(len(self.header)) != self.header:
+                return None
+            out.seek(self.head_size)
+            headers = np.fromfile(out, dtype=self.vsite_dtype, count=self.nstat)
+        if not np.array_equal(
+            headers["name"], self.station_headers.view(self.vsite_dtype)["name"]
+        ):
+            return None
+        return headers["vsite"] > 0
+
+    def write(self, out, index, acc):
+        """
+        Writes the waveforms of a station, then its vsite as the checkpoint
+        :param out: The output file, opened as r+b
+        :param index: The index of the station
+        :param acc: The (nt, N_COMPONENTS) acceleration in g
+        """
+        out.seek(
+            self.head_size
+            + self.nstat * self.head_stat
+            + index * self.nt * N_COMPONENTS * 4
+        )
+        np.asarray(acc, dtype="f4").tofile(out)
+        out.seek(self.head_size + index * self.head_stat + VSITE_OFFSET)
+        # stations without a vsite still need a non zero checkpoint
+        np.float32(self.vsites[index] or 1.0).tofile(out)
+
+
+def run_site_response_batch(
+    stations,
+    load_acc,
+    output: SiteResponseBinary,
+    n_procs=1,
+    logger=qclogging.get_basic_logger(),
+):
+    """
+    Runs the deamplification, deconvolution and site response of many stations,
+    with n_procs concurrent OpenSees processes, and writes them to a single binary file.
+    Stations already completed in the output file are skipped
+    :param stations: The (station name, site file) of each station of the output
+    :param load_acc: Function returning the (nt, N_COMPONENTS) acceleration (cm/s/s)
+        and dt of a station, in the component order of BB.bin files
+    :param output: The binary output
+    """
+    components = [constants.Components(c) for c in range(N_COMPONENTS)]
+    completed = output.initialise()
+    todo = [index for index in range(len(stations)) if not completed[index]]
+    logger.info(
+        f"{np.sum(completed)} of {len(stations)} stations completed, "
+        f"running {len(todo)} stations with {n_procs} OpenSees processes"
+    )
+
+    start_time = time.time()
+    n_done = 0
+    # station index -> [accelerations, number of components left]
+    station_acc = {}
+    with SiteResponsePool(n_procs, logger=logger) as pool, open(
+        output.out_file, "r+b"
+    ) as out:
+
+        def collect(wait=False):
+            nonlocal n_done
+            for (index, c), acc in pool.collect(wait=wait):
+                station_acc[index][0][:, c] = acc / M_TO_G_DIVISOR
+                station_acc[index][1] -= 1
+                if station_acc[index][1] == 0:
+                    output.write(out, index, station_acc.pop(index)[0])
+                    n_done += 1
+                    if n_done % PROGRESS_INTERVAL == 0 or n_done == len(todo):
+                        run_time = time.time() - start_time
+                        logger.info(
+                            f"{n_done} of {len(todo)} stations completed in "
+                            f"{run_time:.1f}s, {n_done / run_time * 3600:.1f} stations/h, "
+                            f"{N_COMPONENTS * n_done / run_time:.3f} components/s"
+                        )
+
+        for index in todo:
+            # Limits the number of queued runs (and their input files)
+            while len(pool) >= N_COMPONENTS * pool.n_procs:
+                collect(wait=True)
+            site_name, site_path = stations[index]
+            site_prop = SiteProp.from_file(site_path)
+            acc_waveforms, dt = load_acc(site_name)
+            station_acc[index] = [
+                np.empty((output.nt, N_COMPONENTS), dtype="f4"),
+                N_COMPONENTS,
+            ]
+            for c, component in enumerate(components):
+                acc_waveform = np.array(acc_waveforms[:, c], dtype=np.float64)
+                deamp_wave = run_deamp(
+                    acc_waveform,
+                    component,
+                    dt,
+                    site_prop.Vs[0],
+                    np.max(acc_waveform),
+                )
+                pool.submit((index, c), deamp_wave, component, site_prop, dt)
+            collect()
+        while len(pool) > 0:
+            collect(wait=True)
+
+    logger.info(
+        f"Site response of {n_done} stations completed in "
+        f"{time.time() - start_time:.1f}s. "
+        f"Curve cache: {curve_cache.cache_info()}, hit rate {curve_cache.hit_rate:.2f}"
+    )
+
+
+def run_site_response_batch_binary(
+    bb_bin, station_folder, output_dir, n_procs=1, logger=qclogging.get_basic_logger()
+):
+    """Runs the site response of the stations of a BB.bin file with a site file"""
+    bb = timeseries.BBSeis(str(bb_bin))
+    site_files = {station.stem: station for station in station_folder.glob("*.yaml")}
+    indices = [i for i, name in enumerate(bb.stations.name) if str(name) in site_files]
+    stations = [
+        (str(bb.stations.name[i]), site_files[str(bb.stations.name[i])])
+        for i in indices
+    ]
+
+    with open(bb_bin, "rb") as f:
+        f.seek(timeseries.BBSeis.HEAD_SIZE)
+        station_headers = np.fromfile(
+            f, dtype=f"V{timeseries.BBSeis.HEAD_STAT}", count=bb.stations.size
+        )[indices]
+    output = SiteResponseBinary(
+        output_dir / BATCH_OUTPUT_FILE,
+        station_headers,
+        bb.nt,
+        bb.dt,
+        bb.start_sec,
+        (str(bb_bin), str(station_folder), "site_response"),
+    )
+    run_site_response_batch(
+        stations,
+        lambda name: (bb.acc(name) * G_TO_CM_MULTIPLIER, bb.dt),
+        output,
+        n_procs=n_procs,
+        logger=logger,
+    )
+
+
+def run_site_response_batch_ascii(
+    folder, station_folder, output_dir, n_procs=1, logger=qclogging.get_basic_logger()
+):
+    """Runs the site response of the stations of an ascii waveform folder with a site file"""
+    components = [constants.Components(c) for c in range(N_COMPONENTS)]
+    waveform_stations = {x.stem for x in folder.glob("*.*")}
+    stations = sorted(
+        (station.stem, station)
+        for station in station_folder.glob("*.yaml")
+        if station.stem in waveform_stations
+    )
+
+    def load_acc(site_name):
+        waveforms = [
+            timeseries.read_ascii(folder / f"{site_name}.{comp.str_value}", meta=True)
+            for comp in components
+        ]
+        dt = waveforms[0][1]["dt"]
+        return (
+            np.stack([timeseries.vel2acc(vel, dt) for vel, _ in waveforms], axis=1),
+            dt,
+        )
+
+    _, meta = timeseries.read_ascii(
+        folder / f"{stations[0][0]}.{components[0].str_value}", meta=True
+    )
+    station_headers = np.zeros(
+        len(stations),
+        dtype={
+            "names": ["name"],
+            "formats": ["|S8"],
+            "offsets": [8],
+            "itemsize": timeseries.BBSeis.HEAD_STAT,
+        },
+    )
+    station_headers["name"] = [name for name, _ in stations]
+    output = SiteResponseBinary(
+        output_dir / BATCH_OUTPUT_FILE,
+        station_headers,
+        meta["nt"],
+        meta["dt"],
+        meta.get("sec", 0.0),
+        (str(folder), str(station_folder), "site_response"),
+    )
+    run_site_response_batch(stations, load_acc, output, n_procs=n_procs, logger=logger)
 
 
 def load_args():
@@ -475,17 +1181,37 @@ def load_args():
         choices=["a", "b"],
         help="Type of input data, either (a)scii or (b)inary.",
     )
+    parser.add_argument(
+        "--n_procs",
+        type=int,
+        default=1,
+        help="Number of concurrent OpenSees processes",
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="Write one csv file per station component, one station at a time, "
+        f"instead of a single {BATCH_OUTPUT_FILE} with the BB.bin layout",
+    )
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = load_args()
-    if args.type == "a":
+    if args.csv and args.type == "a":
         run_deamp_decon_and_site_response_ascii(
             args.bb_bin, args.station_folder, args.output_dir
         )
-    elif args.type == "b":
+    elif args.csv and args.type == "b":
         run_deamp_decon_and_site_response_binary(
             args.bb_bin, args.station_folder, args.output_dir
         )
+    elif args.type == "a":
+        run_site_response_batch_ascii(
+            args.bb_bin, args.station_folder, args.output_dir, n_procs=args.n_procs
+        )
+    elif args.type == "b":
+        run_site_response_batch_binary(
+            args.bb_bin, args.station_folder, args.output_dir, n_procs=args.n_procs
+        )
@@ -0,0 +1,120 @@
+"""
+Per station checksums and statistics of the HF and BB binaries.
+
+The simulations keep a sidecar index next to their binary (<binary>.stats) with one
+fixed size record per station, in the station order of the binary. A station's record
+is written after its waveforms, so completed stations can be verified from the index
+instead of reading the waveforms again.
+"""
+import os
+import zlib
+
+import numpy as np
+
+STATS_SUFFIX = ".stats"
+N_COMP = 3
+STATS_DTYPE = np.dtype(
+    [
+        ("crc32", "<u4"),
+        ("peak", "<f4", (N_COMP,)),
+        ("rms", "<f4", (N_COMP,)),
+        ("done", "u1"),
+    ],
+    align=True,
+)
+
+
+def get_stats_path(bin_path):
+    return f"{bin_path}{STATS_SUFFIX}"
+
+
+def initialise(stats_path, n_stations):
+    """
+    Creates an empty index, no station is done
+    """
+    np.zeros(n_stations, dtype=STATS_DTYPE).tofile(stats_path)
+
+
+def load(stats_path, n_stations):
+    """
+    Loads the index of a binary
+    :return: The records of all stations or None if the index is missing or doesn't match
+        the number of stations
+    """
+    if (
+        not os.path.isfile(stats_path)
+        or os.stat(stats_path).st_size != n_stations * STATS_DTYPE.itemsize
+    ):
+        return None
+    return np.fromfile(stats_path, dtype=STATS_DTYPE, count=n_stations)
+
+
+def station_stats(acc):
+    """
+    The record of a station
+    :param acc: (nt, N_COMP) waveforms as written to the binary, the checksum is of its bytes
+    """
+    acc = np.ascontiguousarray(acc)
+    record = np.zeros(1, dtype=STATS_DTYPE)[0]
+    record["crc32"] = zlib.crc32(acc.data)
+    record["peak"] = np.max(np.abs(acc), axis=0)
+    record["rms"] = np.sqrt(np.mean(np.square(acc, dtype="f8"), axis=0))
+    record["done"] = 1
+    return record
+
+
+def write_station(stats_file, index, acc):
+    """
+    Writes the record of a station to the open (r+b) index
+    """
+    stats_file.seek(index * STATS_DTYPE.itemsize)
+    station_stats(acc).tofile(stats_file)
+    stats_file.flush()
+
+
+def read_station_acc(bin_file, data_offset, nt, index, dtype="f4"):
+    """
+    Reads the waveforms of a station from an open binary
+    :param data_offset: Offset of the waveforms of the first station, after the headers
+    """
+    bin_file.seek(data_offset + index * nt * N_COMP * np.dtype(dtype).itemsize)
+    return np.fromfile(bin_file, dtype=dtype, count=nt * N_COMP).reshape(nt, N_COMP)
+
+
+def update(bin_path, stats_path, data_offset, nt, indices):
+    """
+    Computes the records of the given stations from the waveforms in the binary,
+    used for completed stations that don't have a record yet
+    """
+    with open(bin_path, "rb") as bin_file, open(stats_path, "r+b") as stats_file:
+        for index in indices:
+            write_station(
+                stats_file, index, read_station_acc(bin_file, data_offset, nt, index)
+            )
+
+
+def check(stats, names=None):
+    """
+    Checks the index of a completed binary without reading any waveforms.
+    Stations fail if they are not done, have a component that is all zeros
+    (peak of 0) or contain NaN / inf values.
+    :param stats: The records of all stations, as given by load
+    :param names: The station names, used for the messages
+    :return: The indices of failed stations and a message for each of them
+    """
+    if names is None:
+        names = np.arange(stats.size).astype(str)
+    messages = {}
+    not_done = stats["done"] == 0
+    not_finite = ~np.isfinite(stats["rms"]).all(axis=1) | ~np.isfinite(
+        stats["peak"]
+    ).all(axis=1)
+    all_zero = (stats["peak"] == 0).any(axis=1)
+    for i in np.flatnonzero(not_done):
+        messages[i] = f"Station {names[i]} has not been completed"
+    for i in np.flatnonzero(~not_done & not_finite):
+        messages[i] = f"The waveform for station {names[i]} contains NaN or inf values"
+    for i in np.flatnonzero(~not_done & ~not_finite & all_zero):
+        messages[i] = f"The waveform for station {names[i]} contains all zeros"
+    failed = np.array(sorted(messages), dtype=int)
+    return failed, [messages[i] for i in failed]
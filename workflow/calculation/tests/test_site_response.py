@@ -0,0 +1,202 @@
+"""Unit tests for the site response curve cache, binary output and batch driver"""
+import types
+
+import numpy as np
+import pytest
+from qcore import timeseries
+
+from workflow.calculation.site_response_BB import site_response
+from workflow.calculation.site_response_BB.site_response import CurveCache
+
+N = 128
+CURVE_BYTES = N * np.dtype("f8").itemsize
+
+
+def curve(value):
+    return np.full(N, value)
+
+
+def test_curve_cache_hits():
+    """Float inputs are quantised, so close inputs share a curve"""
+    cache = CurveCache(significant_digits=4)
+    first = cache.get(curve, 1.2351)
+    assert cache.get(curve, 1.2349) is first
+    assert first[0] == 1.235
+    assert cache.get(curve, 2.0) is not first
+    assert cache.cache_info()[:4] == (1, 2, 2, 2 * CURVE_BYTES)
+    assert cache.hit_rate == pytest.approx(1 / 3)
+
+
+def test_curve_cache_read_only():
+    cache = CurveCache()
+    with pytest.raises(ValueError):
+        cache.get(curve, 1.0)[0] = 0
+
+
+def test_curve_cache_lru():
+    """The least recently used curves are dropped once max_bytes is exceeded"""
+    cache = CurveCache(max_bytes=2 * CURVE_BYTES)
+    first = cache.get(curve, 1.0)
+    cache.get(curve, 2.0)
+    # 1.0 is now more recently used than 2.0
+    assert cache.get(curve, 1.0) is first
+    cache.get(curve, 3.0)
+    assert cache.nbytes == 2 * CURVE_BYTES
+
+    cache.get(curve, 1.0)
+    assert cache.hits == 2
+    cache.get(curve, 2.0)
+    assert cache.misses == 4
+
+
+def test_curve_cache_bytes():
+    """Curves above max_bytes are returned without being cached,
+    shrinking the cache drops curves"""
+    cache = CurveCache(max_bytes=CURVE_BYTES - 1)
+    cache.get(curve, 1.0)
+    assert cache.cache_info().n_curves == 0
+    assert cache.nbytes == 0
+
+    cache = CurveCache(max_bytes=3 * CURVE_BYTES)
+    for value in [1.0, 2.0, 3.0]:
+        cache.get(curve, value)
+    cache.resize(CURVE_BYTES)
+    assert cache.cache_info().n_curves == 1
+    assert cache.nbytes == CURVE_BYTES
+    cache.get(curve, 3.0)
+    assert cache.hits == 1
+
+
+HEADER_DTYPE = {
+    "names": ["name", "vsite"],
+    "formats": ["|S8", "f4"],
+    "offsets": [8, site_response.VSITE_OFFSET],
+    "itemsize": timeseries.BBSeis.HEAD_STAT,
+}
+N_STATIONS = 5
+NT, DT = 16, 0.01
+
+
+class ImmediatePool:
+    """SiteResponsePool that returns the submitted waveforms without running OpenSees"""
+
+    def __init__(self, n_procs=1, logger=None):
+        self.n_procs = n_procs
+        self._finished = []
+
+    def __len__(self):
+        return len(self._finished)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def submit(self, key, acceleration_waveform, component, site_properties, dt=0.005):
+        self._finished.append((key, acceleration_waveform))
+
+    def collect(self, wait=False):
+        finished, self._finished = self._finished, []
+        return finished
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    """A batch of stations, with the OpenSees runs replaced by the identity"""
+    monkeypatch.setattr(site_response, "SiteResponsePool", ImmediatePool)
+    monkeypatch.setattr(site_response, "run_deamp", lambda acc, *args: acc)
+    monkeypatch.setattr(
+        site_response.SiteProp,
+        "from_file",
+        classmethod(lambda cls, path: types.SimpleNamespace(Vs=[300.0])),
+    )
+
+    station_headers = np.zeros(N_STATIONS, dtype=f"V{timeseries.BBSeis.HEAD_STAT}")
+    stations = []
+    for i in range(N_STATIONS):
+        name = f"STAT{i}"
+        station_headers[i : i + 1].view(HEADER_DTYPE)["name"] = name.encode()
+        station_headers[i : i + 1].view(HEADER_DTYPE)["vsite"] = 200.0 + i
+        stations.append((name, tmp_path / f"{name}.yaml"))
+    output = site_response.SiteResponseBinary(
+        tmp_path / site_response.BATCH_OUTPUT_FILE, station_headers, NT, DT
+    )
+    return stations, output
+
+
+def get_acc(name):
+    """The (nt, 3) acceleration of a station, different for every station"""
+    return (
+        np.arange(NT * 3, dtype=np.float64).reshape(NT, 3) + int(name[4:]) * 100,
+        DT,
+    )
+
+
+def read_output(output):
+    data = np.fromfile(
+        output.out_file,
+        dtype="f4",
+        offset=output.head_size + N_STATIONS * output.head_stat,
+    )
+    return data.reshape(N_STATIONS, NT, 3)
+
+
+def test_batch_resume(batch):
+    """Only the stations not completed by the interrupted run are run again"""
+    stations, output = batch
+    loaded = []
+
+    def load_acc(name):
+        if len(loaded) == 3:
+            raise RuntimeError("Interrupted")
+        loaded.append(name)
+        return get_acc(name)
+
+    with pytest.raises(RuntimeError):
+        site_response.run_site_response_batch(stations, load_acc, output)
+    assert output.completed().tolist() == [True] * 3 + [False] * 2
+
+    loaded.clear()
+    site_response.run_site_response_batch(stations, load_acc, output)
+    assert loaded == ["STAT3", "STAT4"]
+    assert output.completed().all()
+
+    acc = read_output(output)
+    for i, (name, _) in enumerate(stations):
+        np.testing.assert_allclose(
+            acc[i], get_acc(name)[0] / site_response.M_TO_G_DIVISOR, rtol=1e-6
+        )
+    # The vsites of the input are the checkpoints
+    with open(output.out_file, "rb") as f:
+        f.seek(output.head_size)
+        headers = np.fromfile(f, dtype=HEADER_DTYPE, count=N_STATIONS)
+    assert headers["vsite"].tolist() == [200.0 + i for i in range(N_STATIONS)]
+
+
+def test_batch_other_stations(batch):
+    """An output file of other stations is replaced"""
+    stations, output = batch
+    site_response.run_site_response_batch(stations, get_acc, output)
+
+    other_output = site_response.SiteResponseBinary(
+        output.out_file, output.station_headers[::-1], NT, DT
+    )
+    assert other_output.completed() is None
+    assert not other_output.initialise().any()
+
+
+@pytest.mark.parametrize("newline", [True, False])
+def test_read_binary_output(tmp_path, newline):
+    """OpenSees binary recorders may terminate each record with a newline"""
+    values = np.linspace(-1, 1, 11)
+    if newline:
+        records = np.zeros(values.size, dtype=[("value", "f8"), ("end", "u1")])
+        records["value"] = values
+        records["end"] = ord("\n")
+    else:
+        records = values
+    out_file = tmp_path / site_response.BINARY_OUT_FILE
+    records.tofile(out_file)
+
+    np.testing.assert_array_equal(site_response.read_binary_output(out_file), values)
@@ -0,0 +1,113 @@
+"""Unit tests for the per station statistics index of the HF and BB binaries"""
+import numpy as np
+import pytest
+
+from workflow.calculation import station_stats
+from workflow.calculation.verification.test_binary import check_waveforms
+
+NT = 50
+NAMES = ["OK", "NOTDONE", "NAN", "ZERO"]
+DATA_OFFSET = 16
+
+
+@pytest.fixture
+def waveforms():
+    """(nstat, nt, N_COMP) waveforms, the station NAN has a NaN value and the station
+    ZERO an all zero component"""
+    rng = np.random.default_rng(1)
+    acc = rng.normal(size=(len(NAMES), NT, station_stats.N_COMP)).astype("f4")
+    acc[NAMES.index("NAN"), 10, 1] = np.nan
+    acc[NAMES.index("ZERO"), :, 2] = 0
+    return acc
+
+
+@pytest.fixture
+def binary(tmp_path, waveforms):
+    """A binary with a header of DATA_OFFSET bytes and its index, with every station
+    but NOTDONE written"""
+    bin_path = tmp_path / "BB.bin"
+    with open(bin_path, "wb") as f:
+        f.write(b"\x01" * DATA_OFFSET)
+        waveforms.tofile(f)
+
+    stats_path = station_stats.get_stats_path(str(bin_path))
+    station_stats.initialise(stats_path, len(NAMES))
+    with open(stats_path, "r+b") as stats_file:
+        for i, name in enumerate(NAMES):
+            if name != "NOTDONE":
+                station_stats.write_station(stats_file, i, waveforms[i])
+    return str(bin_path), stats_path
+
+
+def test_load(binary):
+    _, stats_path = binary
+    stats = station_stats.load(stats_path, len(NAMES))
+    assert stats["done"].tolist() == [1, 0, 1, 1]
+    assert station_stats.load(stats_path, len(NAMES) + 1) is None
+    assert station_stats.load(stats_path + ".missing", len(NAMES)) is None
+
+
+def test_station_stats(waveforms):
+    record = station_stats.station_stats(waveforms[0])
+    np.testing.assert_allclose(record["peak"], np.abs(waveforms[0]).max(axis=0))
+    np.testing.assert_allclose(
+        record["rms"], np.sqrt(np.mean(np.square(waveforms[0], dtype="f8"), axis=0))
+    )
+    # The checksum is of the bytes written to the binary
+    assert record["crc32"] == station_stats.station_stats(waveforms[0].copy())["crc32"]
+    assert record["crc32"] != station_stats.station_stats(waveforms[1])["crc32"]
+
+
+def test_check(binary):
+    _, stats_path = binary
+    failed, messages = station_stats.check(
+        station_stats.load(stats_path, len(NAMES)), np.array(NAMES)
+    )
+    assert failed.tolist() == [1, 2, 3]
+    assert messages == [
+        "Station NOTDONE has not been completed",
+        "The waveform for station NAN contains NaN or inf values",
+        "The waveform for station ZERO contains all zeros",
+    ]
+
+    failed, messages = station_stats.check(
+        station_stats.load(stats_path, len(NAMES))[[0]]
+    )
+    assert failed.size == 0 and messages == []
+
+
+def test_update(binary, waveforms):
+    """The records computed from the binary are those of the simulation"""
+    bin_path, stats_path = binary
+    expected = station_stats.load(stats_path, len(NAMES))
+    station_stats.initialise(stats_path, len(NAMES))
+    station_stats.update(bin_path, stats_path, DATA_OFFSET, NT, range(len(NAMES)))
+
+    stats = station_stats.load(stats_path, len(NAMES))
+    assert stats["done"].all()
+    done = expected["done"] == 1
+    for field in station_stats.STATS_DTYPE.names:
+        np.testing.assert_array_equal(stats[field][done], expected[field][done])
+    assert stats["crc32"][NAMES.index("NOTDONE")] == (
+        station_stats.station_stats(waveforms[NAMES.index("NOTDONE")])["crc32"]
+    )
+
+
+def test_check_waveforms_checksum(binary, waveforms):
+    """Stations whose waveforms don't match their checksum fail"""
+    _, stats_path = binary
+    stats = station_stats.load(stats_path, len(NAMES))
+    stats["crc32"][NAMES.index("NOTDONE")] = station_stats.station_stats(
+        waveforms[NAMES.index("NOTDONE")]
+    )["crc32"]
+    # A single sample of the first station differs from the simulation
+    waveforms[0, 20, 0] += 1
+
+    report = check_waveforms(waveforms, NAMES, memory_budget=0, stats=stats)
+    assert report.checksum_ok.tolist() == [False, True, True, True]
+    assert report.failed.tolist() == [True, False, True, True]
+    assert report.n_non_finite.tolist() == [0, 0, 1, 0]
+    assert report.n_all_zero_comps.tolist() == [0, 0, 0, 1]
+
+    report = check_waveforms(waveforms, NAMES)
+    assert report.checksum_ok.all()
@@ -4,17 +4,18 @@ Checks that a given IM_calc folder has all csv files expected after IM_calculati
 event.
 Example usage:
 python im_calc_checkpoint.py /nesi/nobackup/nesi00213/RunFolder/Cybershake/v18p6_rerun/Runs/Kelly/Kelly_HYP01-29_S1244/IM_calc 5302 1
+Multiple IM_calc folders with the same stations can be checked at once:
+python im_calc_checkpoint.py /nesi/nobackup/nesi00213/RunFolder/Cybershake/v18p6_rerun/Runs/Kelly/*/IM_calc 5302 1
 """
 
 import os
 import sys
-import glob
 import argparse
 
 IM_CALC_DIR = "IM_calc"
-CSV_PATTERN = "*.csv"
 CSV_SUFFIX = ".csv"
-META_PATTERN = "*imcalc.info"
+META_SUFFIX = "imcalc.info"
+READ_BUFFER_SIZE = 1024 * 1024
 # Examples:
 # sim_waveform_dirs =
 # ['/nesi/nobackup/nesi00213/RunFolder/Cybershake/v18p6/Runs/test/Kelly/BB/Cant1D_v3-midQ_OneRay_hfnp2mm+_rvf0p8_sd50_k0p045/Kelly_HYP20-29_S1434',
@@ -29,6 +30,46 @@ def print_verbose(message, verbose):
         print(message)
 
 
+def list_files(directory, suffix):
+    """
+    Lists the (non hidden) files in the directory ending with suffix, like glob.glob1
+    with the pattern *suffix, without matching every name against a pattern
+    """
+    with os.scandir(directory) as entries:
+        return [
+            entry.name
+            for entry in entries
+            if entry.name.endswith(suffix) and not entry.name.startswith(".")
+        ]
+
+
+def count_files(directory, suffix):
+    """Counts the (non hidden) files in the directory ending with suffix"""
+    with os.scandir(directory) as entries:
+        return sum(
+            1
+            for entry in entries
+            if entry.name.endswith(suffix) and not entry.name.startswith(".")
+        )
+
+
+def count_lines(file_path, buffer_size=READ_BUFFER_SIZE):
+    """
+    Counts the lines of a file with buffered binary reads, a last line without a
+    newline is counted as well (as by readlines)
+    """
+    n_lines = 0
+    last = b"\n"
+    with open(file_path, "rb") as f:
+        while True:
+            buffer = f.read(buffer_size)
+            if not buffer:
+                break
+            n_lines += buffer.count(b"\n")
+            last = buffer[-1:]
+    return n_lines + (last != b"\n")
+
+
 def check_im_calc_completion(
     output_dir,
     station_count,
@@ -51,7 +92,7 @@ def check_im_calc_completion(
         print_verbose("Output directory does not exist", verbose)
         return False
 
-    sum_csv = glob.glob1(output_dir, CSV_PATTERN)
+    sum_csv = list_files(output_dir, CSV_SUFFIX)
 
     if observed:
         sum_csv = [f for f in sum_csv if event_name in f]
@@ -66,32 +107,34 @@ def check_im_calc_completion(
 
     csv_file_name = sum_csv[0]
 
-    with open(os.path.join(output_dir, csv_file_name)) as csv_file:
-        if station_count * components != (len(csv_file.readlines()) - 1):
-            print_verbose("CSV file does not have enough lines in it", verbose)
-            return False
+    if station_count * components != (
+        count_lines(os.path.join(output_dir, csv_file_name)) - 1
+    ):
+        print_verbose("CSV file does not have enough lines in it", verbose)
+        return False
 
     station_dir = os.path.join(output_dir, "stations")
     if os.path.isdir(station_dir) and not observed:
         # If observed then all station files for all events will be present
-        station_files = glob.glob1(station_dir, CSV_PATTERN)
-        if station_count != len(station_files):
+        if station_count != count_files(station_dir, CSV_SUFFIX):
             print_verbose("Not enough files in the station directory", verbose)
             return False
-        sum_csv = sum_csv + station_files
 
-    meta = glob.glob1(output_dir, META_PATTERN)
-    # if sum_csv and meta are not empty lists('.csv' and '_imcalc.info' files present)
+    # if sum_csv and meta are not empty ('.csv' and '_imcalc.info' files present)
     # then we think im calc on the corresponding dir is completed and hence remove
     print_verbose("Checking csv and meta files exist", verbose)
-    return sum_csv != [] and meta != []
+    return count_files(output_dir, META_SUFFIX) > 0
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
-        "run_dir", type=str, help="The path to the realisation directory"
+        "run_dirs",
+        type=str,
+        nargs="+",
+        help="The path to the realisation directory. Multiple directories with the "
+        "same station count and components can be given",
     )
     parser.add_argument(
         "station_count", type=int, help="The number of stations in the realisation"
@@ -129,23 +172,33 @@ if __name__ == "__main__":
             "If the event was observed the name of the event must be specified"
         )
 
-    res = check_im_calc_completion(
-        args.run_dir,
-        args.station_count,
-        args.components,
-        args.verbose,
-        args.observed,
-        args.event_name,
-    )
-    if res:
-        print_verbose(
-            "{} passed".format(args.event_name if args.event_name else args.run_dir),
+    failed = []
+    for run_dir in args.run_dirs:
+        res = check_im_calc_completion(
+            run_dir,
+            args.station_count,
+            args.components,
             args.verbose,
+            args.observed,
+            args.event_name,
         )
-        sys.exit(0)
-    else:
+        if res:
+            print_verbose(
+                "{} passed".format(args.event_name if args.event_name else run_dir),
+                args.verbose,
+            )
+        else:
+            print_verbose(
+                "{} failed".format(args.event_name if args.event_name else run_dir),
+                args.verbose,
+            )
+            failed.append(run_dir)
+
+    if len(args.run_dirs) > 1:
         print_verbose(
-            "{} failed".format(args.event_name if args.event_name else args.run_dir),
+            "{} of {} passed".format(
+                len(args.run_dirs) - len(failed), len(args.run_dirs)
+            ),
             args.verbose,
         )
-        sys.exit(1)
+    sys.exit(1 if failed else 0)
@@ -2,13 +2,117 @@
 
 import sys
 import argparse
+import csv
+import zlib
 import numpy as np
 
 from qcore.timeseries import BBSeis
 from qcore.timeseries import HFSeis
+from workflow.calculation import station_stats
 
 # the ratio of allowed zero's before being flagged as failed, 0.01 = 1%
 ZERO_COUNT_THRESHOLD = 0.01
+# the memory (MB) used for the waveform checks
+DEFAULT_MEMORY_BUDGET = 256
+# bytes of memory per sample used by the checks, the float32 sample and two masks
+BYTES_PER_SAMPLE = 6
+N_COMP = 3
+
+REPORT_DTYPE = [
+    ("name", "U8"),
+    ("max_zero_ratio", "f4"),
+    ("n_non_finite", "i8"),
+    ("n_all_zero_comps", "i4"),
+    ("checksum_ok", "?"),
+    ("failed", "?"),
+]
+
+
+def load_waveform_data(bin, bin_path):
+    """
+    Memory maps the waveform block of a HF or BB binary, (nstat, nt, N_COMP) float32
+    """
+    nstat = bin.stations.size
+    # the header starts with nstat, which gives the endianness of the file
+    endian = "<" if np.fromfile(bin_path, dtype="<i4", count=1)[0] == nstat else ">"
+    return np.memmap(
+        bin_path,
+        dtype=f"{endian}f4",
+        mode="r",
+        offset=bin.HEAD_SIZE + nstat * bin.HEAD_STAT,
+        shape=(nstat, bin.nt, N_COMP),
+    )
+
+
+def check_waveforms(
+    data,
+    station_names,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    threshold=ZERO_COUNT_THRESHOLD,
+    stats=None,
+):
+    """
+    Checks the waveforms of every station for zeros (aka results have not been written),
+    NaN / inf values and all zero components.
+    Leading and trailing zeros are not counted as there may be some time at the start
+    before the waveform starts.
+    Stations are checked in chunks of at most memory_budget MB.
+
+    :param data: (nstat, nt, N_COMP) waveforms, usually a memmap of the binary
+    :param station_names: The names of the stations
+    :param stats: The station records of the sidecar index, the checksums of the
+        waveforms are compared to them if given
+    :return: A record array with the zero ratio (max over the components),
+        number of non finite values, number of all zero components
+        and whether the checks failed for each station
+    """
+    nstat, nt, n_comp = data.shape
+    report = np.zeros(nstat, dtype=REPORT_DTYPE)
+    report["name"] = station_names
+    report["checksum_ok"] = True
+    chunk_size = max(
+        1, int(memory_budget * 1024**2 // (nt * n_comp * BYTES_PER_SAMPLE))
+    )
+
+    for start in range(0, nstat, chunk_size):
+        chunk = np.asarray(data[start : start + chunk_size])
+        cur_report = report[start : start + chunk_size]
+
+        cur_report["n_non_finite"] = np.count_nonzero(~np.isfinite(chunk), axis=(1, 2))
+
+        nonzero = chunk != 0
+        # (stations, components)
+        any_nonzero = nonzero.any(axis=1)
+        first = np.argmax(nonzero, axis=1)
+        last = nt - np.argmax(nonzero[:, ::-1], axis=1)
+        trimmed_size = np.where(any_nonzero, last - first, 1)
+        n_zeros = trimmed_size - np.count_nonzero(nonzero, axis=1)
+        zero_ratio = np.where(any_nonzero, n_zeros / trimmed_size, 1.0)
+
+        cur_report["max_zero_ratio"] = zero_ratio.max(axis=1)
+        cur_report["n_all_zero_comps"] = np.count_nonzero(~any_nonzero, axis=1)
+
+        if stats is not None:
+            cur_report["checksum_ok"] = [
+                zlib.crc32(station.data) == record["crc32"]
+                for station, record in zip(chunk, stats[start : start + chunk_size])
+            ]
+
+    report["failed"] = (
+        (report["max_zero_ratio"] > threshold)
+        | (report["n_non_finite"] > 0)
+        | (report["n_all_zero_comps"] > 0)
+        | ~report["checksum_ok"]
+    )
+    return report.view(np.recarray)
+
+
+def write_report(report, report_path):
+    with open(report_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(report.dtype.names)
+        writer.writerows(report.tolist())
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -18,6 +122,25 @@ if __name__ == "__main__":
         "process_type", type=str, choices=["bb", "hf"], help="Either bb or hf"
     )
     parser.add_argument("--verbose", action="store_true", default=False)
+    parser.add_argument(
+        "--memory_budget",
+        type=float,
+        default=DEFAULT_MEMORY_BUDGET,
+        help="Memory (MB) used for checking the waveforms",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="Path to save the csv report of the checks of each station to",
+    )
+    parser.add_argument(
+        "--stats_only",
+        action="store_true",
+        default=False,
+        help="Only check the per station statistics of the sidecar index (<bin>.stats) "
+        "written by hf_sim / bb_sim, without reading the waveforms",
+    )
 
     args = parser.parse_args()
 
@@ -66,32 +189,66 @@ if __name__ == "__main__":
             print("Some vs == 0, {} incomplete".format(args.process_type))
         sys.exit(1)
 
-    # binary zero check
-    # Checks 10 random stations for any occurances of 0 in the output (aka results have not been written)
-    # Removes leading 0s from the test as there may be some time at the start before the waveform starts.
-    for stat_name in np.random.choice(
-        bin.stations.name, replace=False, size=min(10, bin.stations.shape[0])
-    ):
-        acc = bin.acc(stat_name)
-        for comp in acc.T:
-            # trim leading and trailing zeros
-            comp_trimmed = np.trim_zeros(comp)
-            if comp_trimmed.size == 0:
-                if args.verbose:
+    stats = station_stats.load(
+        station_stats.get_stats_path(args.bin), bin.stations.size
+    )
+    if args.stats_only:
+        if stats is None:
+            if args.verbose:
+                print(
+                    "No valid station statistics found for {}, {} failed".format(
+                        args.bin, args.process_type
+                    )
+                )
+            sys.exit(1)
+        failed, messages = station_stats.check(stats, bin.stations.name)
+        if failed.size > 0:
+            if args.verbose:
+                print("\n".join(messages))
+                print(
+                    f"{failed.size} of {stats.size} stations failed, {args.process_type} failed"
+                )
+            sys.exit(1)
+        if args.verbose:
+            print("{} passed".format(args.process_type))
+        sys.exit(0)
+
+    # binary zero check of every station
+    try:
+        data = load_waveform_data(bin, args.bin)
+    except ValueError as ex:
+        if args.verbose:
+            print("Cannot map the waveforms of {} {}".format(args.bin, ex))
+        sys.exit(1)
+    report = check_waveforms(data, bin.stations.name, args.memory_budget, stats=stats)
+    if args.report is not None:
+        write_report(report, args.report)
+
+    failed = report[report.failed]
+    if failed.size > 0:
+        if args.verbose:
+            for station in failed:
+                if not station.checksum_ok:
                     print(
-                        f" The waveform for station {stat_name} contains all zeros, please investigate."
+                        f"The waveform for station {station.name} does not match its checksum, please investigate."
                     )
-                sys.exit(1)
-            ratio_zeros = (
-                comp_trimmed.size - np.count_nonzero(comp_trimmed)
-            ) / comp_trimmed.size
-            if ratio_zeros > ZERO_COUNT_THRESHOLD:
-                if args.verbose:
+                elif station.n_all_zero_comps > 0:
                     print(
-                        f"The waveform for station {stat_name} contains {ratio_zeros} zeros, more than {ZERO_COUNT_THRESHOLD}, please investigate. This "
+                        f" The waveform for station {station.name} contains all zeros, please investigate."
+                    )
+                elif station.n_non_finite > 0:
+                    print(
+                        f"The waveform for station {station.name} contains {station.n_non_finite} NaN or inf values, please investigate."
+                    )
+                else:
+                    print(
+                        f"The waveform for station {station.name} contains {station.max_zero_ratio} zeros, more than {ZERO_COUNT_THRESHOLD}, please investigate. This "
                         f"is most likely due to crashes during HF or BB resulting in no written output."
                     )
-                sys.exit(1)
+            print(
+                f"{failed.size} of {report.size} stations failed, {args.process_type} failed"
+            )
+        sys.exit(1)
 
     # pass both check
     if args.verbose:
@@ -1,14 +1,27 @@
 """Script to check that the LF seis files can be read.
-Also checks a random (unless specified otherwise) station velocities for zeros,
-which indicates a dual access issue (occurss when two EMOD3D processes for the
-same sim run at the same time)
+Also checks the station velocities of all seis files for zeros, which indicates a
+dual access issue (occurss when two EMOD3D processes for the same sim run at the
+same time)
 """
 
 import argparse
+import csv
+import os
+from multiprocessing import Pool
+
 import numpy as np
 
 from qcore.timeseries import LFSeis
 
+# velocity components, the first of the components of each station in the seis files
+VEL_COMPONENTS = ["x", "y", "z"]
+# the memory (MB) used by each worker
+DEFAULT_MEMORY_BUDGET = 256
+# bytes of memory per sample used by the zero run check, the zero mask and
+# the int64 temporaries of the run lengths
+BYTES_PER_SAMPLE = 32
+REPORT_HEADER = ["station", "component", "n_zeros", "longest_zero_run", "first_zero"]
+
 
 def lf_zero_check(lf_data: LFSeis, station_ix: int = None):
     """
@@ -35,6 +48,163 @@ def lf_zero_check(lf_data: LFSeis, station_ix: int = None):
     return True
 
 
+def load_seis_data(seis_file: str, nt: int):
+    """
+    Memory maps the station data of a seis file, (nt, nstat, N_COMP) float32
+
+    Raises
+    ------
+    ValueError if the file size doesn't match its number of stations
+    """
+    file_size = os.stat(seis_file).st_size
+    for endian in "<>":
+        nstat = int(np.fromfile(seis_file, dtype=f"{endian}i4", count=1)[0])
+        head_total = 4 + nstat * LFSeis.HEAD_STAT
+        if nstat > 0 and file_size == head_total + nstat * nt * LFSeis.N_COMP * 4:
+            return np.memmap(
+                seis_file,
+                dtype=f"{endian}f4",
+                mode="r",
+                offset=head_total,
+                shape=(nt, nstat, LFSeis.N_COMP),
+            )
+    raise ValueError(f"The size of {seis_file} doesn't match its number of stations")
+
+
+def seis_zero_runs(data: np.ndarray, memory_budget: float = DEFAULT_MEMORY_BUDGET):
+    """
+    Finds the zeros in the velocities of every station of a seis file.
+    The timesteps are read in chunks of at most memory_budget MB.
+
+    Parameters
+    ----------
+    data: (nt, nstat, N_COMP) station data of a seis file
+    memory_budget: Memory (MB) to use
+
+    Returns
+    -------
+    The number of zeros, longest run of zeros and index of the first zero,
+    each (nstat, len(VEL_COMPONENTS)). The first zero is -1 for no zeros
+    """
+    nt, nstat, _ = data.shape
+    n_comp = len(VEL_COMPONENTS)
+    chunk_size = max(
+        1, int(memory_budget * 1024**2 // (nstat * n_comp * BYTES_PER_SAMPLE))
+    )
+
+    n_zeros = np.zeros((nstat, n_comp), dtype=int)
+    longest_run = np.zeros((nstat, n_comp), dtype=int)
+    first_zero = np.full((nstat, n_comp), -1)
+    # index of the last nonzero velocity, carried over the chunks
+    last_nonzero = np.full((nstat, n_comp), -1)
+
+    for start in range(0, nt, chunk_size):
+        zeros = data[start : start + chunk_size, :, :n_comp] == 0
+        end = start + zeros.shape[0]
+        if not zeros.any():
+            last_nonzero[:] = end - 1
+            continue
+
+        time_ix = np.arange(start, end)[:, None, None]
+        n_zeros += np.count_nonzero(zeros, axis=0)
+        new_first = np.where(zeros.any(axis=0), start + np.argmax(zeros, axis=0), -1)
+        first_zero = np.where(first_zero < 0, new_first, first_zero)
+        # the run length at each zero is the distance to the last nonzero value
+        chunk_last_nonzero = np.maximum.accumulate(np.where(zeros, -1, time_ix), axis=0)
+        chunk_last_nonzero = np.maximum(chunk_last_nonzero, last_nonzero)
+        longest_run = np.maximum(
+            longest_run,
+            np.max(np.where(zeros, time_ix - chunk_last_nonzero, 0), axis=0),
+        )
+        last_nonzero = chunk_last_nonzero[-1]
+
+    return n_zeros, longest_run, first_zero
+
+
+def check_seis_files(seis_files, nt: int, memory_budget: float = DEFAULT_MEMORY_BUDGET):
+    """
+    Checks a group of seis files for zeros, run by each worker
+
+    Returns
+    -------
+    A list of (seis file, number of stations, zero results as given by seis_zero_runs)
+    or (seis file, None, error message) for files that can't be read
+    """
+    results = []
+    for seis_file in seis_files:
+        try:
+            data = load_seis_data(seis_file, nt)
+        except (OSError, ValueError) as ex:
+            results.append((seis_file, None, str(ex)))
+        else:
+            results.append(
+                (seis_file, data.shape[1], seis_zero_runs(data, memory_budget))
+            )
+    return results
+
+
+def lf_zero_check_all(
+    lf_data: LFSeis,
+    n_procs: int = 1,
+    memory_budget: float = DEFAULT_MEMORY_BUDGET,
+    max_zero_run: int = 0,
+):
+    """
+    Checks the velocities of all stations of all seis files for zeros,
+    the seis files are split in groups over n_procs workers
+
+    Parameters
+    ----------
+    lf_data: The LF data of the OutBin directory
+    n_procs: Number of workers
+    memory_budget: Memory (MB) used by each worker
+    max_zero_run: The longest run of zeros allowed for a station velocity
+
+    Returns
+    -------
+    The rows of the report for the failed station components (see REPORT_HEADER)
+    and the error messages of files that can't be read
+    """
+    n_procs = max(1, min(n_procs, len(lf_data.seis)))
+    groups = [
+        group for group in np.array_split(lf_data.seis, n_procs) if group.size > 0
+    ]
+    with Pool(n_procs) as pool:
+        results = pool.starmap(
+            check_seis_files, [(group, lf_data.nt, memory_budget) for group in groups]
+        )
+
+    rows, errors = [], []
+    # stations are in the order of the seis files, fall back to the file and index
+    # within the file if the station counts don't match
+    names = lf_data.stations.name
+    n_file_stations = [result[1] or 0 for group in results for result in group]
+    use_names = sum(n_file_stations) == len(names)
+    offset = 0
+    for seis_file, nstat, result in (result for group in results for result in group):
+        if nstat is None:
+            errors.append(f"{seis_file}: {result}")
+            continue
+        n_zeros, longest_run, first_zero = result
+        for station_ix, comp_ix in zip(*np.nonzero(longest_run > max_zero_run)):
+            name = (
+                names[offset + station_ix]
+                if use_names
+                else f"{os.path.basename(seis_file)}:{station_ix}"
+            )
+            rows.append(
+                [
+                    name,
+                    VEL_COMPONENTS[comp_ix],
+                    n_zeros[station_ix, comp_ix],
+                    longest_run[station_ix, comp_ix],
+                    first_zero[station_ix, comp_ix],
+                ]
+            )
+        offset += nstat
+    return rows, errors
+
+
 def main(args):
     try:
         lf_data = LFSeis(args.outbin)
@@ -45,13 +215,59 @@ def main(args):
             )
         )
         return False
-    else:
-        return lf_zero_check(lf_data)
+
+    rows, errors = lf_zero_check_all(
+        lf_data, args.n_procs, args.memory_budget, args.max_zero_run
+    )
+    if args.report is not None:
+        with open(args.report, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_HEADER)
+            writer.writerows(rows)
+
+    for error in errors:
+        print("Cannot read the seis file {}".format(error))
+    if len(rows) > 0:
+        failed_stations = sorted({row[0] for row in rows})
+        print(
+            "The velocities of {} stations contain zero/s ({}), please investigate. "
+            "This is most likely due to file access issues (such as several EMOD3D "
+            "instances for the same sim).".format(
+                len(failed_stations),
+                ", ".join(map(str, failed_stations[:10]))
+                + (", ..." if len(failed_stations) > 10 else ""),
+            )
+        )
+    return len(rows) == 0 and len(errors) == 0
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("outbin", type=str, help="The OutBin directory to test")
+    parser.add_argument(
+        "--n_procs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of workers, each checks a group of the seis files",
+    )
+    parser.add_argument(
+        "--memory_budget",
+        type=float,
+        default=DEFAULT_MEMORY_BUDGET,
+        help="Memory (MB) used by each worker",
+    )
+    parser.add_argument(
+        "--max_zero_run",
+        type=int,
+        default=0,
+        help="The longest run of zeros allowed in a station velocity",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="Path to save the csv report of the station velocities with zeros to",
+    )
     args = parser.parse_args()
 
     if main(args):
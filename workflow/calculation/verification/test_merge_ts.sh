@@ -16,7 +16,7 @@ then
     exit 1
 fi
 
-python $gmsim/workflow/workflow/calculation/verification/test_xyts.py $xyts_file
+python $gmsim/workflow/workflow/calculation/verification/test_xyts.py $xyts_file --component_dir $lf_sim_dir/OutBin
 if [[ $? != 0 ]];
 then
     echo "$xyts_file test has failed"
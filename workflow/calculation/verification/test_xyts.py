@@ -1,43 +1,197 @@
 import argparse
+import os
+from glob import glob
 from os.path import abspath
 from sys import stderr
 
+import numpy as np
+
 from qcore.xyts import XYTSFile
 
+# x0, y0, z0, t0, nx, ny, nz, nt as i4 then dx, dy, hh, dt, mrot, mlat, mlon as f4
+HEADER_SIZE = 60
+# the header of the (unmerged) component files written by each EMOD3D process
+PROC_HEADER_SIZE = 72
+N_COMP = 3
+COMPONENT_GLOB = "*xyts-*.e3d"
+# the memory (MB) used for computing the PGV
+DEFAULT_MEMORY_BUDGET = 512
+# bytes of memory per grid point and timestep, the float32 components and
+# the float32 squared velocity
+BYTES_PER_POINT = (N_COMP + 1) * 4
+
+
+def read_header(file_path: str):
+    """Reads the header of a merged xyts file, as (i4 values, f4 values, endian)"""
+    for endian in "<>":
+        i4 = np.fromfile(file_path, dtype=f"{endian}i4", count=8)
+        f4 = np.fromfile(file_path, dtype=f"{endian}f4", count=15)[8:]
+        # nx, ny and nt are small positive numbers in the right byte order
+        dims = i4[[4, 5, 7]]
+        if np.all((0 < dims) & (dims < 2**24)):
+            return i4, f4, endian
+    raise ValueError("Invalid xyts header in {}".format(file_path))
+
 
 def check_xyts_file(file_path: str):
     """Opens the given file and attempts to extract information from it"""
-    xyts_file = XYTSFile(file_path)
+    xyts_file = XYTSFile(file_path, meta_only=True)
     corners, gmt_corners = xyts_file.corners(True)
     xyts_file.region(corners)
-    xyts_file.tslice_get(0)
-    xyts_file.pgv(True)
     return True
 
 
-def check_zero_bytes(file_path: str):
+def check_size(file_path: str):
+    """Checks the file size matches the dimensions in the header"""
+    i4, _, _ = read_header(file_path)
+    nx, ny, nt = i4[4], i4[5], i4[7]
+    expected_size = HEADER_SIZE + int(nt) * N_COMP * int(ny) * int(nx) * 4
+    actual_size = os.stat(file_path).st_size
+    if actual_size != expected_size:
+        print(
+            "The size of {} is {}, expected {} for nx={} ny={} nt={}".format(
+                file_path, actual_size, expected_size, nx, ny, nt
+            )
+        )
+        return False
+    return True
+
+
+def check_components(file_path: str, component_dir: str):
+    """Checks the header and size of the merged file against the component files
+    it was merged from"""
+    component_files = glob(os.path.join(component_dir, COMPONENT_GLOB))
+    if len(component_files) == 0:
+        print("No component xyts files found in {}, skipping".format(component_dir))
+        return True
+
+    i4, f4, _ = read_header(file_path)
+    nx, ny, nt = i4[4], i4[5], i4[7]
+    success = True
+    n_points = 0
+    for component_file in component_files:
+        component = XYTSFile(
+            component_file, proc_local_file=True, meta_only=True, round_dt=False
+        )
+        mismatched = [
+            name
+            for name, merged, value in [
+                ("nx", nx, component.nx),
+                ("ny", ny, component.ny),
+                ("nt", nt, component.nt),
+                ("dx", f4[0], component.dx),
+                ("dy", f4[1], component.dy),
+                ("hh", f4[2], component.hh),
+                ("dt", f4[3], component.dt),
+                ("mrot", f4[4], component.mrot),
+                ("mlat", f4[5], component.mlat),
+                ("mlon", f4[6], component.mlon),
+            ]
+            if merged != value
+        ]
+        if len(mismatched) > 0:
+            print(
+                "The header of {} does not match the merged file for {}".format(
+                    component_file, ", ".join(mismatched)
+                )
+            )
+            success = False
+
+        local_points = int(component.local_nx) * int(component.local_ny)
+        expected_size = PROC_HEADER_SIZE + int(component.nt) * N_COMP * local_points * 4
+        if os.stat(component_file).st_size != expected_size:
+            print(
+                "The size of {} is {}, expected {}".format(
+                    component_file, os.stat(component_file).st_size, expected_size
+                )
+            )
+            success = False
+        n_points += local_points
+
+    if n_points != nx * ny:
+        print(
+            "The component files cover {} grid points, the merged file has {}".format(
+                n_points, nx * ny
+            )
+        )
+        success = False
+    return success
+
+
+def compute_pgv(file_path: str, memory_budget: float = DEFAULT_MEMORY_BUDGET):
+    """Computes the PGV of every grid point in a single pass over the timesteps,
+    reading chunks of at most memory_budget MB. Returns the (ny, nx) PGV"""
+    i4, _, endian = read_header(file_path)
+    nx, ny, nt = i4[4], i4[5], i4[7]
+    data = np.memmap(
+        file_path,
+        dtype=f"{endian}f4",
+        mode="r",
+        offset=HEADER_SIZE,
+        shape=(nt, N_COMP, ny, nx),
+    )
+    chunk_size = max(1, int(memory_budget * 1024**2 // (ny * nx * BYTES_PER_POINT)))
+
+    # the peak of the squared velocity, sqrt is only taken once at the end
+    pgv_sq = np.zeros((ny, nx), dtype=np.float32)
+    for start in range(0, nt, chunk_size):
+        chunk = np.asarray(data[start : start + chunk_size])
+        # NaN are propagated, so they can be found after
+        np.maximum(
+            pgv_sq, np.einsum("tcyx,tcyx->tyx", chunk, chunk).max(axis=0), out=pgv_sq
+        )
+    return np.sqrt(pgv_sq)
+
+
+def check_zero_bytes(pgv: np.ndarray):
     """Checks that all PGV values are above zero"""
-    xyts_file = XYTSFile(file_path)
-    pgv = xyts_file.pgv()[:, 2]
-    return min(pgv) > 0
+    if np.isnan(pgv).any():
+        print("{} PGV values are NaN".format(np.count_nonzero(np.isnan(pgv))))
+        return False
+    n_zeros = np.count_nonzero(pgv <= 0)
+    if n_zeros > 0:
+        print("{} PGV values are zero".format(n_zeros))
+        return False
+    return True
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("xyts_file", type=str, help="The merged xyts file to test")
+    parser.add_argument(
+        "--component_dir",
+        type=str,
+        default=None,
+        help="Directory of the component xyts files, the merged file is checked "
+        "against their headers and sizes",
+    )
+    parser.add_argument(
+        "--memory_budget",
+        type=float,
+        default=DEFAULT_MEMORY_BUDGET,
+        help="Memory (MB) used for computing the PGV",
+    )
     args = parser.parse_args()
     file_path = abspath(args.xyts_file)
     try:
-        if check_xyts_file(file_path) and check_zero_bytes(file_path):
+        if (
+            check_xyts_file(file_path)
+            and check_size(file_path)
+            and (
+                args.component_dir is None
+                or check_components(file_path, args.component_dir)
+            )
+            and check_zero_bytes(compute_pgv(file_path, args.memory_budget))
+        ):
             return True
     except Exception as e:
         print(e, file=stderr)
-        print(
-            "Attempt to open and extract information from xyts file {} failed".format(
-                file_path
-            )
+    print(
+        "Attempt to open and extract information from xyts file {} failed".format(
+            file_path
         )
-        return False
+    )
+    return False
 
 
 if __name__ == "__main__":